@@ -0,0 +1,384 @@
+"""
+EPG Exporter Lambda Function
+
+Exports the schedule of every channel to S3 as an XMLTV and a JSON EPG, for
+downstream platforms to poll. Runs on a schedule, and whenever the MediaTailor
+function schedules or updates a program.
+
+The schedule of each channel is cached as a snapshot next to its EPG files
+(``fast_common.epg``). A scheduled run compares the item on air with the
+snapshot in one ``GetChannelSchedule`` call, and only pages the schedule again
+when they disagree or when the snapshot no longer covers the horizon. A
+changed program is described and merged into the snapshot when it kept its
+slot or was appended after the last item. Other changes page the schedule
+again, unless it was paged moments ago: a burst of changes, such as a bulk
+ingest, is then marked pending and paged once by the next export. Program metadata is fetched only for VOD sources that are
+new, changed or stale, and EPG files are only rewritten when their content
+changes, so partners polling them see stable ETags.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from fast_common.clients import get_client
+from fast_common.epg import (
+    SCHEDULE_CHANGED_DETAIL_TYPE,
+    START_TOLERANCE_SECONDS,
+    build_programs,
+    extend_loop,
+    get_covered_until,
+    get_digest,
+    get_end,
+    get_loop_seconds,
+    get_metadata,
+    get_start,
+    matches_head,
+    render_json,
+    render_xmltv,
+    to_item,
+    trim_items,
+)
+from fast_common.governor import is_not_found
+from fast_common.logs import as_json
+from fast_common.metrics import emit_api_metrics
+from fast_common.tracing import format_timestamp, parse_timestamp
+
+# Configure logging
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
+
+DEFAULT_HORIZON_HOURS = 24
+
+# Programs that already ended stay in the EPG for this long
+LOOKBACK = timedelta(hours=2)
+
+# A snapshot is paged again at least this often, to catch changes made
+# outside the pipeline that have not reached the item on air yet
+MAX_SNAPSHOT_AGE = timedelta(hours=1)
+
+# Changes within this long of the last paging are left for the next export
+COALESCE_WINDOW = timedelta(seconds=30)
+
+# Program metadata is fetched again after this long, to catch tag edits
+METADATA_TTL = timedelta(hours=6)
+
+# Maximum number of channels and VOD sources processed in parallel
+MAX_CONCURRENCY = 8
+
+# Browsers and CDNs in front of the bucket may cache EPG files this long
+CACHE_CONTROL = "max-age=60"
+
+EPG_FILES = {
+    "epg.xml": (render_xmltv, "application/xml"),
+    "epg.json": (render_json, "application/json"),
+}
+
+
+def get_channel_names() -> list[str]:
+    """Return the channels to export, from ``EpgChannelNames``."""
+    return [name for name in os.environ.get("EpgChannelNames", "").split(",") if name]
+
+
+def get_horizon() -> timedelta:
+    """Return how far ahead the EPG lists programs, from ``EpgHorizonHours``."""
+    hours = float(os.environ.get("EpgHorizonHours", DEFAULT_HORIZON_HOURS))
+    if hours <= 0:
+        raise ValueError(f"Invalid EpgHorizonHours: {hours}. Must be positive")
+    return timedelta(hours=hours)
+
+
+def get_epg_key(channel_name: str, name: str) -> str:
+    """Return the S3 key of a channel's EPG file or snapshot."""
+    return f"{os.environ.get('EpgPrefix', 'epg/')}{channel_name}/{name}"
+
+
+def read_snapshot(channel_name: str) -> dict[str, Any]:
+    """Return the cached schedule snapshot of a channel, or an empty one."""
+    s3 = get_client("s3")
+    try:
+        body = s3.get_object(
+            Bucket=os.environ["EpgBucket"], Key=get_epg_key(channel_name, "snapshot.json")
+        )["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return {}
+    return json.loads(body)
+
+
+def write_snapshot(channel_name: str, snapshot: dict[str, Any]) -> None:
+    """Cache the schedule snapshot of a channel."""
+    get_client("s3").put_object(
+        Bucket=os.environ["EpgBucket"],
+        Key=get_epg_key(channel_name, "snapshot.json"),
+        Body=json.dumps(snapshot).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def fetch_schedule(channel_name: str, duration: timedelta) -> list[dict[str, Any]]:
+    """Page the schedule of a channel from now for ``duration``."""
+    paginator = get_client("mediatailor").get_paginator("get_channel_schedule")
+    items = []
+    for page in paginator.paginate(
+        ChannelName=channel_name,
+        DurationMinutes=str(math.ceil(duration.total_seconds() / 60)),
+    ):
+        items.extend(to_item(entry) for entry in page.get("Items", []))
+    return items
+
+
+def merge_program(channel_name: str, items: list[dict[str, Any]], program_name: str) -> bool:
+    """
+    Merge a changed program into the schedule items without paging the schedule.
+
+    Only a program that kept its start and duration, or that starts after the
+    last item, can be merged: anything else moves the items after it. Returns
+    whether the program was merged.
+    """
+    try:
+        program = get_client("mediatailor").describe_program(
+            ChannelName=channel_name, ProgramName=program_name
+        )
+    except Exception as error:
+        if is_not_found(error):
+            return False
+        raise
+    if not program.get("ScheduledStartTime"):
+        return False
+
+    item = to_item({
+        "ProgramName": program_name,
+        "VodSourceName": program.get("VodSourceName", ""),
+        "SourceLocationName": program.get("SourceLocationName", ""),
+        "ApproximateStartTime": program["ScheduledStartTime"],
+        "ApproximateDurationSeconds": program.get("DurationMillis", 0) / 1000,
+    })
+    for existing in items:
+        if existing["ProgramName"] == program_name:
+            return (
+                abs((get_start(existing) - get_start(item)).total_seconds())
+                <= START_TOLERANCE_SECONDS
+                and abs(existing["DurationSeconds"] - item["DurationSeconds"])
+                <= START_TOLERANCE_SECONDS
+            )
+    if items and get_start(item) >= get_covered_until(items) - timedelta(
+        seconds=START_TOLERANCE_SECONDS
+    ):
+        items.append(item)
+        return True
+    return False
+
+
+def refresh_schedule(
+    channel_name: str,
+    snapshot: dict[str, Any],
+    now: datetime,
+    changed_program: str | None = None,
+) -> str:
+    """
+    Bring the schedule items of a snapshot up to date, calling MediaTailor as little as possible.
+
+    ``changed_program`` is the program of a Channel Schedule Changed event,
+    or an empty string when the event names none. Returns how the items were
+    refreshed: ``cached`` when the snapshot already covered the horizon,
+    ``extended`` when a LOOP schedule was repeated forward, ``merged`` when
+    the changed program was merged in, ``deferred`` when the change was left
+    for the next export, or ``paged`` when the schedule was read from MediaTailor.
+    """
+    until = now + get_horizon()
+    items = trim_items(snapshot.get("Items", []), now - LOOKBACK)
+    refreshed_at = parse_timestamp(snapshot["RefreshedAt"]) if snapshot.get("RefreshedAt") else None
+    mediatailor = get_client("mediatailor")
+
+    force = bool(snapshot.get("PendingChanges"))
+    if changed_program is not None:
+        if changed_program and items and merge_program(channel_name, items, changed_program):
+            snapshot["Items"] = items
+            return "merged"
+        if refreshed_at and now - refreshed_at < COALESCE_WINDOW:
+            logger.info("Schedule of %s was paged moments ago, deferring the change", channel_name)
+            snapshot["Items"] = items
+            snapshot["PendingChanges"] = True
+            return "deferred"
+        force = True
+
+    if items and not force and refreshed_at and now - refreshed_at < MAX_SNAPSHOT_AGE:
+        head = mediatailor.get_channel_schedule(
+            ChannelName=channel_name,
+            DurationMinutes="1",
+            MaxResults=1,
+        ).get("Items", [])
+        if head and matches_head(items, head[0]):
+            if get_covered_until(items) >= until:
+                snapshot["Items"] = items
+                return "cached"
+            if snapshot.get("LoopSeconds"):
+                snapshot["Items"] = extend_loop(items, snapshot["LoopSeconds"], until)
+                return "extended"
+        else:
+            logger.info("Schedule of %s changed on air, paging it again", channel_name)
+
+    if "PlaybackMode" not in snapshot:
+        snapshot["PlaybackMode"] = mediatailor.describe_channel(
+            ChannelName=channel_name
+        ).get("PlaybackMode", "LOOP")
+
+    fetched = fetch_schedule(channel_name, until - now)
+    # Keep the programs that already ended, which a new page no longer lists
+    if fetched:
+        first_start = get_start(fetched[0]) + timedelta(seconds=START_TOLERANCE_SECONDS)
+        items = [item for item in items if get_end(item) <= first_start]
+    snapshot["Items"] = items + fetched
+    snapshot["LoopSeconds"] = (
+        get_loop_seconds(fetched) if snapshot["PlaybackMode"] == "LOOP" else None
+    )
+    snapshot["RefreshedAt"] = format_timestamp(now)
+    snapshot.pop("PendingChanges", None)
+    return "paged"
+
+
+def fetch_metadata(source_location: str, vod_source_name: str) -> dict[str, str]:
+    """Return the program metadata of a VOD source and the asset it was created from."""
+    tags: dict[str, str] = {}
+
+    # VOD sources are named after their MediaPackage asset
+    mediapackage_vod = get_client("mediapackage-vod")
+    try:
+        tags.update(mediapackage_vod.describe_asset(Id=vod_source_name).get("Tags", {}))
+    except mediapackage_vod.exceptions.NotFoundException:
+        logger.debug("No MediaPackage asset %s", vod_source_name)
+
+    vod_source = get_client("mediatailor").describe_vod_source(
+        SourceLocationName=source_location,
+        VodSourceName=vod_source_name,
+    )
+    tags.update(vod_source.get("Tags", {}))
+    return get_metadata(tags)
+
+
+def refresh_metadata(snapshot: dict[str, Any], now: datetime, changed: set[str]) -> int:
+    """
+    Fetch the metadata of VOD sources that are new, changed or stale.
+
+    Failures are logged and the previous metadata is kept, so a missing tag
+    never holds back the EPG. Returns the number of VOD sources fetched.
+    """
+    cached = snapshot.get("Sources", {})
+    locations = {
+        item["VodSourceName"]: item["SourceLocationName"]
+        for item in snapshot["Items"]
+        if item["VodSourceName"]
+    }
+    sources = {name: cached[name] for name in locations if name in cached}
+    stale = [
+        name
+        for name in locations
+        if name not in sources
+        or name in changed
+        or now - parse_timestamp(sources[name]["FetchedAt"]) >= METADATA_TTL
+    ]
+
+    def fetch(name: str) -> None:
+        try:
+            sources[name] = {
+                "Metadata": fetch_metadata(locations[name], name),
+                "FetchedAt": format_timestamp(now),
+            }
+        except Exception as error:
+            logger.warning("Failed to fetch metadata of %s: %s", name, error)
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=min(len(stale), MAX_CONCURRENCY)) as executor:
+            list(executor.map(fetch, stale))
+
+    snapshot["Sources"] = sources
+    return len(stale)
+
+
+def write_epg(channel_name: str, snapshot: dict[str, Any], now: datetime) -> list[str]:
+    """Write the EPG files of a channel whose content changed, returning their keys."""
+    programs = build_programs(
+        snapshot["Items"], snapshot["Sources"], now - LOOKBACK, now + get_horizon()
+    )
+    digests = snapshot.setdefault("Digests", {})
+    written = []
+
+    for name, (render, content_type) in EPG_FILES.items():
+        body = render(channel_name, programs)
+        digest = get_digest(body)
+        if digests.get(name) == digest:
+            continue
+        key = get_epg_key(channel_name, name)
+        get_client("s3").put_object(
+            Bucket=os.environ["EpgBucket"],
+            Key=key,
+            Body=body,
+            ContentType=content_type,
+            CacheControl=CACHE_CONTROL,
+        )
+        digests[name] = digest
+        written.append(key)
+
+    return written
+
+
+def export_channel(
+    channel_name: str, changed: set[str], changed_program: str | None = None
+) -> dict[str, Any]:
+    """Refresh the snapshot of one channel and write the EPG files that changed."""
+    now = datetime.now(UTC)
+    snapshot = read_snapshot(channel_name)
+    cached = json.dumps(snapshot, sort_keys=True)
+
+    schedule = refresh_schedule(channel_name, snapshot, now, changed_program)
+    fetched = refresh_metadata(snapshot, now, changed)
+    written = write_epg(channel_name, snapshot, now)
+    if json.dumps(snapshot, sort_keys=True) != cached:
+        write_snapshot(channel_name, snapshot)
+
+    result = {
+        "ChannelName": channel_name,
+        "Schedule": schedule,
+        "Items": len(snapshot["Items"]),
+        "MetadataFetched": fetched,
+        "Written": written,
+    }
+    logger.info("Exported EPG: %s", as_json(result))
+    return result
+
+
+@emit_api_metrics
+def lambda_handler(event: dict[str, Any], context: Any) -> dict[str, Any]:
+    """
+    Lambda handler for EPG export.
+
+    Triggered by an EventBridge schedule, which exports every channel, and by
+    Channel Schedule Changed events from the MediaTailor function, which
+    refresh the changed program of one channel.
+    """
+    logger.debug("Received event: %s", as_json(event))
+
+    channel_names = get_channel_names()
+    changed: set[str] = set()
+    changed_program = None
+
+    if event.get("detail-type") == SCHEDULE_CHANGED_DETAIL_TYPE:
+        detail = event["detail"]
+        if detail["channelName"] not in channel_names:
+            logger.info("Channel %s is not exported", detail["channelName"])
+            return {"Channels": []}
+        channel_names = [detail["channelName"]]
+        changed = {detail.get("vodSourceName", "")}
+        changed_program = detail.get("programName", "")
+
+    with ThreadPoolExecutor(max_workers=min(len(channel_names), MAX_CONCURRENCY) or 1) as executor:
+        results = list(
+            executor.map(lambda name: export_channel(name, changed, changed_program), channel_names)
+        )
+
+    return {"Channels": results}
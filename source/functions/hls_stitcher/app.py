@@ -0,0 +1,279 @@
+"""
+HLS Stitcher Lambda Function
+
+Joins the HLS outputs of a title transcoded in chunks (``fast_common.chunking``)
+into one presentation for the MediaPackage function.
+
+Every chunk job that completes is recorded next to its outputs. The
+invocation that records the last chunk claims the stitch with a conditional
+write, so concurrent completions stitch a title once. The media playlists of
+the chunks are joined with discontinuities under the names an unchunked job
+would have written, and a stitch event that mirrors a COMPLETE job state
+change sends the stitched master playlist on to packaging.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from urllib.parse import urlparse
+
+from fast_common.chunking import (
+    CHUNK_COUNT_KEY,
+    CHUNK_DIRECTORY,
+    CHUNK_GROUP_KEY,
+    CHUNK_INDEX_KEY,
+    STITCHED_DETAIL_TYPE,
+)
+from fast_common.clients import get_client
+from fast_common.hls import (
+    get_source_playlist,
+    parse_master_playlist,
+    resolve_uri,
+    stitch_master_playlists,
+    stitch_media_playlists,
+)
+from fast_common.logs import as_json
+from fast_common.metrics import emit_api_metrics
+from fast_common.tracing import CORRELATION_ID_KEY
+
+# Configure logging
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
+
+# Maximum number of playlists read and written in parallel
+MAX_CONCURRENCY = 8
+
+# Conditional write errors that mean another invocation claimed the stitch first
+CLAIMED_ERROR_CODES = ("PreconditionFailed", "ConditionalRequestConflict")
+
+
+def get_group_prefix(master_key: str, group: str) -> tuple[str, str]:
+    """Return the destination a chunk group was written under, and the group's own prefix."""
+    directory = f"{CHUNK_DIRECTORY}{group}/"
+    root = master_key.split(directory, 1)[0]
+    return root, root + directory
+
+
+def read_lines(bucket: str, key: str) -> list[str]:
+    """Read the lines of a playlist from S3."""
+    body = get_client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+    return body.decode("utf-8").splitlines()
+
+
+def write_playlist(bucket: str, key: str, body: str) -> None:
+    """Write a playlist to S3."""
+    get_client("s3").put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=body.encode("utf-8"),
+        ContentType="application/vnd.apple.mpegurl",
+    )
+
+
+def record_chunk(bucket: str, group_prefix: str, detail: dict[str, Any], playlist: str) -> None:
+    """Record a completed chunk job for the invocation that stitches its group."""
+    metadata = detail["userMetadata"]
+    index = int(metadata[CHUNK_INDEX_KEY])
+    output_type = next(
+        (
+            group.get("type", "HLS_GROUP")
+            for group in detail.get("outputGroupDetails", [])
+            if playlist in group.get("playlistFilePaths", [])
+        ),
+        "HLS_GROUP",
+    )
+    get_client("s3").put_object(
+        Bucket=bucket,
+        Key=f"{group_prefix}complete/{index:03d}.json",
+        Body=json.dumps({
+            "Index": index,
+            "JobId": detail.get("jobId", ""),
+            "Queue": detail.get("queue", ""),
+            "Timing": detail.get("timing") or {},
+            "Playlist": playlist,
+            "Type": output_type,
+            "UserMetadata": metadata,
+        }).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def list_completed_chunks(bucket: str, group_prefix: str) -> list[str]:
+    """List the records of the completed chunks of a group."""
+    paginator = get_client("s3").get_paginator("list_objects_v2")
+    keys = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{group_prefix}complete/"):
+        keys.extend(item["Key"] for item in page.get("Contents", []))
+    return sorted(keys)
+
+
+def claim_stitch(bucket: str, group_prefix: str) -> bool:
+    """Claim the stitch of a group, returning False when another invocation holds it."""
+    s3 = get_client("s3")
+    try:
+        s3.put_object(
+            Bucket=bucket,
+            Key=f"{group_prefix}stitched.json",
+            Body=b"{}",
+            ContentType="application/json",
+            IfNoneMatch="*",
+        )
+    except s3.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] in CLAIMED_ERROR_CODES:
+            return False
+        raise
+    return True
+
+
+def release_stitch(bucket: str, group_prefix: str) -> None:
+    """Release a claim after a failed stitch, so a retry can stitch the group."""
+    try:
+        get_client("s3").delete_object(Bucket=bucket, Key=f"{group_prefix}stitched.json")
+    except Exception as error:
+        logger.warning("Failed to release the stitch of %s: %s", group_prefix, error)
+
+
+def stitch_chunks(chunks: list[dict[str, Any]], group: str) -> str:
+    """
+    Write the stitched master and media playlists of a group, returning the master URL.
+
+    The stitched playlists take the names of the first chunk's playlists one
+    directory level up, where an unchunked job writes them, and refer to the
+    segments in place in the chunk directories.
+    """
+    parsed = [urlparse(chunk["Playlist"]) for chunk in chunks]
+    bucket = parsed[0].netloc
+    chunk_masters = [url.path.lstrip("/") for url in parsed]
+    root, _ = get_group_prefix(chunk_masters[0], group)
+    master_key = root + posixpath.basename(chunk_masters[0])
+
+    with ThreadPoolExecutor(max_workers=min(len(chunks), MAX_CONCURRENCY)) as executor:
+        masters = list(executor.map(lambda key: read_lines(bucket, key), chunk_masters))
+
+    master = parse_master_playlist(masters[0])
+    if master["Errors"]:
+        raise ValueError(f"Invalid master playlist {chunk_masters[0]}: {master['Errors']}")
+    uris = [item["Uri"] for item in master["Variants"] + master["Renditions"]]
+
+    def stitch(uri: str) -> None:
+        target = resolve_uri(master_key, uri)
+        if target is None:
+            return
+        sources = [resolve_uri(key, uri) for key in chunk_masters]
+        write_playlist(bucket, target, stitch_media_playlists([
+            (
+                posixpath.relpath(posixpath.dirname(source), posixpath.dirname(target)),
+                read_lines(bucket, source),
+            )
+            for source in sources
+        ]))
+
+    with ThreadPoolExecutor(max_workers=min(len(uris), MAX_CONCURRENCY) or 1) as executor:
+        list(executor.map(stitch, uris))
+
+    # The master is written last, so it never refers to a missing media playlist
+    write_playlist(bucket, master_key, stitch_master_playlists(masters))
+    logger.info("Stitched %d chunks and %d playlists to %s", len(chunks), len(uris), master_key)
+    return f"s3://{bucket}/{master_key}"
+
+
+def get_stitched_timing(chunks: list[dict[str, Any]]) -> dict[str, Any]:
+    """Return the earliest submit and start times and the latest finish time of the chunks."""
+    timing = {}
+    for name, pick in (("submitTime", min), ("startTime", min), ("finishTime", max)):
+        values = [chunk["Timing"][name] for chunk in chunks if chunk["Timing"].get(name)]
+        if values:
+            timing[name] = pick(values)
+    return timing
+
+
+def emit_stitched(chunks: list[dict[str, Any]], group: str, playlist: str) -> None:
+    """Send the stitched title to the MediaPackage function as a COMPLETE job would be."""
+    metadata = {
+        key: value
+        for key, value in chunks[0]["UserMetadata"].items()
+        if key != CHUNK_INDEX_KEY
+    }
+    get_client("events").put_events(
+        Entries=[
+            {
+                "Detail": json.dumps({
+                    "status": "COMPLETE",
+                    "jobId": group,
+                    "queue": chunks[0]["Queue"],
+                    "timing": get_stitched_timing(chunks),
+                    "userMetadata": metadata,
+                    "outputGroupDetails": [
+                        {"type": chunks[0]["Type"], "playlistFilePaths": [playlist]}
+                    ],
+                    "chunkJobIds": [chunk["JobId"] for chunk in chunks],
+                }),
+                "DetailType": STITCHED_DETAIL_TYPE,
+                "Source": os.environ.get("StackName", "fast-channels"),
+            }
+        ]
+    )
+
+
+@emit_api_metrics
+def lambda_handler(event: dict[str, Any], context: Any) -> dict[str, Any]:
+    """
+    Lambda handler for HLS stitching.
+
+    Triggered by MediaConvert COMPLETE status events of chunk jobs via
+    EventBridge. Stitches the group once all of its chunks have completed.
+    """
+    logger.debug("Received event: %s", as_json(event))
+
+    detail = event["detail"]
+    metadata = detail.get("userMetadata") or {}
+    group = metadata[CHUNK_GROUP_KEY]
+    count = int(metadata[CHUNK_COUNT_KEY])
+    result: dict[str, Any] = {
+        "ChunkGroup": group,
+        "ChunkIndex": int(metadata[CHUNK_INDEX_KEY]),
+        "ChunkCount": count,
+        CORRELATION_ID_KEY: metadata.get(CORRELATION_ID_KEY),
+    }
+
+    playlist = get_source_playlist(detail.get("outputGroupDetails", []))
+    if not playlist:
+        logger.warning("No playlist file paths in event")
+        return {**result, "Status": "NO_OUTPUT"}
+
+    parsed = urlparse(playlist)
+    bucket = parsed.netloc
+    _, group_prefix = get_group_prefix(parsed.path.lstrip("/"), group)
+
+    record_chunk(bucket, group_prefix, detail, playlist)
+    completed = list_completed_chunks(bucket, group_prefix)
+    if len(completed) < count:
+        logger.info("Chunk group %s has %d of %d chunks", group, len(completed), count)
+        return {**result, "Status": "WAITING", "Completed": len(completed)}
+
+    if not claim_stitch(bucket, group_prefix):
+        logger.info("Chunk group %s is stitched by another invocation", group)
+        return {**result, "Status": "ALREADY_STITCHED"}
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(count, MAX_CONCURRENCY)) as executor:
+            chunks = list(executor.map(
+                lambda key: json.loads(
+                    get_client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+                ),
+                completed,
+            ))
+        chunks.sort(key=lambda chunk: chunk["Index"])
+        stitched = stitch_chunks(chunks, group)
+        emit_stitched(chunks, group, stitched)
+    except Exception:
+        release_stitch(bucket, group_prefix)
+        raise
+
+    result.update({"Status": "STITCHED", "Playlist": stitched})
+    logger.info("Stitched chunk group: %s", as_json(result))
+    return result
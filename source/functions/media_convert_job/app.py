@@ -3,38 +3,80 @@ MediaConvert Job Lambda Function
 
 Triggers a MediaConvert job when a new video file is uploaded to S3.
 Supports ad break offsets via S3 object tags for frame-accurate ad insertion.
+Offsets can be snapped to the GOP or segment boundaries of the job template, so
+the splice points in the encode and the MediaTailor ad breaks always agree.
+Each job gets a correlation ID that follows the upload through the pipeline.
+Re-deliveries of a source already transcoded with the same template and ad
+offsets reuse the existing output instead of starting a job, and a tag change
+that only moves the ad breaks of a packaged source updates them in place.
+Sources longer than ``ChunkedTranscodeThresholdMinutes`` are transcoded as
+parallel chunks that the HLS stitcher joins again (``fast_common.chunking``).
 """
 from __future__ import annotations
 
+import copy
 import json
 import logging
 import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
-import boto3
-import xmltodict
-from botocore.config import Config
+from fast_common.alignment import ALIGNMENT_MODES, plan_alignment, snap_offsets
+from fast_common.chunking import (
+    CHUNK_COUNT_KEY,
+    CHUNK_GROUP_KEY,
+    CHUNK_INDEX_KEY,
+    get_chunk_millis,
+    get_chunk_prefix,
+    get_source_duration,
+    get_threshold_millis,
+    plan_chunks,
+    remap_offsets,
+)
+from fast_common.clients import get_client
+from fast_common.logs import as_json, log_sampled
+from fast_common.metrics import emit_api_metrics
+from fast_common.reuse import (
+    AD_BREAKS_DETAIL_TYPE,
+    REUSE_KEY,
+    REUSED_DETAIL_TYPE,
+    REUSED_JOB_KEY,
+    SOURCE_ETAG_KEY,
+    SOURCE_ID_KEY,
+    find_reusable_output,
+    get_fingerprint,
+    get_reuse_key,
+    get_reuse_mode,
+    get_source_id,
+    head_source,
+    read_source_record,
+    write_source_record,
+)
+from fast_common.tracing import (
+    CORRELATION_ID_KEY,
+    format_timestamp,
+    get_event_timestamp,
+    new_correlation_id,
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
 logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
-# Initialize MediaConvert client with regional endpoint
-config = Config(retries={"max_attempts": 3, "mode": "adaptive"})
-mediaconvert_client = boto3.client("mediaconvert", config=config)
-endpoint = mediaconvert_client.describe_endpoints()["Endpoints"][0]["Url"]
-logger.info("MediaConvert Endpoint URL: %s", endpoint)
-mediaconvert = boto3.client("mediaconvert", endpoint_url=endpoint, config=config)
+# Uploads with any other extension are skipped
+VIDEO_EXTENSIONS = frozenset({".mp4", ".mov", ".mxf", ".mkv", ".avi", ".ts", ".m2ts"})
 
-s3_client = boto3.client("s3", config=config)
+# Maximum number of chunk jobs submitted in parallel
+MAX_CONCURRENCY = 8
 
 
 def get_s3_object_tags(bucket: str, key: str) -> list[dict[str, str]] | None:
     """Retrieve S3 object tags for the given bucket and key."""
     try:
-        response = s3_client.get_object_tagging(Bucket=bucket, Key=key)
+        response = get_client("s3").get_object_tagging(Bucket=bucket, Key=key)
         tags = response.get("TagSet", [])
-        logger.info("Retrieved tags: %s", json.dumps(tags))
+        log_sampled(logger, logging.INFO, "Retrieved tags: %s", as_json(tags))
         return tags
     except Exception as error:
         logger.warning("Failed to retrieve tags: %s", error)
@@ -68,8 +110,44 @@ def get_ad_offsets(tags: list[dict[str, str]] | None) -> list[str] | None:
     return None
 
 
+def is_fast_path_enabled() -> bool:
+    """Return whether tag-only changes update ad breaks in place (``AdBreakFastPath``)."""
+    return os.environ.get("AdBreakFastPath", "true").lower() == "true"
+
+
+def get_segment_length(template: dict[str, Any]) -> int:
+    """Return the segment length of the first output group of a job template."""
+    for output_group in template["Settings"].get("OutputGroups", []):
+        for key, settings in output_group.get("OutputGroupSettings", {}).items():
+            if key != "Type" and isinstance(settings, dict) and settings.get("SegmentLength"):
+                return int(settings["SegmentLength"])
+    return 6
+
+
+def align_ad_offsets(ad_offsets: list[str], template: dict[str, Any]) -> list[str]:
+    """
+    Snap ad offsets to the boundaries selected by ``AdOffsetAlignment``.
+
+    The GOP and segment durations are planned from ``SourceFrameRate`` and the
+    segment length of the job template, as the presets were generated.
+    """
+    mode = os.environ.get("AdOffsetAlignment", "NONE").upper()
+    if mode not in ALIGNMENT_MODES:
+        raise ValueError(f"Invalid AdOffsetAlignment: {mode}. Must be one of {ALIGNMENT_MODES}")
+    if mode == "NONE":
+        return ad_offsets
+
+    plan = plan_alignment(os.environ.get("SourceFrameRate", "30"), get_segment_length(template))
+    aligned = [str(offset) for offset in snap_offsets(ad_offsets, plan, mode)]
+    if aligned != ad_offsets:
+        logger.info("Snapped ad offsets %s to %s boundaries: %s", ad_offsets, mode, aligned)
+    return aligned
+
+
 def generate_esam(ad_offsets: list[str]) -> dict[str, Any]:
     """Generate ESAM (Event Signaling and Management) XML for ad break offsets."""
+    import xmltodict
+
     response_signals = []
     conditioning_infos = []
     manifests_responses = []
@@ -153,8 +231,14 @@ def format_template_for_new_job(
     input_file: str,
     esam: dict[str, Any] | None = None,
     ad_offsets: list[str] | None = None,
+    user_metadata: dict[str, str] | None = None,
 ) -> dict[str, Any]:
-    """Format a MediaConvert job template for a new job submission."""
+    """
+    Format a MediaConvert job template for a new job submission.
+
+    ``user_metadata`` (correlation ID and stage timestamps) is passed through
+    the job to the MediaPackage function, which copies it into asset tags.
+    """
     job_settings = {
         "JobTemplate": template["Name"],
         "Role": os.environ["MediaConvertTranscodeRoleArn"],
@@ -163,55 +247,281 @@ def format_template_for_new_job(
 
     job_settings["Settings"]["Inputs"][0]["FileInput"] = input_file
 
+    metadata = dict(user_metadata or {})
     if ad_offsets:
-        offsets_str = " ".join(ad_offsets)
-        job_settings["Tags"] = {"AdOffsets": offsets_str}
-        job_settings["UserMetadata"] = {"AdOffsets": offsets_str}
+        metadata["AdOffsets"] = " ".join(ad_offsets)
+
+    if metadata:
+        job_settings["UserMetadata"] = metadata
+        job_settings["Tags"] = {
+            key: metadata[key] for key in (CORRELATION_ID_KEY, "AdOffsets") if key in metadata
+        }
 
     if esam:
         logger.info("Adding ESAM configuration")
         job_settings["Settings"]["Esam"] = esam
 
-    logger.debug("MediaConvert Job JSON: %s", json.dumps(job_settings))
+    logger.debug("MediaConvert Job JSON: %s", as_json(job_settings))
     return job_settings
 
 
+def plan_source_chunks(
+    template: dict[str, Any],
+    input_file_bucket: str,
+    input_file_key: str,
+    head: dict[str, Any],
+    tags: list[dict[str, str]] | None,
+) -> list[dict[str, Any]] | None:
+    """
+    Plan the chunks of a source longer than the chunking threshold.
+
+    Returns None when chunking is disabled, the duration of the source is
+    unknown or below the threshold, or the source would fit in one chunk.
+    """
+    threshold = get_threshold_millis()
+    if not threshold:
+        return None
+
+    duration = get_source_duration(input_file_bucket, input_file_key, head, tags)
+    if duration is None or duration < threshold:
+        logger.info("Not chunking %s, duration %s ms", input_file_key, duration)
+        return None
+
+    plan = plan_alignment(os.environ.get("SourceFrameRate", "30"), get_segment_length(template))
+    chunks = plan_chunks(duration, get_chunk_millis(), plan)
+    if len(chunks) < 2:
+        return None
+    logger.info("Chunking %s (%d ms) into %d chunks", input_file_key, duration, len(chunks))
+    return chunks
+
+
+def get_chunk_destination(destination: str, prefix: str) -> str:
+    """Move an output group destination into a chunk directory, keeping its base name."""
+    if destination.endswith("/"):
+        return destination + prefix
+    return posixpath.join(posixpath.dirname(destination), prefix + posixpath.basename(destination))
+
+
+def submit_chunks(
+    template: dict[str, Any],
+    input_file: str,
+    chunks: list[dict[str, Any]],
+    ad_offsets: list[str] | None,
+    user_metadata: dict[str, str],
+) -> list[dict[str, Any]]:
+    """
+    Submit one job per chunk, clipped from the same input.
+
+    Each job writes to its own chunk directory with the ad offsets that fall
+    inside it as ESAM, and carries the title's offsets and the chunk group in
+    its user metadata for the stitcher.
+    """
+    mediaconvert = get_client("mediaconvert")
+    group = user_metadata[CORRELATION_ID_KEY]
+
+    def submit(chunk: dict[str, Any]) -> dict[str, Any]:
+        chunk_offsets = remap_offsets(ad_offsets, chunk)
+        metadata = {
+            **user_metadata,
+            CHUNK_GROUP_KEY: group,
+            CHUNK_INDEX_KEY: str(chunk["Index"]),
+            CHUNK_COUNT_KEY: str(len(chunks)),
+        }
+        job_params = format_template_for_new_job(
+            copy.deepcopy(template),
+            input_file,
+            generate_esam(chunk_offsets) if chunk_offsets else None,
+            ad_offsets,
+            metadata,
+        )
+
+        clipping = {"StartTimecode": chunk["StartTimecode"]}
+        if chunk["EndTimecode"]:
+            clipping["EndTimecode"] = chunk["EndTimecode"]
+        job_input = job_params["Settings"]["Inputs"][0]
+        job_input["InputClippings"] = [clipping]
+        # Clipping timecodes count from the first frame of the input
+        job_input["TimecodeSource"] = "ZEROBASED"
+
+        prefix = get_chunk_prefix(group, chunk["Index"])
+        for output_group in job_params["Settings"].get("OutputGroups", []):
+            for key, settings in output_group.get("OutputGroupSettings", {}).items():
+                if key != "Type" and isinstance(settings, dict) and settings.get("Destination"):
+                    settings["Destination"] = get_chunk_destination(settings["Destination"], prefix)
+
+        return mediaconvert.create_job(**job_params)["Job"]
+
+    with ThreadPoolExecutor(max_workers=min(len(chunks), MAX_CONCURRENCY)) as executor:
+        return list(executor.map(submit, chunks))
+
+
+def reuse_output(
+    entry: dict[str, Any],
+    input_file_key: str,
+    ad_offsets: list[str] | None,
+    user_metadata: dict[str, str],
+) -> None:
+    """
+    Send an indexed output to the MediaPackage function in place of a new job.
+
+    The event mirrors a COMPLETE job state change with the new upload's
+    metadata, and names the asset after the new upload.
+    """
+    metadata = {**user_metadata, REUSED_JOB_KEY: entry["JobId"]}
+    if ad_offsets:
+        metadata["AdOffsets"] = " ".join(ad_offsets)
+
+    get_client("events").put_events(
+        Entries=[
+            {
+                "Detail": json.dumps({
+                    "status": "COMPLETE",
+                    "jobId": entry["JobId"],
+                    "userMetadata": metadata,
+                    "outputGroupDetails": entry["OutputGroupDetails"],
+                    "sourceName": os.path.splitext(os.path.basename(input_file_key))[0],
+                }),
+                "DetailType": REUSED_DETAIL_TYPE,
+                "Source": os.environ.get("StackName", "fast-channels"),
+            }
+        ]
+    )
+
+
+def update_ad_breaks(
+    record: dict[str, Any],
+    ad_offsets: list[str] | None,
+    user_metadata: dict[str, str],
+) -> dict[str, Any]:
+    """
+    Apply new ad offsets to a packaged source without transcoding it again.
+
+    Emits an event for the MediaTailor function, which updates the asset and
+    VOD source tags and the scheduled program's ad breaks, and records the
+    new offsets so the next change is compared against them.
+    """
+    offsets = " ".join(ad_offsets or [])
+    if offsets == record.get("AdOffsets", ""):
+        return {"Status": "SKIPPED", "Reason": "Ad offsets unchanged", "AssetId": record["AssetId"]}
+
+    detail = {
+        "assetArn": record["AssetArn"],
+        "vodSourceName": record["AssetId"],
+        "adOffsets": offsets,
+        "previousAdOffsets": record.get("AdOffsets", ""),
+        "requestedAdOffsets": user_metadata.get("RequestedAdOffsets", ""),
+        "correlationId": record.get(CORRELATION_ID_KEY),
+    }
+    get_client("events").put_events(
+        Entries=[
+            {
+                "Detail": json.dumps(detail),
+                "DetailType": AD_BREAKS_DETAIL_TYPE,
+                "Source": os.environ.get("StackName", "fast-channels"),
+            }
+        ]
+    )
+    write_source_record(record["SourceId"], {**record, "AdOffsets": offsets})
+    return {"Status": "AD_BREAKS_UPDATED", "AssetId": record["AssetId"], "AdOffsets": offsets}
+
+
+@emit_api_metrics
 def lambda_handler(event: dict[str, Any], context: Any) -> dict[str, Any]:
     """
     Lambda handler for MediaConvert job creation.
     
     Triggered by S3 Object Created or Object Tagging events via EventBridge.
     """
-    logger.debug("Received event: %s", json.dumps(event, default=str))
+    logger.debug("Received event: %s", as_json(event))
 
     input_file_bucket = event["detail"]["bucket"]["name"]
     input_file_key = event["detail"]["object"]["key"]
     
     # Skip processing for non-video files
-    video_extensions = {".mp4", ".mov", ".mxf", ".mkv", ".avi", ".ts", ".m2ts"}
     file_ext = os.path.splitext(input_file_key)[1].lower()
-    if file_ext not in video_extensions:
+    if file_ext not in VIDEO_EXTENSIONS:
         logger.info("Skipping non-video file: %s", input_file_key)
         return {"Status": "SKIPPED", "Reason": "Not a video file"}
 
-    input_file_tags = get_s3_object_tags(input_file_bucket, input_file_key)
-    ad_offsets = get_ad_offsets(input_file_tags)
-    esam = generate_esam(ad_offsets) if ad_offsets else None
+    user_metadata = {
+        CORRELATION_ID_KEY: new_correlation_id(),
+        "UploadedAt": get_event_timestamp(event),
+    }
 
+    reuse_mode = get_reuse_mode()
+    mediaconvert = get_client("mediaconvert")
     template = mediaconvert.get_job_template(
         Name=os.environ["MediaConvertJobTemplate"]
     )["JobTemplate"]
 
+    # Snapped offsets go to both ESAM and the AdOffsets metadata that becomes
+    # the MediaTailor ad breaks, so the encode and the schedule agree
+    input_file_tags = get_s3_object_tags(input_file_bucket, input_file_key)
+    ad_offsets = get_ad_offsets(input_file_tags)
+    if ad_offsets:
+        aligned_offsets = align_ad_offsets(ad_offsets, template)
+        if aligned_offsets != ad_offsets:
+            user_metadata["RequestedAdOffsets"] = " ".join(ad_offsets)
+        ad_offsets = aligned_offsets
+    esam = generate_esam(ad_offsets) if ad_offsets else None
+
     input_file = f"s3://{input_file_bucket}/{input_file_key}"
 
-    job_params = format_template_for_new_job(template, input_file, esam, ad_offsets)
+    head = head_source(input_file_bucket, input_file_key)
+    user_metadata[SOURCE_ID_KEY] = get_source_id(input_file_bucket, input_file_key)
+    user_metadata[SOURCE_ETAG_KEY] = head.get("ETag", "").strip('"')
+
+    # A tag change on content that is already packaged only moves the ad breaks
+    if event.get("detail-type") != "Object Created" and is_fast_path_enabled():
+        record = read_source_record(user_metadata[SOURCE_ID_KEY])
+        if record and record.get(SOURCE_ETAG_KEY) == user_metadata[SOURCE_ETAG_KEY]:
+            result = update_ad_breaks(record, ad_offsets, user_metadata)
+            result["InputFile"] = input_file
+            logger.info("Tag-only change: %s", as_json(result))
+            return result
+
+    fingerprint = get_fingerprint(input_file_bucket, input_file_key, reuse_mode, head)
+    if fingerprint:
+        user_metadata[REUSE_KEY] = get_reuse_key(fingerprint, template, ad_offsets)
+        entry = find_reusable_output(user_metadata[REUSE_KEY])
+        if entry:
+            reuse_output(entry, input_file_key, ad_offsets, user_metadata)
+            result = {
+                "Status": "REUSED",
+                "Id": entry["JobId"],
+                "InputFile": input_file,
+                CORRELATION_ID_KEY: user_metadata[CORRELATION_ID_KEY],
+            }
+            logger.info("Reused output of %s: %s", fingerprint, as_json(result))
+            return result
+
+    user_metadata["TranscodeSubmittedAt"] = format_timestamp()
+    chunks = plan_source_chunks(
+        template, input_file_bucket, input_file_key, head, input_file_tags
+    )
+    if chunks:
+        jobs = submit_chunks(template, input_file, chunks, ad_offsets, user_metadata)
+        result = {
+            "Status": jobs[0]["Status"],
+            "Id": jobs[0]["Id"],
+            "ChunkJobIds": [job["Id"] for job in jobs],
+            "InputFile": input_file,
+            CORRELATION_ID_KEY: user_metadata[CORRELATION_ID_KEY],
+        }
+        logger.info("Chunk jobs created: %s", as_json(result))
+        return result
+
+    job_params = format_template_for_new_job(
+        template, input_file, esam, ad_offsets, user_metadata
+    )
     job = mediaconvert.create_job(**job_params)["Job"]
 
     result = {
         "Status": job["Status"],
         "Id": job["Id"],
         "InputFile": input_file,
+        CORRELATION_ID_KEY: user_metadata[CORRELATION_ID_KEY],
     }
-    logger.info("Job created: %s", json.dumps(result))
+    logger.info("Job created: %s", as_json(result))
 
     return result
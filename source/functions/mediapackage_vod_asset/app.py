@@ -2,32 +2,45 @@
 MediaPackage VOD Asset Lambda Function
 
 Creates MediaPackage VOD assets from MediaConvert job outputs
-and generates playback URLs for MediaTailor SSAI.
+and generates playback URLs for MediaTailor SSAI. The HLS playlists are
+validated and measured before ingest, so a broken output fails fast instead
+of failing later inside MediaPackage.
 """
 from __future__ import annotations
 
 import json
 import logging
 import os
+import posixpath
 import re
-from random import randint
-from time import sleep
+from collections.abc import Iterator
 from typing import Any
 from urllib.parse import urlparse, urlunparse
 
-import boto3
-from botocore.config import Config
+from fast_common.clients import get_client
+from fast_common.governor import wait_for
+from fast_common.hls import (
+    get_segment_boundaries,
+    get_segment_map_key,
+    get_source_playlist,
+    parse_master_playlist,
+    parse_media_playlist,
+    resolve_uri,
+)
+from fast_common.logs import as_json, log_sampled
+from fast_common.metrics import emit_api_metrics
+from fast_common.reuse import REUSE_KEY, REUSED_JOB_KEY, SOURCE_ETAG_KEY, SOURCE_ID_KEY
+from fast_common.tracing import (
+    CORRELATION_ID_KEY,
+    format_timestamp,
+    get_event_timestamp,
+    get_stage_times,
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
 logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
-# Initialize AWS clients
-config = Config(retries={"max_attempts": 3, "mode": "adaptive"})
-mediapackage = boto3.client("mediapackage-vod", config=config)
-s3 = boto3.client("s3", config=config)
-events = boto3.client("events", config=config)
-
 
 def generate_playback_urls(
     egress_endpoints: list[dict[str, Any]],
@@ -72,7 +85,7 @@ def generate_playback_urls(
             "adOffsets": asset_tags.get("AdOffsets"),
         })
 
-    logger.info("Generated playback URLs: %s", json.dumps(playback_urls, default=str))
+    log_sampled(logger, logging.INFO, "Generated playback URLs: %s", as_json(playback_urls))
     return playback_urls
 
 
@@ -93,27 +106,238 @@ def create_resource_id_from_mediaconvert_job_output(job_output: str) -> str:
     return asset_id
 
 
+def read_playlist_lines(bucket: str, key: str) -> Iterator[str]:
+    """Stream the lines of a playlist from S3."""
+    body = get_client("s3").get_object(Bucket=bucket, Key=key)["Body"]
+    for line in body.iter_lines():
+        yield line.decode("utf-8")
+
+
+def list_object_sizes(bucket: str, keys: set[str]) -> dict[str, int]:
+    """
+    Return the size of each key that exists, with one listing per directory.
+
+    Each listing is limited to the longest prefix the keys of a directory
+    share, which for MediaConvert outputs is the name of the title.
+    """
+    directories: dict[str, list[str]] = {}
+    for key in keys:
+        directories.setdefault(posixpath.dirname(key), []).append(key)
+
+    paginator = get_client("s3").get_paginator("list_objects_v2")
+    sizes: dict[str, int] = {}
+    for directory_keys in directories.values():
+        prefix = os.path.commonprefix(directory_keys)
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            sizes.update(
+                (item["Key"], item.get("Size", 0))
+                for item in page.get("Contents", [])
+                if item["Key"] in keys
+            )
+    return sizes
+
+
+def inspect_playlists(job_output: str) -> dict[str, Any]:
+    """
+    Validate the HLS output of a job and measure its duration.
+
+    Reads the master playlist and every variant and rendition playlist it
+    references, checks that each referenced segment exists, and returns the
+    duration, target duration and segment boundaries of the first variant,
+    with the attributes and size in bytes of every playlist. Raises
+    ValueError listing every problem found.
+    """
+    s3 = get_client("s3")
+    parsed = urlparse(job_output)
+    bucket, master_key = parsed.netloc, parsed.path.lstrip("/")
+
+    master = parse_master_playlist(read_playlist_lines(bucket, master_key))
+    errors = [f"{master_key}: {error}" for error in master["Errors"]]
+    # Variant streams come first, so the first playlist measured is a video rung
+    attributes = {
+        variant["Uri"]: {
+            "Type": "VIDEO",
+            "Resolution": variant["Resolution"],
+            "Bandwidth": variant["Bandwidth"],
+            "Codecs": variant["Codecs"],
+        }
+        for variant in master["Variants"]
+    }
+    for rendition in master["Renditions"]:
+        attributes.setdefault(rendition["Uri"], {"Type": rendition["Type"] or "AUDIO"})
+
+    variants = []
+    referenced: set[str] = set()
+    for uri, variant_attributes in attributes.items():
+        key = resolve_uri(master_key, uri)
+        if key is None:
+            errors.append(f"{master_key}: external playlist {uri} is not supported")
+            continue
+        try:
+            media = parse_media_playlist(read_playlist_lines(bucket, key))
+        except s3.exceptions.NoSuchKey:
+            errors.append(f"{key}: playlist not found")
+            continue
+
+        errors.extend(f"{key}: {error}" for error in media["Errors"])
+        segment_keys = set()
+        for segment_uri in [segment["Uri"] for segment in media["Segments"]] + media["Maps"]:
+            segment_key = resolve_uri(key, segment_uri)
+            if segment_key is None:
+                errors.append(f"{key}: external segment {segment_uri} is not supported")
+            else:
+                segment_keys.add(segment_key)
+        referenced |= segment_keys
+        variants.append({"Uri": key, "SegmentKeys": segment_keys, **variant_attributes, **media})
+
+    sizes = list_object_sizes(bucket, referenced) if referenced else {}
+    missing = referenced - sizes.keys()
+    if missing:
+        errors.append(f"{len(missing)} missing segments, e.g. {', '.join(sorted(missing)[:3])}")
+    if errors:
+        raise ValueError(f"Invalid HLS output {job_output}: {'; '.join(errors[:10])}")
+
+    program = variants[0]
+    for variant in variants[1:]:
+        if abs(variant["Duration"] - program["Duration"]) > program["TargetDuration"]:
+            logger.warning(
+                "Playlist %s lasts %.3fs but %s lasts %.3fs",
+                variant["Uri"], variant["Duration"], program["Uri"], program["Duration"],
+            )
+
+    info = {
+        "Playlist": master_key,
+        "DurationMillis": round(program["Duration"] * 1000),
+        "TargetDuration": program["TargetDuration"],
+        "SegmentCount": len(program["Segments"]),
+        "SegmentBoundaries": get_segment_boundaries(program["Segments"]),
+        "Variants": [
+            {
+                "Uri": variant["Uri"],
+                **{
+                    name: variant[name]
+                    for name in ("Type", "Resolution", "Bandwidth", "Codecs")
+                    if name in variant
+                },
+                "DurationMillis": round(variant["Duration"] * 1000),
+                "SegmentCount": len(variant["Segments"]),
+                "Bytes": sum(sizes[segment_key] for segment_key in variant["SegmentKeys"]),
+            }
+            for variant in variants
+        ],
+    }
+    logger.info(
+        "Validated %s: %d playlists, %d segments, %dms",
+        master_key, len(variants), len(referenced), info["DurationMillis"],
+    )
+    return info
+
+
+def write_segment_map(bucket: str, info: dict[str, Any]) -> None:
+    """Write the playlist inspection next to the master playlist for later scheduling."""
+    get_client("s3").put_object(
+        Bucket=bucket,
+        Key=get_segment_map_key(info["Playlist"]),
+        Body=json.dumps(info).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def record_job_stats(detail: dict[str, Any], info: dict[str, Any]) -> None:
+    """Record the timing and output sizes of a job, without ever failing the ingest."""
+    from fast_common.jobstats import build_rows, write_job_stats
+
+    try:
+        location = write_job_stats(build_rows(detail, info))
+    except Exception as error:
+        logger.warning("Failed to record job statistics: %s", error)
+        return
+    if location:
+        logger.info("Recorded job statistics in %s", location)
+
+
+def index_output(reuse_key: str, detail: dict[str, Any], job_output: str) -> None:
+    """Index a validated job output for reuse, without ever failing the ingest."""
+    from fast_common.reuse import write_index
+
+    try:
+        location = write_index(reuse_key, detail, job_output)
+    except Exception as error:
+        logger.warning("Failed to index output for reuse: %s", error)
+        return
+    if location:
+        logger.info("Indexed output for reuse in %s", location)
+
+
+def record_source(
+    asset_tags: dict[str, str], asset_response: dict[str, Any], detail: dict[str, Any]
+) -> None:
+    """Record the asset a source was packaged as, without ever failing the ingest."""
+    from fast_common.reuse import write_source_record
+
+    try:
+        write_source_record(
+            asset_tags[SOURCE_ID_KEY],
+            {
+                SOURCE_ETAG_KEY: asset_tags.get(SOURCE_ETAG_KEY, ""),
+                "AssetId": asset_response["Id"],
+                "AssetArn": asset_response["Arn"],
+                "JobId": detail.get("jobId", ""),
+                "AdOffsets": asset_tags.get("AdOffsets", ""),
+                "DurationMillis": asset_tags.get("DurationMillis", ""),
+                CORRELATION_ID_KEY: asset_tags.get(CORRELATION_ID_KEY, ""),
+            },
+        )
+    except Exception as error:
+        logger.warning("Failed to record the source of %s: %s", asset_response["Id"], error)
+
+
+def get_playlist_tags(info: dict[str, Any], ad_offsets: str | None) -> dict[str, str]:
+    """Return the duration tags of an asset, flagging ad offsets beyond the program."""
+    tags = {
+        "DurationMillis": str(info["DurationMillis"]),
+        "TargetDuration": str(info["TargetDuration"]),
+        "SegmentCount": str(info["SegmentCount"]),
+    }
+    out_of_range = [
+        offset
+        for offset in (ad_offsets or "").split()
+        if not 0 <= float(offset) < info["DurationMillis"]
+    ]
+    if out_of_range:
+        logger.warning(
+            "Ad offsets %s are outside the %dms program", out_of_range, info["DurationMillis"]
+        )
+        tags["AdOffsetsOutOfRange"] = " ".join(out_of_range)
+    return tags
+
+
 def update_asset(asset: dict[str, Any]) -> dict[str, Any]:
     """Delete and recreate an existing MediaPackage VOD asset."""
+    mediapackage = get_client("mediapackage-vod")
     try:
         mediapackage.delete_asset(Id=asset["Id"])
         logger.info("Deleted existing asset: %s", asset["Id"])
-        sleep(10)
+        # The ID can only be reused once the deletion is visible
+        wait_for(mediapackage.describe_asset, exists=False, Id=asset["Id"])
         new_asset = mediapackage.create_asset(**asset)
-        logger.info("Recreated asset: %s", json.dumps({"Id": new_asset["Id"]}))
+        logger.info("Recreated asset: %s", as_json({"Id": new_asset["Id"]}))
         return new_asset
     except mediapackage.exceptions.NotFoundException as error:
         raise ValueError(error.response["Error"]["Message"]) from error
 
 
+@emit_api_metrics
 def lambda_handler(event: dict[str, Any], context: Any) -> str:
     """
     Lambda handler for MediaPackage VOD asset creation.
     
-    Triggered by MediaConvert COMPLETE status events via EventBridge.
+    Triggered by MediaConvert COMPLETE status events via EventBridge, by the
+    reuse events the MediaConvert function emits for re-delivered sources, and
+    by the stitch events the HLS stitcher emits for titles transcoded in chunks.
     Creates MediaPackage VOD assets and emits playback URL events.
     """
-    logger.debug("Received event: %s", json.dumps(event))
+    logger.debug("Received event: %s", as_json(event))
 
     asset_tags = {
         "stack-id": os.environ.get("StackId", ""),
@@ -122,26 +346,40 @@ def lambda_handler(event: dict[str, Any], context: Any) -> str:
 
     if event["detail"].get("userMetadata"):
         asset_tags.update(event["detail"]["userMetadata"])
+    asset_tags["TranscodedAt"] = get_event_timestamp(event)
 
+    mediapackage = get_client("mediapackage-vod")
     try:
-        output_details = event["detail"]["outputGroupDetails"]
-        if not output_details or not output_details[0].get("playlistFilePaths"):
+        job_output = get_source_playlist(event["detail"]["outputGroupDetails"])
+        if not job_output:
             logger.warning("No playlist file paths in event")
             return json.dumps({"status": "NO_OUTPUT"})
 
-        job_output = output_details[0]["playlistFilePaths"][0]
-        
+        playlist_info = inspect_playlists(job_output)
+        write_segment_map(urlparse(job_output).netloc, playlist_info)
+        if not asset_tags.get(REUSED_JOB_KEY):
+            record_job_stats(event["detail"], playlist_info)
+            if asset_tags.get(REUSE_KEY):
+                index_output(asset_tags[REUSE_KEY], event["detail"], job_output)
+        asset_tags.update(get_playlist_tags(playlist_info, asset_tags.get("AdOffsets")))
+
+        # A reused output is packaged under the name its own transcode would have had
+        asset_source = job_output
+        if event["detail"].get("sourceName"):
+            asset_source = posixpath.join(
+                posixpath.dirname(job_output), event["detail"]["sourceName"] + ".m3u8"
+            )
+
         asset = {
             "PackagingGroupId": os.environ["MediaPackagePackagingGroupId"],
-            "Id": create_resource_id_from_mediaconvert_job_output(job_output),
+            "Id": create_resource_id_from_mediaconvert_job_output(asset_source),
             "SourceArn": get_object_arn_from_url(job_output),
             "SourceRoleArn": os.environ["MediaPackageReadS3RoleArn"],
             "Tags": asset_tags,
         }
-        logger.info("Creating MediaPackage asset: %s", json.dumps(asset))
+        log_sampled(logger, logging.INFO, "Creating MediaPackage asset: %s", as_json(asset))
 
-        # Randomize delay to minimize asset creation collisions
-        sleep(randint(10, 30) / 10)
+        asset_tags["PackagingStartedAt"] = format_timestamp()
 
         asset_response = mediapackage.create_asset(**asset)
 
@@ -153,8 +391,11 @@ def lambda_handler(event: dict[str, Any], context: Any) -> str:
         else:
             raise
 
+    if asset_tags.get(SOURCE_ID_KEY):
+        record_source(asset_tags, asset_response, event["detail"])
+
     # Emit playback URL event
-    playback_url_event = events.put_events(
+    playback_url_event = get_client("events").put_events(
         Entries=[
             {
                 "Detail": json.dumps(
@@ -163,7 +404,10 @@ def lambda_handler(event: dict[str, Any], context: Any) -> str:
                             asset_response["EgressEndpoints"],
                             asset_response["Id"],
                             asset_tags,
-                        )
+                        ),
+                        "correlationId": asset_tags.get(CORRELATION_ID_KEY),
+                        "stageTimes": get_stage_times(asset_tags),
+                        "durationMillis": playlist_info["DurationMillis"],
                     },
                     default=str,
                 ),
@@ -172,7 +416,9 @@ def lambda_handler(event: dict[str, Any], context: Any) -> str:
             }
         ]
     )
-    logger.info("Emitted playback URL event: %s", json.dumps(playback_url_event, default=str))
+    log_sampled(
+        logger, logging.INFO, "Emitted playback URL event: %s", as_json(playback_url_event)
+    )
 
     response = mediapackage.describe_asset(Id=asset_response["Id"])
     return json.dumps(response, default=str)
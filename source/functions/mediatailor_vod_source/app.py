@@ -2,30 +2,35 @@
 MediaTailor VOD Source Lambda Function
 
 Creates MediaTailor Channel Assembly VOD sources from MediaPackage VOD assets
-and schedules programs to the sample channel.
+and schedules programs to the sample channel. LINEAR channels are scheduled by
+the refill worker instead. When only the ad offsets of a
+packaged source change, updates its tags and the ad breaks of its program, or
+of every upcoming airing on a LINEAR channel, in place.
+Every scheduled or updated program is announced for the EPG exporter.
 """
 from __future__ import annotations
 
 import json
 import logging
+import math
 import os
-from random import randint
-from time import sleep
 from typing import Any
 from urllib.parse import urlparse
 
-import boto3
-from botocore.config import Config
+from fast_common.clients import get_client
+from fast_common.epg import SCHEDULE_CHANGED_DETAIL_TYPE
+from fast_common.governor import is_not_found, wait_for
+from fast_common.logs import as_json, log_sampled
+from fast_common.metrics import emit_api_metrics
+from fast_common.reuse import AD_BREAKS_DETAIL_TYPE
+from fast_common.schedule import SLATE_TAG_KEY, create_ad_breaks
+from fast_common.tracing import CORRELATION_ID_KEY, format_timestamp, get_event_timestamp
 
 # Configure logging
 logger = logging.getLogger(__name__)
 logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
-# Initialize AWS clients
-config = Config(retries={"max_attempts": 3, "mode": "adaptive"})
-mediatailor = boto3.client("mediatailor", config=config)
-events = boto3.client("events", config=config)
-mediapackage_vod = boto3.client("mediapackage-vod", config=config)
+DEFAULT_HORIZON_HOURS = 6
 
 
 def parse_arn(arn: str) -> dict[str, Any]:
@@ -61,6 +66,14 @@ def get_type_from_url(url: str) -> str:
         raise ValueError(f"Invalid manifest extension: {extension}. Must be .m3u8 or .mpd")
 
 
+def get_manifest_url(manifest_urls: list[str]) -> str:
+    """Return the first HLS or DASH manifest URL of a MediaPackage asset event."""
+    for manifest_url in manifest_urls:
+        if os.path.splitext(urlparse(manifest_url).path)[1] in (".m3u8", ".mpd"):
+            return manifest_url
+    raise ValueError(f"No HLS or DASH manifest in {manifest_urls}")
+
+
 def create_package_configuration(
     manifest_url: str,
     packaging_configuration_id: str,
@@ -78,6 +91,7 @@ def update_packaging_configurations(vod_source: dict[str, Any]) -> dict[str, Any
     new_http_packaging_configuration = vod_source.pop("HttpPackageConfigurations", [None])[0]
     http_packaging_configurations = [new_http_packaging_configuration]
 
+    mediatailor = get_client("mediatailor")
     response = mediatailor.describe_vod_source(**vod_source)
     
     for existing_config in response.get("HttpPackageConfigurations", []):
@@ -87,7 +101,7 @@ def update_packaging_configurations(vod_source: dict[str, Any]) -> dict[str, Any
             logger.info("Replacing existing packaging configuration: %s", existing_config)
 
     vod_source["HttpPackageConfigurations"] = http_packaging_configurations
-    logger.info("Updating VOD source: %s", json.dumps(vod_source, default=str))
+    log_sampled(logger, logging.INFO, "Updating VOD source: %s", as_json(vod_source))
     
     return mediatailor.update_vod_source(**vod_source)
 
@@ -95,66 +109,178 @@ def update_packaging_configurations(vod_source: dict[str, Any]) -> dict[str, Any
 def get_tags(asset_arn: str) -> dict[str, str]:
     """Retrieve tags from a MediaPackage VOD asset."""
     try:
+        mediapackage_vod = get_client("mediapackage-vod")
         tags = mediapackage_vod.list_tags_for_resource(ResourceArn=asset_arn).get("Tags", {})
-        logger.info("Asset tags: %s", json.dumps(tags))
+        log_sampled(logger, logging.INFO, "Asset tags: %s", as_json(tags))
         return tags
     except Exception as error:
         logger.warning("Error retrieving tags: %s", error)
         return {}
 
 
-def create_ad_breaks(tags: dict[str, str], source_location: str) -> list[dict[str, Any]]:
-    """Create ad break configurations from asset tags."""
-    ad_breaks = []
-    
-    offsets_str = tags.get("AdOffsets", "")
-    if not offsets_str:
-        return ad_breaks
+def notify_schedule_changed(channel_name: str, program_name: str, change: str) -> None:
+    """Announce a scheduled or updated program so the EPG is exported again."""
+    try:
+        get_client("events").put_events(
+            Entries=[
+                {
+                    "Detail": json.dumps({
+                        "channelName": channel_name,
+                        "programName": program_name,
+                        "vodSourceName": program_name,
+                        "change": change,
+                    }),
+                    "DetailType": SCHEDULE_CHANGED_DETAIL_TYPE,
+                    "Source": os.environ.get("StackName", "fast-channels"),
+                }
+            ]
+        )
+    except Exception as error:
+        logger.warning("Failed to announce schedule change of %s: %s", program_name, error)
 
-    offsets = offsets_str.split()
-    
-    for index, offset in enumerate(offsets):
-        ad_breaks.append({
-            "OffsetMillis": int(offset),
-            "MessageType": "SPLICE_INSERT",
-            "SpliceInsertMessage": {
-                "AvailNum": index,
-                "AvailsExpected": 1,
-                "SpliceEventId": index,
-                "UniqueProgramId": index,
-            },
-            "Slate": {
-                "SourceLocationName": source_location,
-                "VodSourceName": "AdBreakSlate30000",
-            },
-        })
 
-    return ad_breaks
+def get_program_names(
+    channel_name: str, vod_source_name: str, playback_mode: str
+) -> list[str]:
+    """
+    Return the programs of a VOD source on a channel.
+
+    LOOP channels have one program named after the VOD source. LINEAR
+    channels air it many times as ``{vod}-{epoch}`` programs, which are found
+    in the schedule up to the refill horizon.
+    """
+    if playback_mode != "LINEAR":
+        return [vod_source_name]
+
+    hours = float(os.environ.get("ScheduleHorizonHours", DEFAULT_HORIZON_HOURS))
+    paginator = get_client("mediatailor").get_paginator("get_channel_schedule")
+    names = []
+    for page in paginator.paginate(
+        ChannelName=channel_name, DurationMinutes=str(math.ceil(hours * 60))
+    ):
+        for entry in page.get("Items", []):
+            if entry.get("VodSourceName") == vod_source_name and entry["ProgramName"] not in names:
+                names.append(entry["ProgramName"])
+    return names
+
+
+def update_program_ad_breaks(
+    channel_name: str, program_name: str, ad_breaks: list[dict[str, Any]]
+) -> bool:
+    """Replace the ad breaks of a program, keeping its clip range. Returns whether it exists."""
+    mediatailor = get_client("mediatailor")
+    try:
+        program = mediatailor.describe_program(
+            ChannelName=channel_name,
+            ProgramName=program_name,
+        )
+    except Exception as error:
+        if not is_not_found(error):
+            raise
+        logger.info("No program %s to update in %s", program_name, channel_name)
+        return False
+
+    schedule_configuration = {}
+    if program.get("ClipRange"):
+        schedule_configuration["ClipRange"] = program["ClipRange"]
+
+    mediatailor.update_program(
+        ChannelName=channel_name,
+        ProgramName=program_name,
+        AdBreaks=ad_breaks,
+        ScheduleConfiguration=schedule_configuration,
+    )
+    notify_schedule_changed(channel_name, program_name, "UPDATED")
+    return True
+
+
+def update_ad_breaks(
+    detail: dict[str, Any], source_location: str, channel_name: str, playback_mode: str = "LOOP"
+) -> dict[str, Any]:
+    """
+    Apply new ad offsets to an existing asset, VOD source and its programs.
+
+    Ad breaks are program metadata in Channel Assembly, so the programs are
+    updated in place with their clip range kept. Nothing is transcoded or
+    packaged again.
+    """
+    vod_source_name = detail["vodSourceName"]
+    tags = {"AdOffsets": detail["adOffsets"], "AdBreaksUpdatedAt": format_timestamp()}
+    if detail.get("requestedAdOffsets"):
+        tags["RequestedAdOffsets"] = detail["requestedAdOffsets"]
+
+    get_client("mediapackage-vod").tag_resource(ResourceArn=detail["assetArn"], Tags=tags)
+
+    mediatailor = get_client("mediatailor")
+    vod_source = mediatailor.describe_vod_source(
+        SourceLocationName=source_location,
+        VodSourceName=vod_source_name,
+    )
+    mediatailor.tag_resource(ResourceArn=vod_source["Arn"], Tags=tags)
+
+    result = {"VodSourceName": vod_source_name, "AdOffsets": detail["adOffsets"]}
+    if not channel_name:
+        return result
+
+    program_names = get_program_names(channel_name, vod_source_name, playback_mode)
+    if not program_names:
+        logger.info("No programs of %s scheduled in %s", vod_source_name, channel_name)
+        return result
+
+    ad_breaks = create_ad_breaks(tags, source_location)
+    logger.info(
+        "Updating ad breaks of %d programs of %s from %s to %s",
+        len(program_names), vod_source_name, detail.get("previousAdOffsets"), detail["adOffsets"],
+    )
+    updated = [
+        name for name in program_names
+        if update_program_ad_breaks(channel_name, name, ad_breaks)
+    ]
+    if updated:
+        result["AdBreaks"] = len(ad_breaks)
+        result["Programs"] = updated
+    return result
 
 
+@emit_api_metrics
 def lambda_handler(event: dict[str, Any], context: Any) -> str:
     """
     Lambda handler for MediaTailor VOD source creation.
     
     Triggered by MediaPackage VodAssetPlayable events via EventBridge.
     Creates VOD sources and schedules programs to the sample channel.
+    Ad Breaks Changed events from the MediaConvert function update them.
     """
-    logger.debug("Received event: %s", json.dumps(event, default=str))
+    logger.debug("Received event: %s", as_json(event))
 
     source_location = os.environ["MediaTailorSourceLocation"]
     channel_name = os.environ.get("MediaTailorChannelName", "")
+    playback_mode = os.environ.get("MediaTailorChannelPlaybackMode", "LOOP")
+
+    if event.get("detail-type") == AD_BREAKS_DETAIL_TYPE:
+        result = update_ad_breaks(
+            event["detail"], source_location, channel_name, playback_mode
+        )
+        return json.dumps(result, default=str)
+    mediatailor = get_client("mediatailor")
 
     try:
         asset_arn = event["resources"][0]
         vod_source_name = parse_arn(asset_arn)["resource"]
         tags = get_tags(asset_arn)
+        if SLATE_TAG_KEY in tags:
+            logger.info("Asset %s is an ad break slate, not a program", vod_source_name)
+            return json.dumps({"VodSourceName": vod_source_name, "Skipped": True})
+        # Stage timestamps are only recorded when the VOD source is first created
+        tags["PlayableAt"] = get_event_timestamp(event)
+        tags["VodSourceCreatedAt"] = format_timestamp()
 
         vod_source = {
             "VodSourceName": vod_source_name,
             "SourceLocationName": source_location,
             "HttpPackageConfigurations": [
                 create_package_configuration(
-                    event["detail"]["manifest_urls"][0],
+                    get_manifest_url(event["detail"]["manifest_urls"]),
                     event["detail"]["packaging_configuration_id"],
                 )
             ],
@@ -164,14 +290,19 @@ def lambda_handler(event: dict[str, Any], context: Any) -> str:
             logger.info("Adding tags to VOD source: %s", vod_source_name)
             vod_source["Tags"] = tags
 
-        logger.info("Creating VOD source: %s", json.dumps(vod_source, default=str))
+        log_sampled(
+            logger,
+            logging.INFO,
+            "Creating VOD source %s for correlation ID %s",
+            as_json(vod_source),
+            tags.get(CORRELATION_ID_KEY),
+        )
         response = mediatailor.create_vod_source(**vod_source)
 
     except mediatailor.exceptions.BadRequestException as error:
         if "exists" in error.response["Error"]["Message"]:
             logger.info("VOD source exists, updating packaging configuration")
-            sleep(randint(10, 100) / 10)
-            
+
             if tags:
                 del vod_source["Tags"]  # update_vod_source doesn't support tags
             
@@ -184,9 +315,17 @@ def lambda_handler(event: dict[str, Any], context: Any) -> str:
             raise
 
     # Create program in sample channel if configured
-    if channel_name:
+    if channel_name and playback_mode == "LINEAR":
+        logger.info(
+            "Channel %s is LINEAR, the refill worker schedules %s", channel_name, vod_source_name
+        )
+    elif channel_name:
         try:
-            sleep(5)  # Allow VOD source to propagate
+            wait_for(
+                mediatailor.describe_vod_source,
+                VodSourceName=vod_source_name,
+                SourceLocationName=source_location,
+            )
             logger.info("Creating program in sample channel: %s", channel_name)
 
             schedule = mediatailor.get_channel_schedule(
@@ -219,8 +358,9 @@ def lambda_handler(event: dict[str, Any], context: Any) -> str:
             if ad_breaks:
                 program["AdBreaks"] = ad_breaks
 
-            logger.info("Creating program: %s", json.dumps(program, default=str))
+            log_sampled(logger, logging.INFO, "Creating program: %s", as_json(program))
             response = mediatailor.create_program(**program)
+            notify_schedule_changed(channel_name, vod_source_name, "CREATED")
 
         except mediatailor.exceptions.BadRequestException as error:
             if "exists" in error.response["Error"]["Message"]:
@@ -229,8 +369,14 @@ def lambda_handler(event: dict[str, Any], context: Any) -> str:
                     ChannelName=channel_name,
                     ProgramName=vod_source_name,
                 )
-                sleep(5)
+                wait_for(
+                    mediatailor.describe_program,
+                    exists=False,
+                    ChannelName=channel_name,
+                    ProgramName=vod_source_name,
+                )
                 response = mediatailor.create_program(**program)
+                notify_schedule_changed(channel_name, vod_source_name, "CREATED")
             else:
                 logger.error("Error creating program: %s", error)
 
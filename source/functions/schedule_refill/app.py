@@ -0,0 +1,318 @@
+"""
+Schedule Refill Lambda Function
+
+Keeps the schedule of every LINEAR channel filled for the next
+``ScheduleHorizonHours`` from a rotation pool of VOD sources
+(``fast_common.schedule``), and removes programs that have aired in batches
+so the schedule of a channel stays short however long it has been on air.
+
+New programs are chained to the last one scheduled with RELATIVE transitions,
+so each starts when the previous one ends. The programs the worker scheduled
+are recorded in S3 next to the EPG files, so a run needs no schedule reads:
+it deletes the aired programs of the record and appends programs until the
+record covers the horizon again. LOOP channels are skipped.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from fast_common.clients import get_client
+from fast_common.epg import SCHEDULE_CHANGED_DETAIL_TYPE, get_end, to_item
+from fast_common.governor import is_conflict, is_not_found
+from fast_common.logs import as_json
+from fast_common.metrics import emit_api_metrics
+from fast_common.schedule import (
+    create_ad_breaks,
+    get_next_source,
+    get_program_name,
+    get_rotation_pool,
+)
+from fast_common.tracing import format_timestamp
+
+# Configure logging
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
+
+DEFAULT_HORIZON_HOURS = 6
+
+# A schedule that ran dry starts again this far ahead of now
+START_LEAD = timedelta(minutes=2)
+
+# Programs are deleted this long after they end
+AIRED_RETENTION = timedelta(minutes=30)
+
+# Aired programs deleted per channel and run; the rest wait for the next run
+DELETE_BATCH_SIZE = 100
+
+# Programs created per channel and run, in case of very short VOD sources
+MAX_PROGRAMS_PER_RUN = 200
+
+# Maximum number of channels and program deletions processed in parallel
+MAX_CONCURRENCY = 8
+
+
+def get_channel_names() -> list[str]:
+    """Return the channels to refill, from ``ScheduleChannelNames``."""
+    return [name for name in os.environ.get("ScheduleChannelNames", "").split(",") if name]
+
+
+def get_horizon() -> timedelta:
+    """Return how far ahead channels are scheduled, from ``ScheduleHorizonHours``."""
+    hours = float(os.environ.get("ScheduleHorizonHours", DEFAULT_HORIZON_HOURS))
+    if hours <= 0:
+        raise ValueError(f"Invalid ScheduleHorizonHours: {hours}. Must be positive")
+    return timedelta(hours=hours)
+
+
+def get_record_key(channel_name: str) -> str:
+    """Return the S3 key of the record of the programs scheduled on a channel."""
+    return f"{os.environ.get('SchedulePrefix', 'schedule/')}{channel_name}.json"
+
+
+def read_record(channel_name: str) -> dict[str, Any]:
+    """Return the record of the programs scheduled on a channel, or an empty one."""
+    s3 = get_client("s3")
+    try:
+        body = s3.get_object(
+            Bucket=os.environ["ScheduleBucket"], Key=get_record_key(channel_name)
+        )["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return {}
+    return json.loads(body)
+
+
+def write_record(channel_name: str, record: dict[str, Any]) -> None:
+    """Save the record of the programs scheduled on a channel."""
+    get_client("s3").put_object(
+        Bucket=os.environ["ScheduleBucket"],
+        Key=get_record_key(channel_name),
+        Body=json.dumps(record).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def list_vod_sources(source_location: str) -> list[dict[str, Any]]:
+    """List every VOD source of a source location, with its tags."""
+    paginator = get_client("mediatailor").get_paginator("list_vod_sources")
+    vod_sources = []
+    for page in paginator.paginate(SourceLocationName=source_location):
+        vod_sources.extend(page.get("Items", []))
+    return vod_sources
+
+
+def read_scheduled_programs(channel_name: str) -> list[dict[str, Any]]:
+    """
+    Read the programs already scheduled on a channel from now to the horizon.
+
+    Only used when a channel has no record yet, so that the first refill
+    continues an existing schedule instead of overlapping it.
+    """
+    paginator = get_client("mediatailor").get_paginator("get_channel_schedule")
+    items = []
+    for page in paginator.paginate(
+        ChannelName=channel_name,
+        DurationMinutes=str(math.ceil(get_horizon().total_seconds() / 60)),
+    ):
+        items.extend(to_item(entry) for entry in page.get("Items", []))
+    return [item for item in items if item["Type"] == "PROGRAM"]
+
+
+def delete_aired_programs(
+    channel_name: str, programs: list[dict[str, Any]], now: datetime
+) -> list[dict[str, Any]]:
+    """
+    Delete up to ``DELETE_BATCH_SIZE`` programs that have aired.
+
+    Returns the programs that are still scheduled. Programs that fail to
+    delete stay in the record and are tried again on the next run.
+    """
+    aired = [item for item in programs if get_end(item) < now - AIRED_RETENTION]
+    batch = aired[:DELETE_BATCH_SIZE]
+    if not batch:
+        return programs
+
+    mediatailor = get_client("mediatailor")
+
+    def delete(item: dict[str, Any]) -> str | None:
+        try:
+            mediatailor.delete_program(ChannelName=channel_name, ProgramName=item["ProgramName"])
+        except Exception as error:
+            if not is_not_found(error):
+                logger.warning("Failed to delete program %s: %s", item["ProgramName"], error)
+                return None
+        return item["ProgramName"]
+
+    with ThreadPoolExecutor(max_workers=min(len(batch), MAX_CONCURRENCY)) as executor:
+        deleted = {name for name in executor.map(delete, batch) if name}
+
+    logger.info(
+        "Deleted %d of %d aired programs from %s", len(deleted), len(aired), channel_name
+    )
+    return [item for item in programs if item["ProgramName"] not in deleted]
+
+
+def schedule_program(
+    channel_name: str,
+    vod_source: dict[str, Any],
+    previous: dict[str, Any] | None,
+    start: datetime,
+) -> dict[str, Any]:
+    """
+    Schedule a VOD source after the previous program, or at ``start`` without one.
+
+    Returns the record item of the new program. A program of the same name
+    left by a run that failed before saving its record is adopted.
+    """
+    if previous:
+        transition = {
+            "Type": "RELATIVE",
+            "RelativePosition": "AFTER_PROGRAM",
+            "RelativeProgram": previous["ProgramName"],
+        }
+    else:
+        # The API requires a relative position even for absolute transitions
+        transition = {
+            "Type": "ABSOLUTE",
+            "RelativePosition": "AFTER_PROGRAM",
+            "ScheduledStartTimeMillis": int(start.timestamp() * 1000),
+        }
+
+    program = {
+        "ChannelName": channel_name,
+        "ProgramName": get_program_name(vod_source["VodSourceName"], start),
+        "SourceLocationName": vod_source["SourceLocationName"],
+        "VodSourceName": vod_source["VodSourceName"],
+        "ScheduleConfiguration": {"Transition": transition},
+    }
+    ad_breaks = create_ad_breaks(vod_source.get("Tags", {}), vod_source["SourceLocationName"])
+    if ad_breaks:
+        program["AdBreaks"] = ad_breaks
+
+    mediatailor = get_client("mediatailor")
+    try:
+        response = mediatailor.create_program(**program)
+    except Exception as error:
+        if not is_conflict(error):
+            raise
+        logger.info("Program %s already exists, adopting it", program["ProgramName"])
+        response = mediatailor.describe_program(
+            ChannelName=channel_name, ProgramName=program["ProgramName"]
+        )
+    return {
+        "ProgramName": program["ProgramName"],
+        "VodSourceName": program["VodSourceName"],
+        "SourceLocationName": program["SourceLocationName"],
+        "Type": "PROGRAM",
+        "Start": format_timestamp(response.get("ScheduledStartTime") or start),
+        "DurationSeconds": response.get("DurationMillis", 0) / 1000,
+    }
+
+
+def notify_schedule_changed(channel_name: str) -> None:
+    """Announce a refilled schedule so the EPG is exported again."""
+    try:
+        get_client("events").put_events(
+            Entries=[
+                {
+                    "Detail": json.dumps({
+                        "channelName": channel_name,
+                        "programName": "",
+                        "vodSourceName": "",
+                        "change": "REFILLED",
+                    }),
+                    "DetailType": SCHEDULE_CHANGED_DETAIL_TYPE,
+                    "Source": os.environ.get("StackName", "fast-channels"),
+                }
+            ]
+        )
+    except Exception as error:
+        logger.warning("Failed to announce schedule change of %s: %s", channel_name, error)
+
+
+def refill_channel(channel_name: str, pool: list[dict[str, Any]]) -> dict[str, Any]:
+    """Delete the aired programs of a LINEAR channel and schedule it up to the horizon."""
+    now = datetime.now(UTC)
+    result: dict[str, Any] = {"ChannelName": channel_name, "Deleted": 0, "Created": 0}
+
+    playback_mode = get_client("mediatailor").describe_channel(
+        ChannelName=channel_name
+    ).get("PlaybackMode", "LOOP")
+    if playback_mode != "LINEAR":
+        logger.info("Channel %s is %s, skipping", channel_name, playback_mode)
+        return {**result, "Skipped": True}
+
+    record = read_record(channel_name)
+    if "Programs" in record:
+        programs = record["Programs"]
+    else:
+        programs = read_scheduled_programs(channel_name)
+    scheduled = len(programs)
+    programs = delete_aired_programs(channel_name, programs, now)
+    result["Deleted"] = scheduled - len(programs)
+
+    # A schedule that ran dry cannot be continued from a program in the past
+    previous = programs[-1] if programs and get_end(programs[-1]) > now + START_LEAD else None
+    start = get_end(previous) if previous else now + START_LEAD
+    until = now + get_horizon()
+
+    if not pool:
+        logger.warning("No VOD sources to schedule on %s", channel_name)
+    try:
+        while pool and start < until and result["Created"] < MAX_PROGRAMS_PER_RUN:
+            vod_source = get_next_source(pool, record.get("LastVodSourceName"))
+            previous = schedule_program(channel_name, vod_source, previous, start)
+            programs.append(previous)
+            record["LastVodSourceName"] = vod_source["VodSourceName"]
+            result["Created"] += 1
+            if get_end(previous) <= start:
+                logger.warning("Program %s has no duration, stopping", previous["ProgramName"])
+                break
+            start = get_end(previous)
+    finally:
+        # Record the programs created before a failure, so the next run continues after them
+        record["Programs"] = programs
+        record["RefilledAt"] = format_timestamp(now)
+        write_record(channel_name, record)
+        if result["Deleted"] or result["Created"]:
+            notify_schedule_changed(channel_name)
+
+    result["ScheduledUntil"] = format_timestamp(start)
+    logger.info("Refilled schedule: %s", as_json(result))
+    return result
+
+
+@emit_api_metrics
+def lambda_handler(event: dict[str, Any], context: Any) -> dict[str, Any]:
+    """
+    Lambda handler for schedule refill.
+
+    Triggered by an EventBridge schedule. Every channel is attempted even if
+    some fail, and the failures are raised together at the end.
+    """
+    logger.debug("Received event: %s", as_json(event))
+
+    channel_names = get_channel_names()
+    pool = get_rotation_pool(list_vod_sources(os.environ["MediaTailorSourceLocation"]))
+    results = []
+    errors = {}
+
+    def refill(channel_name: str) -> None:
+        try:
+            results.append(refill_channel(channel_name, pool))
+        except Exception as error:
+            logger.error("Channel %s failed: %s", channel_name, error)
+            errors[channel_name] = str(error)
+
+    with ThreadPoolExecutor(max_workers=min(len(channel_names), MAX_CONCURRENCY) or 1) as executor:
+        list(executor.map(refill, channel_names))
+
+    if errors:
+        raise ValueError(f"Failed to refill channels: {json.dumps(errors)}")
+
+    return {"Channels": results}
@@ -2,59 +2,253 @@
 SNS Email Sender Lambda Function
 
 Sends playback URL notifications via SNS email.
+
+Events arrive either directly from EventBridge or batched through SQS. A batch
+holding more than one event is sent as a single digest email, split into
+several messages when it would exceed the SNS message size limit, with the
+full detail written to S3. An entry too large for a message on its own is
+trimmed to the playback URLs that fit, the rest being in the S3 detail.
+
+Digest parts are published one by one. When a part fails, only the SQS
+messages of its entries are reported as batch item failures, so a retry does
+not send the parts that went out again.
 """
 from __future__ import annotations
 
+import json
 import logging
 import os
+import uuid
+from datetime import UTC, datetime
 from typing import Any
+from urllib.parse import quote
 
-import boto3
-import yaml
-from botocore.config import Config
+from fast_common.clients import get_client
+from fast_common.logs import as_json
+from fast_common.metrics import emit_api_metrics
 
 # Configure logging
 logger = logging.getLogger(__name__)
 logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
-# Initialize AWS client
-config = Config(retries={"max_attempts": 3, "mode": "adaptive"})
-sns_client = boto3.client("sns", config=config)
+# SNS rejects messages above 256 KB; keep headroom for the digest header
+MAX_MESSAGE_BYTES = 240 * 1024
+MAX_SUBJECT_LENGTH = 100
 
 
 def dict_to_yaml(data: dict[str, Any]) -> str:
     """Convert a dictionary to YAML format for readable email content."""
+    import yaml
+
     return yaml.dump(data, default_flow_style=False, sort_keys=False)
 
 
 def publish_to_sns(message: str, subject: str) -> dict[str, Any]:
     """Publish a message to the configured SNS topic."""
     topic_arn = os.environ["SnsTopicArn"]
-    
-    response = sns_client.publish(
+
+    response = get_client("sns").publish(
         TopicArn=topic_arn,
-        Subject=subject,
+        Subject=subject[:MAX_SUBJECT_LENGTH],
         Message=message,
     )
-    
+
     logger.info("Published to SNS, MessageId: %s", response.get("MessageId"))
     return response
 
 
+def get_event_payloads(event: dict[str, Any]) -> list[dict[str, Any]]:
+    """Return the playback URL payloads of an EventBridge event or an SQS batch."""
+    if "Records" in event:
+        return [json.loads(record["body"]).get("detail", {}) for record in event["Records"]]
+    return [event.get("detail", {})]
+
+
+def get_record_ids(event: dict[str, Any]) -> list[str | None]:
+    """Return the SQS message ID of each payload, or None for an EventBridge event."""
+    if "Records" in event:
+        return [record.get("messageId") for record in event["Records"]]
+    return [None]
+
+
+def summarize_payloads(payloads: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Group the playback URLs of several events into one entry per asset."""
+    assets: dict[str, dict[str, Any]] = {}
+
+    for payload in payloads:
+        for playback_url in payload.get("playbackUrls", []):
+            asset = assets.setdefault(
+                playback_url["assetId"],
+                {
+                    "assetId": playback_url["assetId"],
+                    "adOffsets": playback_url.get("adOffsets"),
+                    "playbackUrls": [],
+                },
+            )
+            asset["playbackUrls"].append(playback_url["vodPlaybackUrl"])
+
+    return list(assets.values())
+
+
+def get_entry_payloads(payloads: list[dict[str, Any]]) -> dict[str, set[int]]:
+    """Return the indices of the payloads that contributed to each asset's entry."""
+    entry_payloads: dict[str, set[int]] = {}
+    for index, payload in enumerate(payloads):
+        for playback_url in payload.get("playbackUrls", []):
+            entry_payloads.setdefault(playback_url["assetId"], set()).add(index)
+    return entry_payloads
+
+
+def trim_entry(entry: dict[str, Any], max_bytes: int) -> str:
+    """
+    Render an entry as YAML within ``max_bytes``, dropping playback URLs that do not fit.
+
+    The number of dropped URLs is noted in the entry; they are listed in the S3
+    detail of the digest.
+    """
+    import yaml
+
+    urls = entry["playbackUrls"]
+    for count in range(len(urls), -1, -1):
+        trimmed = {**entry, "playbackUrls": urls[:count]}
+        if count < len(urls):
+            trimmed["omittedPlaybackUrls"] = len(urls) - count
+        entry_yaml = yaml.dump([trimmed], default_flow_style=False, sort_keys=False)
+        if len(entry_yaml.encode()) <= max_bytes:
+            return entry_yaml
+
+    return yaml.dump(
+        [{"assetId": entry["assetId"], "omittedPlaybackUrls": len(urls)}],
+        default_flow_style=False,
+        sort_keys=False,
+    )
+
+
+def split_messages(
+    header: str,
+    entries: list[dict[str, Any]],
+    max_bytes: int = MAX_MESSAGE_BYTES,
+) -> list[tuple[str, list[dict[str, Any]]]]:
+    """
+    Render digest entries as YAML messages that each fit within ``max_bytes``.
+
+    Returns each message with the entries it holds. Every message starts with
+    ``header``; entries are never split across messages, and an entry that
+    does not fit in a message of its own is trimmed.
+    """
+    import yaml
+
+    messages = []
+    body = ""
+    body_entries: list[dict[str, Any]] = []
+
+    for entry in entries:
+        entry_yaml = yaml.dump([entry], default_flow_style=False, sort_keys=False)
+        if len((header + entry_yaml).encode()) > max_bytes:
+            entry_yaml = trim_entry(entry, max_bytes - len(header.encode()))
+        if body and len((header + body + entry_yaml).encode()) > max_bytes:
+            messages.append((header + body, body_entries))
+            body = ""
+            body_entries = []
+        body += entry_yaml
+        body_entries.append(entry)
+
+    messages.append((header + body, body_entries))
+    return messages
+
+
+def write_digest_detail(payloads: list[dict[str, Any]]) -> str | None:
+    """Write the full digest payloads to S3 and return a console link to them."""
+    import yaml
+
+    bucket = os.environ.get("DigestBucket")
+    if not bucket:
+        return None
+
+    timestamp = datetime.now(UTC).strftime("%Y/%m/%d/%H%M%S")
+    key = f"{os.environ.get('DigestPrefix', 'digests/')}{timestamp}-{uuid.uuid4().hex[:8]}.yaml"
+
+    get_client("s3").put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=yaml.dump(payloads, default_flow_style=False, sort_keys=False).encode(),
+        ContentType="application/x-yaml",
+    )
+    logger.info("Wrote digest detail to s3://%s/%s", bucket, key)
+
+    return f"https://s3.console.aws.amazon.com/s3/object/{bucket}?prefix={quote(key)}"
+
+
+def send_digest(
+    payloads: list[dict[str, Any]],
+    stack_name: str,
+    record_ids: list[str | None] | None = None,
+) -> dict[str, Any]:
+    """
+    Send one consolidated notification for a batch of playback URL events.
+
+    A part that fails to publish does not stop the others. The SQS message IDs
+    in ``record_ids`` of the payloads behind its entries are returned as
+    ``batchItemFailures``, so SQS redelivers only those messages. Without
+    message IDs a failed part is raised.
+    """
+    entries = summarize_payloads(payloads)
+    entry_payloads = get_entry_payloads(payloads)
+    detail_url = write_digest_detail(payloads)
+
+    header = f"{len(entries)} assets with new playback URLs from {len(payloads)} events.\n"
+    if detail_url:
+        header += f"Full detail: {detail_url}\n"
+    header += "\n"
+
+    messages = split_messages(header, entries)
+    message_ids = []
+    failed: set[int] = set()
+
+    for part, (message, part_entries) in enumerate(messages, start=1):
+        subject = f"[{stack_name}] {len(entries)} new playback URLs"
+        if len(messages) > 1:
+            subject += f" ({part}/{len(messages)})"
+        try:
+            message_ids.append(publish_to_sns(message, subject).get("MessageId"))
+        except Exception as error:
+            if not record_ids or None in record_ids:
+                raise
+            logger.error("Failed to publish digest part %d: %s", part, error)
+            for entry in part_entries:
+                failed.update(entry_payloads.get(entry["assetId"], ()))
+
+    return {
+        "MessageIds": message_ids,
+        "Events": len(payloads),
+        "DetailUrl": detail_url,
+        "batchItemFailures": [
+            {"itemIdentifier": record_ids[index]} for index in sorted(failed)
+        ],
+    }
+
+
+@emit_api_metrics
 def lambda_handler(event: dict[str, Any], context: Any) -> dict[str, Any]:
     """
     Lambda handler for SNS email notifications.
-    
-    Triggered by Playback URLs events via EventBridge.
-    Converts playback URL data to YAML and sends via SNS email.
+
+    Triggered by Playback URLs events via EventBridge, either directly or
+    batched through SQS. Converts playback URL data to YAML and sends via SNS
+    email, as a single digest when a batch holds several events.
     """
-    logger.debug("Received event: %s", event)
+    logger.debug("Received event: %s", as_json(event))
 
-    payload = event.get("detail", {})
-    logger.debug("Payload: %s", payload)
+    payloads = get_event_payloads(event)
+    logger.debug("Payloads: %s", as_json(payloads))
 
-    yaml_payload = dict_to_yaml(payload)
     stack_name = os.environ.get("StackName", "FAST-Channels")
-    subject = f"[{stack_name}] New playback URLs available"
 
-    return publish_to_sns(yaml_payload, subject)
+    if len(payloads) == 1:
+        yaml_payload = dict_to_yaml(payloads[0])
+        if len(yaml_payload.encode()) <= MAX_MESSAGE_BYTES:
+            subject = f"[{stack_name}] New playback URLs available"
+            return publish_to_sns(yaml_payload, subject)
+
+    # Batches, and single events too large for one message, are sent as digests
+    return send_digest(payloads, stack_name, get_record_ids(event))
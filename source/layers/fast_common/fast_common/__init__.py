@@ -0,0 +1,5 @@
+"""
+Shared helpers for the FAST Channels Lambda functions.
+
+Packaged as a Lambda layer and imported by every function and custom resource.
+"""
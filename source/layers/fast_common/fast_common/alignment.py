@@ -0,0 +1,139 @@
+"""
+GOP and Segment Alignment
+
+Plans GOP sizes and segment lengths that line up for a source frame rate.
+Segments only have even durations when each one holds a whole number of GOPs,
+so the GOP duration is chosen as a divisor of the segment length and the GOP
+size in frames follows from the nominal frame rate of the frame-rate family.
+Ad offsets can be snapped to the GOP or segment boundaries of a plan.
+"""
+from __future__ import annotations
+
+from fractions import Fraction
+from typing import Any
+
+# Frame rates as MediaConvert numerator/denominator pairs
+FRAME_RATES = {
+    "23.976": (24000, 1001),
+    "24": (24, 1),
+    "25": (25, 1),
+    "29.97": (30000, 1001),
+    "30": (30, 1),
+    "50": (50, 1),
+    "59.94": (60000, 1001),
+    "60": (60, 1),
+}
+
+# Ad offset alignment modes: leave offsets alone, or snap to a GOP or segment boundary
+ALIGNMENT_MODES = ("NONE", "GOP", "SEGMENT")
+
+FRAME_RATE_FAMILIES = {
+    "film": ("23.976", "24"),
+    "pal": ("25", "50"),
+    "ntsc": ("29.97", "59.94"),
+    "integer": ("30", "60"),
+}
+
+
+def get_frame_rate(frame_rate: str | float) -> tuple[int, int]:
+    """
+    Return the numerator and denominator of a frame rate.
+
+    Accepts names such as "29.97", numbers such as 25, and fractions such as
+    "30000/1001". Values within 0.01 fps of a known rate snap to that rate.
+    """
+    try:
+        rate = Fraction(str(frame_rate).strip())
+    except (ValueError, ZeroDivisionError) as error:
+        raise ValueError(f"Invalid frame rate: {frame_rate}") from error
+
+    if rate <= 0:
+        raise ValueError(f"Invalid frame rate: {frame_rate}. Must be positive")
+
+    for numerator, denominator in FRAME_RATES.values():
+        if abs(float(rate) - numerator / denominator) < 0.01:
+            return numerator, denominator
+
+    rate = rate.limit_denominator(1001)
+    return rate.numerator, rate.denominator
+
+
+def get_frame_rate_family(numerator: int, denominator: int) -> str:
+    """Return the frame-rate family (film, pal, ntsc or integer) of a frame rate."""
+    for family, names in FRAME_RATE_FAMILIES.items():
+        if (numerator, denominator) in (FRAME_RATES[name] for name in names):
+            return family
+    return "integer"
+
+
+def plan_alignment(
+    frame_rate: str | float,
+    segment_length: int = 6,
+    max_gop_seconds: int = 3,
+) -> dict[str, Any]:
+    """
+    Plan the GOP size and segment length for a source frame rate.
+
+    The GOP lasts the largest whole number of nominal seconds, up to
+    ``max_gop_seconds``, that divides ``segment_length``. NTSC and film rates
+    (1001 denominators) keep the frame count of their integer rate, so their
+    GOPs and segments run 0.1% longer but every segment still holds the same
+    number of whole GOPs.
+    """
+    if segment_length < 1 or max_gop_seconds < 1:
+        raise ValueError("Segment length and GOP duration must be at least 1 second")
+
+    numerator, denominator = get_frame_rate(frame_rate)
+    nominal_rate = max(round(numerator / denominator), 1)
+    gop_seconds = max(
+        seconds for seconds in range(1, min(max_gop_seconds, segment_length) + 1)
+        if segment_length % seconds == 0
+    )
+    gop_size = nominal_rate * gop_seconds
+    gops_per_segment = segment_length // gop_seconds
+
+    return {
+        "Family": get_frame_rate_family(numerator, denominator),
+        "FramerateNumerator": numerator,
+        "FramerateDenominator": denominator,
+        "GopSize": gop_size,
+        "GopSeconds": gop_seconds,
+        "GopsPerSegment": gops_per_segment,
+        "SegmentLength": segment_length,
+        "SegmentDuration": round(gops_per_segment * gop_size * denominator / numerator, 3),
+    }
+
+
+def get_boundary_interval(plan: dict[str, Any], boundary: str = "GOP") -> Fraction:
+    """Return the exact duration in milliseconds of a GOP or a segment of an alignment plan."""
+    if boundary not in ALIGNMENT_MODES[1:]:
+        raise ValueError(f"Invalid boundary: {boundary}. Must be one of {ALIGNMENT_MODES[1:]}")
+    frames = plan["GopSize"] * (plan["GopsPerSegment"] if boundary == "SEGMENT" else 1)
+    return Fraction(frames * plan["FramerateDenominator"] * 1000, plan["FramerateNumerator"])
+
+
+def snap_offsets(
+    offsets: list[str] | list[int],
+    plan: dict[str, Any],
+    boundary: str = "GOP",
+) -> list[int]:
+    """
+    Snap ad offsets in milliseconds to the nearest GOP or segment boundary.
+
+    A splice on a boundary needs no extra IDR frame and splits no segment.
+    Mid-roll offsets never snap back to a pre-roll at 0. Offsets that snap to
+    the same boundary are merged, and the result is sorted. With ``boundary``
+    NONE the offsets are only converted to integers.
+    """
+    values = [int(round(float(offset))) for offset in offsets]
+    if boundary == "NONE":
+        return values
+
+    interval = get_boundary_interval(plan, boundary)
+    snapped = set()
+    for value in values:
+        count = round(value / interval)
+        if value > 0:
+            count = max(count, 1)
+        snapped.add(round(count * interval))
+    return sorted(snapped)
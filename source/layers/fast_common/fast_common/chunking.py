@@ -0,0 +1,211 @@
+"""
+Chunked Transcoding
+
+A long source transcoded as one MediaConvert job is playable only after the
+whole title is encoded. Above ``ChunkedTranscodeThresholdMinutes`` the source
+is split into chunks of about ``ChunkMinutes``, each transcoded by its own job
+from the same input with ``InputClippings``, and the HLS stitcher joins their
+playlists into one presentation once every chunk is done. Time to playable
+then follows the chunk length instead of the title length.
+
+Chunk boundaries fall on segment boundaries of the alignment plan, so every
+chunk but the last holds whole segments and whole GOPs. Clipping timecodes
+count frames at the nominal rate from a zero-based input timecode. Ad offsets
+are remapped into each chunk for its ESAM, while the title keeps its original
+offsets.
+
+The source duration comes from the ``SourceDurationMillis`` object tag, or
+from the movie header of MP4 and QuickTime files read with a few range reads.
+Sources of unknown duration are transcoded as one job.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import os
+import struct
+from typing import Any
+
+from fast_common.alignment import get_boundary_interval
+from fast_common.clients import get_client
+
+logger = logging.getLogger(__name__)
+
+# User metadata that ties the jobs of a chunked transcode together
+CHUNK_GROUP_KEY = "ChunkGroup"
+CHUNK_INDEX_KEY = "ChunkIndex"
+CHUNK_COUNT_KEY = "ChunkCount"
+
+# Chunk outputs are written under <destination>chunks/<group>/<index>/
+CHUNK_DIRECTORY = "chunks/"
+
+# Event the HLS stitcher emits in place of a COMPLETE event for a chunked title
+STITCHED_DETAIL_TYPE = "MediaConvert Job Stitched"
+
+DURATION_TAG_KEY = "SourceDurationMillis"
+
+# Containers whose duration is read from the movie header
+MP4_EXTENSIONS = frozenset({".mp4", ".mov", ".m4v"})
+
+# Top-level and moov boxes walked before giving up on finding the movie header
+MAX_BOXES = 64
+
+DEFAULT_CHUNK_MINUTES = 10
+
+
+def get_threshold_millis() -> int:
+    """Return the duration above which sources are chunked, or 0 when chunking is disabled."""
+    minutes = float(os.environ.get("ChunkedTranscodeThresholdMinutes", 0))
+    if minutes < 0:
+        raise ValueError(
+            f"Invalid ChunkedTranscodeThresholdMinutes: {minutes}. Must not be negative"
+        )
+    return int(minutes * 60000)
+
+
+def get_chunk_millis() -> int:
+    """Return the target chunk length, from ``ChunkMinutes``."""
+    minutes = float(os.environ.get("ChunkMinutes", DEFAULT_CHUNK_MINUTES))
+    if minutes <= 0:
+        raise ValueError(f"Invalid ChunkMinutes: {minutes}. Must be positive")
+    return int(minutes * 60000)
+
+
+def _read_range(bucket: str, key: str, start: int, length: int) -> bytes:
+    return get_client("s3").get_object(
+        Bucket=bucket, Key=key, Range=f"bytes={start}-{start + length - 1}"
+    )["Body"].read()
+
+
+def _find_box(
+    bucket: str, key: str, box_type: bytes, start: int, end: int
+) -> tuple[int, int] | None:
+    """Return the payload offset and size of the first box of a type between two offsets."""
+    offset = start
+    for _ in range(MAX_BOXES):
+        if offset + 8 > end:
+            return None
+        header = _read_range(bucket, key, offset, 16)
+        if len(header) < 8:
+            return None
+        size, current = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                return None
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return None
+        if current == box_type:
+            return offset + header_size, size - header_size
+        offset += size
+    return None
+
+
+def probe_mp4_duration(bucket: str, key: str, size: int) -> int | None:
+    """
+    Return the duration in milliseconds of an MP4 or QuickTime file from its movie header.
+
+    Walks the top-level boxes to ``moov`` and its children to ``mvhd`` with
+    one small range read per box, so a title with its ``moov`` after the media
+    data costs no more than one at the start. Returns None when no movie
+    header is found.
+    """
+    moov = _find_box(bucket, key, b"moov", 0, size)
+    if moov is None:
+        return None
+    mvhd = _find_box(bucket, key, b"mvhd", moov[0], moov[0] + moov[1])
+    if mvhd is None:
+        return None
+
+    header = _read_range(bucket, key, mvhd[0], 32)
+    if header[:1] == b"\x01":
+        timescale, duration = struct.unpack(">IQ", header[20:32])
+    else:
+        timescale, duration = struct.unpack(">II", header[12:20])
+    if not timescale:
+        return None
+    return duration * 1000 // timescale
+
+
+def get_source_duration(
+    bucket: str, key: str, head: dict[str, Any], tags: list[dict[str, str]] | None
+) -> int | None:
+    """
+    Return the duration of a source in milliseconds, or None when it is unknown.
+
+    The ``SourceDurationMillis`` tag wins over the movie header, so any
+    container can be chunked when its duration is supplied at upload.
+    """
+    for tag in tags or []:
+        if tag.get("Key") == DURATION_TAG_KEY:
+            try:
+                return int(float(tag["Value"]))
+            except ValueError:
+                logger.warning("Invalid %s tag: %s", DURATION_TAG_KEY, tag["Value"])
+
+    if os.path.splitext(key)[1].lower() not in MP4_EXTENSIONS:
+        return None
+    try:
+        return probe_mp4_duration(bucket, key, head.get("ContentLength", 0))
+    except Exception as error:
+        logger.warning("Failed to read the duration of %s: %s", key, error)
+        return None
+
+
+def to_timecode(frame: int, plan: dict[str, Any]) -> str:
+    """Return the non-drop-frame ``HH:MM:SS:FF`` timecode of a frame at the nominal rate."""
+    rate = plan["GopSize"] // plan["GopSeconds"]
+    seconds, frames = divmod(frame, rate)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}:{frames:02d}"
+
+
+def plan_chunks(
+    duration_millis: int, chunk_millis: int, plan: dict[str, Any]
+) -> list[dict[str, Any]]:
+    """
+    Split a source into chunks of about ``chunk_millis`` on segment boundaries.
+
+    Each chunk has its index, start and end in milliseconds and its clipping
+    timecodes. The last chunk has no end and runs to the end of the source, so
+    it absorbs the remainder instead of leaving a short chunk behind.
+    """
+    segment = get_boundary_interval(plan, "SEGMENT")
+    segment_frames = plan["GopSize"] * plan["GopsPerSegment"]
+    chunk_segments = max(round(chunk_millis / segment), 1)
+    count = max(round(duration_millis / (chunk_segments * segment)), 1)
+
+    chunks = []
+    for index in range(count):
+        start_frame = index * chunk_segments * segment_frames
+        end_frame = (index + 1) * chunk_segments * segment_frames
+        last = index == count - 1
+        chunks.append({
+            "Index": index,
+            "StartMillis": round(index * chunk_segments * segment),
+            "EndMillis": None if last else round((index + 1) * chunk_segments * segment),
+            "StartTimecode": to_timecode(start_frame, plan),
+            # The end timecode is the last frame of the chunk
+            "EndTimecode": None if last else to_timecode(end_frame - 1, plan),
+        })
+    return chunks
+
+
+def remap_offsets(offsets: list[str] | None, chunk: dict[str, Any]) -> list[str]:
+    """Return the ad offsets that fall inside a chunk, relative to its start."""
+    end = chunk["EndMillis"] if chunk["EndMillis"] is not None else math.inf
+    return [
+        str(round(float(offset)) - chunk["StartMillis"])
+        for offset in offsets or []
+        if chunk["StartMillis"] <= round(float(offset)) < end
+    ]
+
+
+def get_chunk_prefix(group: str, index: int) -> str:
+    """Return the directory of a chunk's outputs, relative to the job destination."""
+    return f"{CHUNK_DIRECTORY}{group}/{index:03d}/"
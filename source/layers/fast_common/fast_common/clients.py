@@ -0,0 +1,69 @@
+"""
+Shared AWS client factory.
+
+Clients are created on first use and cached for the lifetime of the execution
+environment, so importing a handler does no credential or network work and
+boto3 itself is only imported when a handler first calls AWS. Every client is
+instrumented with the API call metrics of ``fast_common.metrics``, and clients
+of rate-limited services wait on the token buckets of ``fast_common.governor``.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any
+
+from fast_common.governor import govern
+from fast_common.metrics import instrument
+
+RETRY_CONFIG = {"max_attempts": 3, "mode": "adaptive"}
+
+_clients: dict[tuple[str, str | None], Any] = {}
+_resources: dict[str, Any] = {}
+# boto3's default session is not thread-safe while creating clients
+_lock = threading.Lock()
+
+
+def create_client(service_name: str, endpoint_url: str | None = None) -> Any:
+    """Create an instrumented, rate-governed boto3 client with the shared retry configuration."""
+    import boto3
+    from botocore.config import Config
+
+    # The governor registers first so its waits are not counted as API latency
+    return instrument(govern(boto3.client(
+        service_name,
+        endpoint_url=endpoint_url,
+        config=Config(retries=RETRY_CONFIG),
+    )))
+
+
+def get_client(service_name: str, endpoint_url: str | None = None) -> Any:
+    """Return the cached client for a service, creating it on first use."""
+    key = (service_name, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = create_client(service_name, endpoint_url)
+    return client
+
+
+def get_resource(service_name: str) -> Any:
+    """Return the cached boto3 resource for a service, creating it on first use."""
+    resource = _resources.get(service_name)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(service_name)
+            if resource is None:
+                import boto3
+
+                resource = _resources[service_name] = boto3.resource(service_name)
+                instrument(resource.meta.client)
+    return resource
+
+
+def reset_clients() -> None:
+    """Drop every cached client and resource, for example between test runs."""
+    with _lock:
+        _clients.clear()
+        _resources.clear()
@@ -0,0 +1,217 @@
+"""
+Electronic Program Guide
+
+Downstream platforms read the schedule of each channel as an EPG, in XMLTV
+and in JSON. Paging ``GetChannelSchedule`` for every export does not scale,
+so the schedule of a channel is cached as a snapshot: its schedule items from
+shortly before the last export to the end of the horizon, the program
+metadata joined from VOD source and asset tags, and a digest of every EPG file
+written from it. The items of a LOOP channel repeat, so a snapshot holding a
+full loop is extended forward without calling MediaTailor at all.
+
+Program metadata is read from these tags of the VOD source, or of the
+MediaPackage asset it was created from: ``Title``, ``Subtitle``,
+``Description``, ``Genre``, ``Episode``, ``Rating``, ``Language`` and
+``Image``. Programs without a ``Title`` are listed under their VOD source name.
+"""
+from __future__ import annotations
+
+import json
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from fast_common.tracing import format_timestamp, parse_timestamp
+
+# Event the MediaTailor function emits when it schedules or updates a program
+SCHEDULE_CHANGED_DETAIL_TYPE = "Channel Schedule Changed"
+
+METADATA_TAGS = (
+    "Title",
+    "Subtitle",
+    "Description",
+    "Genre",
+    "Episode",
+    "Rating",
+    "Language",
+    "Image",
+)
+
+# Schedule entries that are listed in the EPG; filler slates are not
+LISTED_ENTRY_TYPES = ("PROGRAM", "ALTERNATE_MEDIA")
+
+# Difference in approximate start times still treated as the same item
+START_TOLERANCE_SECONDS = 5
+
+XMLTV_TIME_FORMAT = "%Y%m%d%H%M%S +0000"
+
+
+def to_item(entry: dict[str, Any]) -> dict[str, Any]:
+    """Convert a ``GetChannelSchedule`` entry to a snapshot item."""
+    start = entry["ApproximateStartTime"]
+    if isinstance(start, str):
+        start = parse_timestamp(start)
+    return {
+        "ProgramName": entry.get("ProgramName", ""),
+        "VodSourceName": entry.get("VodSourceName", ""),
+        "SourceLocationName": entry.get("SourceLocationName", ""),
+        "Type": entry.get("ScheduleEntryType", "PROGRAM"),
+        "Start": format_timestamp(start),
+        "DurationSeconds": entry.get("ApproximateDurationSeconds", 0),
+    }
+
+
+def get_start(item: dict[str, Any]) -> datetime:
+    """Return the start time of a snapshot item."""
+    return parse_timestamp(item["Start"])
+
+
+def get_end(item: dict[str, Any]) -> datetime:
+    """Return the end time of a snapshot item."""
+    return get_start(item) + timedelta(seconds=item["DurationSeconds"])
+
+
+def get_covered_until(items: list[dict[str, Any]]) -> datetime | None:
+    """Return the end of the last item of a schedule, or None for an empty one."""
+    return get_end(items[-1]) if items else None
+
+
+def trim_items(items: list[dict[str, Any]], since: datetime) -> list[dict[str, Any]]:
+    """Drop the items that ended before ``since``."""
+    return [item for item in items if get_end(item) > since]
+
+
+def get_loop_seconds(items: list[dict[str, Any]]) -> float | None:
+    """
+    Return the length of one loop of a LOOP channel's schedule.
+
+    The loop is found where the first program starts again, so the items must
+    span more than one loop. Returns None when they do not.
+    """
+    if not items:
+        return None
+    first = items[0]
+    for item in items[1:]:
+        if item["ProgramName"] == first["ProgramName"]:
+            return (get_start(item) - get_start(first)).total_seconds()
+    return None
+
+
+def extend_loop(
+    items: list[dict[str, Any]], loop_seconds: float, until: datetime
+) -> list[dict[str, Any]]:
+    """Repeat the last loop of a schedule until it covers ``until``."""
+    if not items or loop_seconds <= 0:
+        return items
+    items = list(items)
+    last_start = get_start(items[-1])
+    loop = [item for item in items if (last_start - get_start(item)).total_seconds() < loop_seconds]
+    while get_end(items[-1]) < until:
+        for item in loop:
+            item = {
+                **item,
+                "Start": format_timestamp(get_start(item) + timedelta(seconds=loop_seconds)),
+            }
+            items.append(item)
+        loop = items[-len(loop):]
+    return items
+
+
+def matches_head(items: list[dict[str, Any]], entry: dict[str, Any]) -> bool:
+    """Return whether the item on air in MediaTailor is the one the snapshot expects."""
+    head = to_item(entry)
+    head_start = get_start(head)
+    for item in items:
+        if abs((get_start(item) - head_start).total_seconds()) <= START_TOLERANCE_SECONDS:
+            return item["ProgramName"] == head["ProgramName"]
+    return False
+
+
+def get_metadata(tags: dict[str, str]) -> dict[str, str]:
+    """Return the program metadata found in a set of tags."""
+    return {key: tags[key] for key in METADATA_TAGS if tags.get(key)}
+
+
+def build_programs(
+    items: list[dict[str, Any]],
+    sources: dict[str, dict[str, Any]],
+    since: datetime,
+    until: datetime,
+) -> list[dict[str, Any]]:
+    """Join the listed items between two times with the metadata of their VOD sources."""
+    programs = []
+    for item in items:
+        if item["Type"] not in LISTED_ENTRY_TYPES:
+            continue
+        if get_end(item) <= since or get_start(item) >= until:
+            continue
+        metadata = sources.get(item["VodSourceName"], {}).get("Metadata", {})
+        programs.append({
+            "ProgramName": item["ProgramName"],
+            "VodSourceName": item["VodSourceName"],
+            "Start": item["Start"],
+            "End": format_timestamp(get_end(item)),
+            "DurationSeconds": item["DurationSeconds"],
+            **metadata,
+            "Title": metadata.get("Title") or item["VodSourceName"] or item["ProgramName"],
+        })
+    return programs
+
+
+def render_json(channel_name: str, programs: list[dict[str, Any]]) -> bytes:
+    """Render the programs of a channel as a JSON EPG."""
+    return json.dumps({"Channel": channel_name, "Programs": programs}, indent=1).encode("utf-8")
+
+
+def _xmltv_time(value: str) -> str:
+    return parse_timestamp(value).astimezone(UTC).strftime(XMLTV_TIME_FORMAT)
+
+
+def render_xmltv(channel_name: str, programs: list[dict[str, Any]]) -> bytes:
+    """Render the programs of a channel as an XMLTV EPG."""
+    import xml.etree.ElementTree as ElementTree
+
+    tv = ElementTree.Element("tv", {"generator-info-name": "fast-channels"})
+    channel = ElementTree.SubElement(tv, "channel", {"id": channel_name})
+    ElementTree.SubElement(channel, "display-name").text = channel_name
+
+    for program in programs:
+        element = ElementTree.SubElement(tv, "programme", {
+            "start": _xmltv_time(program["Start"]),
+            "stop": _xmltv_time(program["End"]),
+            "channel": channel_name,
+        })
+        language = {"lang": program["Language"]} if program.get("Language") else {}
+        # Children follow the element order of the XMLTV DTD
+        ElementTree.SubElement(element, "title", language).text = program["Title"]
+        if program.get("Subtitle"):
+            ElementTree.SubElement(element, "sub-title", language).text = program["Subtitle"]
+        if program.get("Description"):
+            ElementTree.SubElement(element, "desc", language).text = program["Description"]
+        if program.get("Genre"):
+            ElementTree.SubElement(element, "category", language).text = program["Genre"]
+        if program.get("Language"):
+            ElementTree.SubElement(element, "language").text = program["Language"]
+        ElementTree.SubElement(element, "length", {"units": "seconds"}).text = str(
+            round(program["DurationSeconds"])
+        )
+        if program.get("Image"):
+            ElementTree.SubElement(element, "icon", {"src": program["Image"]})
+        if program.get("Episode"):
+            ElementTree.SubElement(
+                element, "episode-num", {"system": "onscreen"}
+            ).text = program["Episode"]
+        if program.get("Rating"):
+            rating = ElementTree.SubElement(element, "rating")
+            ElementTree.SubElement(rating, "value").text = program["Rating"]
+
+    ElementTree.indent(tv)
+    return b'<?xml version="1.0" encoding="UTF-8"?>\n' + ElementTree.tostring(
+        tv, encoding="unicode"
+    ).encode("utf-8") + b"\n"
+
+
+def get_digest(body: bytes) -> str:
+    """Return the digest that decides whether an EPG file changed."""
+    import hashlib
+
+    return hashlib.sha256(body).hexdigest()
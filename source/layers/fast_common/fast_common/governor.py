@@ -0,0 +1,299 @@
+"""
+AWS API Rate Governor
+
+Spaces out MediaTailor, MediaPackage and MediaConvert calls with token buckets
+per service and per operation, so bursts of uploads are limited by the service
+quotas instead of by random sleeps. Every client created by the shared
+factory for a governed service waits for a token before each call.
+
+Set ``RateGovernorTable`` to a DynamoDB table (string partition key
+``BucketKey``) to share the buckets across all concurrent Lambda invocations,
+as the stack does by default. Without a table the buckets live in memory. An
+execution environment runs one invocation at a time, so in-memory buckets
+only space out the calls of a single invocation and its threads, never a
+burst of concurrent invocations. ``RateGovernorLimits`` overrides the limits
+with JSON such as ``{"mediatailor.CreateProgram": [2, 4]}`` (rate per second,
+burst).
+
+Changes that take a moment to become visible are awaited with ``wait_for``,
+which polls a describe call with a bounded backoff instead of sleeping for a
+fixed time.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Requests per second and burst size, per service and per "service.Operation".
+# Defaults stay below the default service quotas; raise them with
+# RateGovernorLimits when the account has higher quotas.
+DEFAULT_LIMITS: dict[str, tuple[float, int]] = {
+    "mediatailor": (10, 20),
+    "mediatailor.CreateVodSource": (5, 10),
+    "mediatailor.UpdateVodSource": (5, 10),
+    "mediatailor.CreateProgram": (5, 10),
+    "mediatailor.DeleteProgram": (5, 10),
+    "mediatailor.UpdateProgram": (5, 10),
+    "mediapackage-vod": (10, 20),
+    "mediapackage-vod.CreateAsset": (5, 10),
+    "mediapackage-vod.DeleteAsset": (5, 10),
+    "mediaconvert": (20, 40),
+    "mediaconvert.CreateJob": (10, 20),
+}
+
+# Longest a call waits for a token of each bucket before it is sent anyway,
+# leaving the SDK's adaptive retries to absorb the throttling
+MAX_WAIT_SECONDS = 30.0
+
+# Seconds a bucket item stays in DynamoDB after its last use
+BUCKET_TTL_SECONDS = 3600
+
+# Longest wait_for polls a describe call, and its first and longest delay
+POLL_TIMEOUT_SECONDS = 30.0
+POLL_INITIAL_DELAY = 0.5
+POLL_MAX_DELAY = 4.0
+
+# Error codes of describe calls for a resource that does not exist
+NOT_FOUND_CODES = ("NotFoundException", "ResourceNotFoundException", "404")
+
+# Error codes of create calls for a resource that already exists
+CONFLICT_CODES = ("ConflictException", "ResourceAlreadyExistsException")
+
+
+class MemoryBucketStore:
+    """Token buckets held in process memory."""
+
+    def __init__(self):
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        """Take a token, returning 0, or the seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (float(burst), now))
+            tokens = min(float(burst), tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+
+
+class DynamoDBBucketStore:
+    """Token buckets in a DynamoDB table, shared by every Lambda invocation."""
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        """Take a token, returning 0, or the seconds until one is available."""
+        from fast_common.clients import get_client
+
+        dynamodb = get_client("dynamodb")
+        while True:
+            now = time.time()
+            item = dynamodb.get_item(
+                TableName=self.table_name,
+                Key={"BucketKey": {"S": key}},
+                ConsistentRead=True,
+            ).get("Item")
+
+            if item:
+                updated = item["UpdatedAt"]["N"]
+                tokens = float(item["Tokens"]["N"]) + (now - float(updated)) * rate
+                condition = {
+                    "ConditionExpression": "UpdatedAt = :updated",
+                    "ExpressionAttributeValues": {":updated": {"N": updated}},
+                }
+            else:
+                tokens = float(burst)
+                condition = {"ConditionExpression": "attribute_not_exists(BucketKey)"}
+
+            tokens = min(float(burst), tokens)
+            if tokens < 1:
+                return (1 - tokens) / rate
+
+            try:
+                dynamodb.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        "BucketKey": {"S": key},
+                        "Tokens": {"N": repr(tokens - 1)},
+                        "UpdatedAt": {"N": repr(now)},
+                        "ExpiresAt": {"N": str(int(now) + BUCKET_TTL_SECONDS)},
+                    },
+                    **condition,
+                )
+                return 0.0
+            except dynamodb.exceptions.ConditionalCheckFailedException:
+                # Another invocation took a token first; read the bucket again
+                continue
+
+
+class RateGovernor:
+    """Wait for a token from the service bucket and the operation bucket of each call."""
+
+    def __init__(
+        self,
+        limits: dict[str, tuple[float, int]],
+        store: MemoryBucketStore | DynamoDBBucketStore,
+    ):
+        self.limits = limits
+        self.store = store
+        self.waited: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def governs(self, service: str) -> bool:
+        """Return whether any limit applies to a service."""
+        return any(key == service or key.startswith(f"{service}.") for key in self.limits)
+
+    def acquire(self, service: str, operation: str) -> float:
+        """
+        Block until the call may be sent and return the seconds waited.
+
+        Each bucket gets its own ``MAX_WAIT_SECONDS``, so a service bucket
+        that gave up still leaves the operation bucket to take its token.
+        """
+        waited = 0.0
+        for key in (service, f"{service}.{operation}"):
+            if key not in self.limits:
+                continue
+            rate, burst = self.limits[key]
+            key_waited = 0.0
+            while key_waited < MAX_WAIT_SECONDS:
+                wait = self.store.take(key, rate, burst)
+                if wait <= 0:
+                    break
+                wait = min(wait, MAX_WAIT_SECONDS - key_waited)
+                time.sleep(wait)
+                key_waited += wait
+            else:
+                logger.warning(
+                    "Rate governor gave up waiting for %s after %.1fs", key, key_waited
+                )
+            waited += key_waited
+
+        if waited:
+            name = f"{service}.{operation}"
+            with self._lock:
+                self.waited[name] = self.waited.get(name, 0.0) + waited
+        return waited
+
+
+def load_limits() -> dict[str, tuple[float, int]]:
+    """Return the default limits updated with the RateGovernorLimits environment variable."""
+    limits = dict(DEFAULT_LIMITS)
+    overrides = os.environ.get("RateGovernorLimits")
+    if overrides:
+        for key, (rate, burst) in json.loads(overrides).items():
+            limits[key] = (float(rate), int(burst))
+    return {key: limit for key, limit in limits.items() if limit[0] > 0}
+
+
+_governor: RateGovernor | None = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> RateGovernor:
+    """Return the governor of this execution environment, creating it on first use."""
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                table_name = os.environ.get("RateGovernorTable")
+                store = DynamoDBBucketStore(table_name) if table_name else MemoryBucketStore()
+                _governor = RateGovernor(load_limits(), store)
+    return _governor
+
+
+def reset_governor() -> None:
+    """Drop the governor so the next call reads the environment again."""
+    global _governor
+    with _governor_lock:
+        _governor = None
+
+
+def _before_call(service: str, model: Any, **_: Any) -> None:
+    get_governor().acquire(service, model.name)
+
+
+def govern(client: Any) -> Any:
+    """Register the rate governor on a boto3 client of a governed service and return it."""
+    service = client.meta.service_model.service_name
+    if get_governor().governs(service):
+        client.meta.events.register("before-call.*.*", functools.partial(_before_call, service))
+    return client
+
+
+def is_not_found(error: Exception) -> bool:
+    """Return whether an AWS error means the resource does not exist."""
+    response = getattr(error, "response", None)
+    if not isinstance(response, dict):
+        return False
+    details = response.get("Error", {})
+    # MediaTailor reports some missing resources as bad requests
+    return details.get("Code") in NOT_FOUND_CODES or "not found" in str(
+        details.get("Message", "")
+    ).lower()
+
+
+def is_conflict(error: Exception) -> bool:
+    """Return whether an AWS error means the resource already exists."""
+    response = getattr(error, "response", None)
+    if not isinstance(response, dict):
+        return False
+    details = response.get("Error", {})
+    # MediaTailor reports some existing resources as bad requests
+    return details.get("Code") in CONFLICT_CODES or "already exists" in str(
+        details.get("Message", "")
+    ).lower()
+
+
+def wait_for(
+    describe: Callable[..., Any],
+    exists: bool = True,
+    timeout: float = POLL_TIMEOUT_SECONDS,
+    **kwargs: Any,
+) -> bool:
+    """
+    Poll a describe call until the resource exists, or until it is gone with ``exists=False``.
+
+    The delay doubles from ``POLL_INITIAL_DELAY`` up to ``POLL_MAX_DELAY``, and
+    polling gives up after ``timeout`` seconds. Describe calls of a governed
+    client wait for their tokens like any other call. Returns whether the
+    resource reached the expected state.
+    """
+    deadline = time.monotonic() + timeout
+    delay = POLL_INITIAL_DELAY
+    while True:
+        try:
+            describe(**kwargs)
+            found = True
+        except Exception as error:
+            if not is_not_found(error):
+                raise
+            found = False
+        if found == exists:
+            return True
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(
+                "Gave up after %.0fs waiting for %s %s to %s",
+                timeout,
+                getattr(describe, "__name__", "describe"),
+                kwargs,
+                "exist" if exists else "be deleted",
+            )
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, POLL_MAX_DELAY)
@@ -0,0 +1,341 @@
+"""
+HLS Playlist Parsing
+
+Parses master and media playlists line by line, so a playlist can be read
+straight from a streaming S3 body without holding the whole file. The media
+playlist parser records each segment's URI and duration, from which the
+program duration and segment boundaries are computed, and collects the
+problems that would make MediaPackage reject the playlist. Playlists can also
+be cut to their first seconds and re-pointed at the cut renditions, which is
+how ad break slates of several durations share a single encode, and the
+playlists of the chunks of a title transcoded in parallel can be stitched back
+into one presentation.
+"""
+from __future__ import annotations
+
+import posixpath
+import re
+from collections.abc import Iterable
+from typing import Any
+from urllib.parse import urlparse
+
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+# HLS allows an EXTINF duration to exceed the target duration when rounding
+TARGET_DURATION_TOLERANCE = 0.5
+
+# Segment maps are written next to the master playlist, <stem>.segments.json
+SEGMENT_MAP_SUFFIX = ".segments.json"
+
+# MediaConvert output groups MediaPackage can ingest, most preferred first.
+# CMAF groups write fragmented MP4 once with both an HLS and a DASH manifest.
+SOURCE_GROUP_TYPES = ("CMAF_GROUP", "HLS_GROUP")
+
+# Media playlist tags that describe the whole playlist rather than a segment
+HEADER_TAGS = (
+    "#EXTM3U",
+    "#EXT-X-VERSION",
+    "#EXT-X-TARGETDURATION",
+    "#EXT-X-MEDIA-SEQUENCE",
+    "#EXT-X-DISCONTINUITY-SEQUENCE",
+    "#EXT-X-PLAYLIST-TYPE",
+    "#EXT-X-INDEPENDENT-SEGMENTS",
+    "#EXT-X-ENDLIST",
+)
+
+
+def parse_attributes(value: str) -> dict[str, str]:
+    """Parse an attribute list such as ``BANDWIDTH=800000,CODECS="avc1,mp4a"``."""
+    return {key: raw.strip('"') for key, raw in ATTRIBUTE_PATTERN.findall(value)}
+
+
+def resolve_uri(playlist_key: str, uri: str) -> str | None:
+    """Return the S3 key a URI refers to relative to a playlist, or None for absolute URLs."""
+    if urlparse(uri).scheme:
+        return None
+    path = uri.split("?", 1)[0]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(playlist_key), path))
+
+
+def get_source_playlist(output_group_details: list[dict[str, Any]]) -> str | None:
+    """
+    Select the HLS playlist MediaPackage ingests from MediaConvert output groups.
+
+    CMAF groups are preferred over HLS groups when a job writes both. Within a
+    group the first .m3u8 playlist is used, skipping the DASH .mpd manifest.
+    """
+    def preference(group: dict[str, Any]) -> int:
+        group_type = group.get("type", "HLS_GROUP")
+        if group_type in SOURCE_GROUP_TYPES:
+            return SOURCE_GROUP_TYPES.index(group_type)
+        return len(SOURCE_GROUP_TYPES)
+
+    for group in sorted(output_group_details or [], key=preference):
+        for playlist in group.get("playlistFilePaths", []):
+            if posixpath.splitext(urlparse(playlist).path)[1] == ".m3u8":
+                return playlist
+
+    return None
+
+
+def get_segment_map_key(playlist_key: str) -> str:
+    """Return the S3 key of the segment map written for a master playlist."""
+    return posixpath.splitext(playlist_key)[0] + SEGMENT_MAP_SUFFIX
+
+
+def parse_master_playlist(lines: Iterable[str]) -> dict[str, Any]:
+    """
+    Parse a master playlist into its variant streams and alternative renditions.
+
+    Returns a dict with ``Variants`` (``Uri``, ``Bandwidth``, ``Resolution``,
+    ``Codecs``), ``Renditions`` (``Uri``, ``Type``, ``GroupId``) and
+    ``Errors``.
+    """
+    playlist: dict[str, Any] = {"Variants": [], "Renditions": [], "Errors": []}
+    header = False
+    stream_info: dict[str, str] | None = None
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line == "#EXTM3U":
+            header = True
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            stream_info = parse_attributes(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-MEDIA:"):
+            attributes = parse_attributes(line.split(":", 1)[1])
+            if attributes.get("URI"):
+                playlist["Renditions"].append({
+                    "Uri": attributes["URI"],
+                    "Type": attributes.get("TYPE", ""),
+                    "GroupId": attributes.get("GROUP-ID", ""),
+                })
+        elif line.startswith("#EXTINF"):
+            playlist["Errors"].append("Expected a master playlist but found media segments")
+            break
+        elif not line.startswith("#") and stream_info is not None:
+            playlist["Variants"].append({
+                "Uri": line,
+                "Bandwidth": int(stream_info.get("BANDWIDTH", 0) or 0),
+                "Resolution": stream_info.get("RESOLUTION", ""),
+                "Codecs": stream_info.get("CODECS", ""),
+            })
+            stream_info = None
+
+    if not header:
+        playlist["Errors"].insert(0, "Missing #EXTM3U header")
+    if not playlist["Variants"] and not playlist["Errors"]:
+        playlist["Errors"].append("No variant streams")
+    return playlist
+
+
+def parse_media_playlist(lines: Iterable[str]) -> dict[str, Any]:
+    """
+    Parse a VOD media playlist into its segments.
+
+    Returns a dict with ``TargetDuration``, ``Segments`` (``Uri`` and
+    ``Duration`` in seconds), ``Maps`` (initialization section URIs),
+    ``Duration``, ``EndList`` and ``Errors``.
+    """
+    playlist: dict[str, Any] = {
+        "TargetDuration": None,
+        "Segments": [],
+        "Maps": [],
+        "Duration": 0.0,
+        "EndList": False,
+        "Errors": [],
+    }
+    header = False
+    duration: float | None = None
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line == "#EXTM3U":
+            header = True
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            playlist["TargetDuration"] = int(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF:"):
+            try:
+                duration = float(line.split(":", 1)[1].split(",", 1)[0])
+            except ValueError:
+                playlist["Errors"].append(f"Invalid segment duration: {line}")
+                duration = 0.0
+        elif line.startswith("#EXT-X-MAP:"):
+            uri = parse_attributes(line.split(":", 1)[1]).get("URI")
+            if uri and uri not in playlist["Maps"]:
+                playlist["Maps"].append(uri)
+        elif line == "#EXT-X-ENDLIST":
+            playlist["EndList"] = True
+        elif not line.startswith("#"):
+            if duration is None:
+                playlist["Errors"].append(f"Segment without #EXTINF: {line}")
+                continue
+            playlist["Segments"].append({"Uri": line, "Duration": duration})
+            playlist["Duration"] += duration
+            duration = None
+
+    if not header:
+        playlist["Errors"].insert(0, "Missing #EXTM3U header")
+    if not playlist["Segments"]:
+        playlist["Errors"].append("No media segments")
+    if not playlist["EndList"]:
+        playlist["Errors"].append("Missing #EXT-X-ENDLIST, the playlist is not a complete VOD")
+
+    target = playlist["TargetDuration"]
+    if target is None:
+        playlist["Errors"].append("Missing #EXT-X-TARGETDURATION")
+    else:
+        longest = max((segment["Duration"] for segment in playlist["Segments"]), default=0.0)
+        if longest > target + TARGET_DURATION_TOLERANCE:
+            playlist["Errors"].append(
+                f"Segment of {longest:g}s exceeds the target duration of {target}s"
+            )
+    return playlist
+
+
+def get_segment_boundaries(segments: list[dict[str, Any]]) -> list[int]:
+    """Return the start time in milliseconds of every segment, followed by the end time."""
+    boundaries = [0]
+    elapsed = 0.0
+    for segment in segments:
+        elapsed += segment["Duration"]
+        boundaries.append(round(elapsed * 1000))
+    return boundaries
+
+
+def truncate_media_playlist(lines: Iterable[str], seconds: float, tolerance: float = 0.1) -> str:
+    """
+    Return a VOD media playlist holding only the segments of its first ``seconds``.
+
+    Segments are kept whole, with the tags that precede them, until the kept
+    duration is within ``tolerance`` of ``seconds``; the playlist is closed
+    with ``#EXT-X-ENDLIST``.
+    """
+    kept: list[str] = []
+    pending: list[str] = []
+    elapsed = 0.0
+    duration = 0.0
+
+    for line in lines:
+        line = line.strip()
+        if not line or line == "#EXT-X-ENDLIST":
+            continue
+        if elapsed >= seconds - tolerance:
+            break
+        if line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",", 1)[0])
+        pending.append(line)
+        if not line.startswith("#"):
+            kept.extend(pending)
+            pending = []
+            elapsed += duration
+
+    # Header tags of a playlist without segments are still pending
+    kept.extend(line for line in pending if not line.startswith("#EXTINF:"))
+    kept.append("#EXT-X-ENDLIST")
+    return "\n".join(kept) + "\n"
+
+
+def rewrite_master_playlist(lines: Iterable[str], uris: dict[str, str]) -> str:
+    """Return a master playlist with its variant and rendition URIs replaced."""
+    rewritten = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-MEDIA:"):
+            uri = parse_attributes(line.split(":", 1)[1]).get("URI")
+            if uri in uris:
+                line = line.replace(f'URI="{uri}"', f'URI="{uris[uri]}"')
+        elif not line.startswith("#"):
+            line = uris.get(line, line)
+        rewritten.append(line)
+    return "\n".join(rewritten) + "\n"
+
+
+def _prefix_uri(prefix: str, uri: str) -> str:
+    if not prefix or urlparse(uri).scheme or uri.startswith("/"):
+        return uri
+    return posixpath.join(prefix, uri)
+
+
+def stitch_media_playlists(chunks: list[tuple[str, Iterable[str]]]) -> str:
+    """
+    Join the media playlists of consecutive chunks into one VOD media playlist.
+
+    Each chunk is a directory prefix, relative to the stitched playlist, and
+    the lines of its playlist. Header tags come from the first chunk, with the
+    longest target duration of all chunks. The segments of every later chunk
+    follow an ``#EXT-X-DISCONTINUITY``, since each chunk was encoded with its
+    own timestamps, and its segment and ``#EXT-X-MAP`` URIs get its prefix.
+    """
+    header: list[str] = []
+    body: list[str] = []
+    target = 0
+
+    for index, (prefix, lines) in enumerate(chunks):
+        if index:
+            body.append("#EXT-X-DISCONTINUITY")
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#EXT-X-TARGETDURATION:"):
+                target = max(target, int(line.split(":", 1)[1]))
+                if index == 0:
+                    header.append(line)
+            elif line.startswith(HEADER_TAGS):
+                if index == 0 and line != "#EXT-X-ENDLIST":
+                    header.append(line)
+            elif line.startswith("#EXT-X-MAP:"):
+                uri = parse_attributes(line.split(":", 1)[1]).get("URI", "")
+                body.append(line.replace(f'URI="{uri}"', f'URI="{_prefix_uri(prefix, uri)}"'))
+            elif line.startswith("#"):
+                body.append(line)
+            else:
+                body.append(_prefix_uri(prefix, line))
+
+    header = [
+        f"#EXT-X-TARGETDURATION:{target}" if line.startswith("#EXT-X-TARGETDURATION:") else line
+        for line in header
+    ]
+    return "\n".join(header + body + ["#EXT-X-ENDLIST"]) + "\n"
+
+
+def stitch_master_playlists(masters: list[list[str]]) -> str:
+    """
+    Return the master playlist of stitched chunks, from the masters of the chunks.
+
+    The first chunk's master is kept, with the ``BANDWIDTH`` and
+    ``AVERAGE-BANDWIDTH`` of each variant raised to the highest of any chunk,
+    so players see the true peak of the whole title.
+    """
+    peaks: dict[tuple[str, str], int] = {}
+    for lines in masters:
+        attributes: dict[str, str] | None = None
+        for line in lines:
+            line = line.strip()
+            if line.startswith("#EXT-X-STREAM-INF:"):
+                attributes = parse_attributes(line.split(":", 1)[1])
+            elif line and not line.startswith("#") and attributes is not None:
+                for name in ("BANDWIDTH", "AVERAGE-BANDWIDTH"):
+                    if attributes.get(name, "").isdigit():
+                        key = (line, name)
+                        peaks[key] = max(peaks.get(key, 0), int(attributes[name]))
+                attributes = None
+
+    stitched = [line.strip() for line in masters[0] if line.strip()]
+    for index, line in enumerate(stitched):
+        if not line.startswith("#EXT-X-STREAM-INF:") or index + 1 >= len(stitched):
+            continue
+        uri = stitched[index + 1]
+        for name in ("AVERAGE-BANDWIDTH", "BANDWIDTH"):
+            if (uri, name) in peaks:
+                line = re.sub(
+                    rf"([:,]){name}=\d+", rf"\g<1>{name}={peaks[(uri, name)]}", line
+                )
+        stitched[index] = line
+    return "\n".join(stitched) + "\n"
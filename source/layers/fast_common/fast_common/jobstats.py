@@ -0,0 +1,175 @@
+"""
+MediaConvert Job Statistics
+
+Records the timing and output of every completed MediaConvert job as CSV rows,
+one per rendition, so queue wait, encode speed and bytes per rung can be
+analysed across the library. Each job is written to S3 under a date partition
+(``<JobStatsPrefix>date=YYYY-MM-DD/<job id>.csv``), which Athena and
+``transcode_report.py`` read directly. When ``JobStatsPath`` is set, rows are
+appended to that local file instead, for the simulator and local runs.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import logging
+import os
+import posixpath
+import threading
+from datetime import UTC, datetime
+from typing import Any
+
+from fast_common.clients import get_client
+from fast_common.tracing import CORRELATION_ID_KEY, format_timestamp, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREFIX = "analytics/mediaconvert/"
+
+# Serializes appends to the local file when handlers run on several threads
+_local_lock = threading.Lock()
+
+# One row per rendition; the job columns repeat on every row of a job
+COLUMNS = (
+    "JobId",
+    "Queue",
+    "CorrelationId",
+    "Playlist",
+    "SubmitTime",
+    "StartTime",
+    "FinishTime",
+    "QueueSeconds",
+    "TranscodeSeconds",
+    "ProgramMillis",
+    "Rung",
+    "Type",
+    "Resolution",
+    "Bandwidth",
+    "Codecs",
+    "DurationMillis",
+    "SegmentCount",
+    "Bytes",
+)
+
+
+def _to_datetime(value: Any) -> datetime | None:
+    """Convert an epoch millisecond or ISO 8601 job timing value to a datetime."""
+    if value in (None, ""):
+        return None
+    if isinstance(value, int | float):
+        return datetime.fromtimestamp(value / 1000, UTC)
+    try:
+        return parse_timestamp(str(value))
+    except ValueError:
+        return None
+
+
+def get_job_timing(detail: dict[str, Any]) -> dict[str, Any]:
+    """
+    Return the submit, start and finish times of a job state change event.
+
+    Adds ``QueueSeconds`` (submit to start) and ``TranscodeSeconds`` (start to
+    finish) when the times they need are present.
+    """
+    timing = detail.get("timing") or {}
+    times = {
+        "SubmitTime": _to_datetime(timing.get("submitTime")),
+        "StartTime": _to_datetime(timing.get("startTime")),
+        "FinishTime": _to_datetime(timing.get("finishTime")),
+    }
+    result: dict[str, Any] = {
+        key: format_timestamp(value) if value else "" for key, value in times.items()
+    }
+    if times["SubmitTime"] and times["StartTime"]:
+        result["QueueSeconds"] = round(
+            (times["StartTime"] - times["SubmitTime"]).total_seconds(), 3
+        )
+    if times["StartTime"] and times["FinishTime"]:
+        result["TranscodeSeconds"] = round(
+            (times["FinishTime"] - times["StartTime"]).total_seconds(), 3
+        )
+    return result
+
+
+def get_rung_name(master_key: str, playlist_key: str) -> str:
+    """Return the name modifier that distinguishes a rendition playlist from its master."""
+    stem = posixpath.splitext(posixpath.basename(master_key))[0]
+    name = posixpath.splitext(posixpath.basename(playlist_key))[0]
+    return name[len(stem):] if name.startswith(stem) and name != stem else name
+
+
+def build_rows(detail: dict[str, Any], info: dict[str, Any]) -> list[dict[str, Any]]:
+    """Build one row per rendition from a COMPLETE event and the inspected playlists."""
+    job = {
+        "JobId": detail.get("jobId", ""),
+        "Queue": detail.get("queue", "").rsplit("/", 1)[-1],
+        "CorrelationId": (detail.get("userMetadata") or {}).get(CORRELATION_ID_KEY, ""),
+        "Playlist": info["Playlist"],
+        "ProgramMillis": info["DurationMillis"],
+        **get_job_timing(detail),
+    }
+    return [
+        {
+            **job,
+            "Rung": get_rung_name(info["Playlist"], variant["Uri"]),
+            "Type": variant.get("Type", "VIDEO"),
+            "Resolution": variant.get("Resolution", ""),
+            "Bandwidth": variant.get("Bandwidth", ""),
+            "Codecs": variant.get("Codecs", ""),
+            "DurationMillis": variant["DurationMillis"],
+            "SegmentCount": variant["SegmentCount"],
+            "Bytes": variant.get("Bytes", ""),
+        }
+        for variant in info["Variants"]
+    ]
+
+
+def format_rows(rows: list[dict[str, Any]], header: bool = True) -> str:
+    """Format rows as CSV in the order of COLUMNS."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS, extrasaction="ignore", lineterminator="\n")
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def get_stats_key(job_id: str, finish_time: str = "", prefix: str | None = None) -> str:
+    """Return the S3 key of a job's rows, partitioned by the day the job finished."""
+    if prefix is None:
+        prefix = os.environ.get("JobStatsPrefix", DEFAULT_PREFIX)
+    day = (finish_time or format_timestamp())[:10]
+    return f"{prefix}date={day}/{job_id or 'unknown'}.csv"
+
+
+def write_job_stats(rows: list[dict[str, Any]]) -> str | None:
+    """
+    Write the rows of a job to the local file or S3 bucket configured.
+
+    Returns the location written, or None when neither ``JobStatsPath`` nor
+    ``JobStatsBucket`` is set.
+    """
+    if not rows:
+        return None
+
+    path = os.environ.get("JobStatsPath")
+    if path:
+        with _local_lock:
+            exists = os.path.exists(path) and os.path.getsize(path) > 0
+            with open(path, "a", encoding="utf-8", newline="") as stats_file:
+                stats_file.write(format_rows(rows, header=not exists))
+        return path
+
+    bucket = os.environ.get("JobStatsBucket")
+    if not bucket:
+        return None
+
+    key = get_stats_key(rows[0]["JobId"], rows[0].get("FinishTime", ""))
+    get_client("s3").put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=format_rows(rows).encode("utf-8"),
+        ContentType="text/csv",
+    )
+    logger.info("Wrote %d job statistics rows to s3://%s/%s", len(rows), bucket, key)
+    return f"s3://{bucket}/{key}"
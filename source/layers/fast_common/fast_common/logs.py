@@ -0,0 +1,72 @@
+"""
+Lazy and Sampled Log Arguments
+
+Handlers log events, job settings and API requests as JSON. Calling
+``json.dumps`` in the arguments of a log call serializes them on every
+invocation, even when the level is disabled and the message is dropped.
+``as_json`` wraps a value so it is only serialized when a record is actually
+formatted, and truncates the result to ``LogMaxChars`` characters so a
+multi-KB job settings dump does not become a multi-KB log line.
+
+Messages logged for every item of a busy pipeline can also be sampled with
+``log_sampled``, which keeps the share set by ``LogSampleRate`` or by the
+call itself. Warnings and errors should never be sampled.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+from typing import Any
+
+DEFAULT_MAX_CHARS = 4096
+
+
+def get_max_chars() -> int:
+    """Return the length JSON log arguments are truncated to, from ``LogMaxChars`` (0 disables)."""
+    return int(os.environ.get("LogMaxChars", DEFAULT_MAX_CHARS))
+
+
+def get_sample_rate() -> float:
+    """Return the share of sampled messages that are logged, from ``LogSampleRate``."""
+    return float(os.environ.get("LogSampleRate", "1"))
+
+
+class LazyJson:
+    """A log argument that serializes its value to JSON when the record is formatted."""
+
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value: Any, max_chars: int | None = None):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        text = json.dumps(self.value, default=str)
+        max_chars = get_max_chars() if self.max_chars is None else self.max_chars
+        if max_chars and len(text) > max_chars:
+            return f"{text[:max_chars]}... ({len(text)} chars)"
+        return text
+
+    __repr__ = __str__
+
+
+def as_json(value: Any, max_chars: int | None = None) -> LazyJson:
+    """Wrap a value to be logged as JSON, serialized only if the message is emitted."""
+    return LazyJson(value, max_chars)
+
+
+def log_sampled(
+    logger: logging.Logger,
+    level: int,
+    message: str,
+    *args: Any,
+    rate: float | None = None,
+) -> None:
+    """Log a message for a share of calls, ``rate`` or ``LogSampleRate`` by default."""
+    if not logger.isEnabledFor(level):
+        return
+    if random.random() < (get_sample_rate() if rate is None else rate):
+        # stacklevel reports the caller instead of this function
+        logger.log(level, message, *args, stacklevel=2)
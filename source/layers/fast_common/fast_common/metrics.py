@@ -0,0 +1,204 @@
+"""
+AWS API Call Metrics
+
+Registers botocore event hooks on every client to time each API call and
+count its errors, retries and throttled attempts. Adaptive retries otherwise
+hide throttling: a call that succeeds on its third attempt looks like a slow
+call. The totals are aggregated per service and operation and written as
+CloudWatch Embedded Metric Format (EMF) lines once per invocation by handlers
+decorated with ``emit_api_metrics``. An operation called more than 100 times
+in one invocation gets one extra line per further 100 latencies, so no call is
+left out of the percentiles.
+
+Set ``MetricsSampleRate`` between 0 and 1 to emit metrics for only a share of
+invocations, and ``MetricsNamespace`` to change the CloudWatch namespace.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import os
+import random
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+DEFAULT_NAMESPACE = "FastChannels"
+
+# EMF accepts at most 100 values per metric in one document
+MAX_VALUES = 100
+
+THROTTLING_ERROR_CODES = frozenset({
+    "BandwidthLimitExceeded",
+    "LimitExceededException",
+    "PriorRequestNotComplete",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "SlowDown",
+    "ThrottledException",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+})
+
+_stats: dict[tuple[str, str], dict[str, Any]] = {}
+_lock = threading.Lock()
+
+
+def _get_stats(service: str, operation: str) -> dict[str, Any]:
+    """Return the running totals of an operation. Caller holds the lock."""
+    key = (service, operation)
+    if key not in _stats:
+        _stats[key] = {"latencies": [], "calls": 0, "errors": 0, "retries": 0, "throttles": 0}
+    return _stats[key]
+
+
+def _error_code(parsed: dict[str, Any] | None) -> str:
+    return (parsed or {}).get("Error", {}).get("Code", "")
+
+
+def _before_call(context: dict[str, Any], **_: Any) -> None:
+    context["metrics_start"] = time.perf_counter()
+
+
+def _after_call(
+    service: str,
+    http_response: Any,
+    parsed: dict[str, Any],
+    model: Any,
+    context: dict[str, Any],
+    **_: Any,
+) -> None:
+    start = context.get("metrics_start")
+    latency = (time.perf_counter() - start) * 1000 if start else None
+    status = getattr(http_response, "status_code", 200)
+    retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+
+    with _lock:
+        stats = _get_stats(service, model.name)
+        stats["calls"] += 1
+        stats["retries"] += retries
+        if status >= 300:
+            stats["errors"] += 1
+        if latency is not None:
+            stats["latencies"].append(latency)
+
+
+def _after_call_error(
+    service: str,
+    context: dict[str, Any],
+    event_name: str = "",
+    **_: Any,
+) -> None:
+    # Emitted with only the exception and context, so the operation is read
+    # from the event name: after-call-error.<service>.<Operation>
+    start = context.get("metrics_start")
+    operation = event_name.rsplit(".", 1)[-1]
+    with _lock:
+        stats = _get_stats(service, operation)
+        stats["calls"] += 1
+        stats["errors"] += 1
+        if start:
+            stats["latencies"].append((time.perf_counter() - start) * 1000)
+
+
+def _needs_retry(
+    service: str,
+    operation: Any,
+    response: tuple[Any, dict[str, Any]] | None = None,
+    **_: Any,
+) -> None:
+    # Called after every attempt, including the ones botocore retries silently
+    if response and _error_code(response[1]) in THROTTLING_ERROR_CODES:
+        with _lock:
+            _get_stats(service, operation.name)["throttles"] += 1
+
+
+def instrument(client: Any) -> Any:
+    """Register the metrics hooks on a boto3 client and return it."""
+    service = client.meta.service_model.service_name
+    events = client.meta.events
+    events.register("before-call.*.*", _before_call)
+    events.register("after-call.*.*", functools.partial(_after_call, service))
+    events.register("after-call-error.*.*", functools.partial(_after_call_error, service))
+    events.register("needs-retry.*.*", functools.partial(_needs_retry, service))
+    return client
+
+
+def format_metrics(function_name: str = "", namespace: str | None = None) -> list[str]:
+    """
+    Return the EMF lines of every operation called since the last flush, and reset the totals.
+
+    Each operation gets one line with its counts and first ``MAX_VALUES``
+    latencies, and one line per further ``MAX_VALUES`` latencies.
+    """
+    namespace = namespace or os.environ.get("MetricsNamespace", DEFAULT_NAMESPACE)
+    with _lock:
+        stats = dict(_stats)
+        _stats.clear()
+
+    timestamp = int(time.time() * 1000)
+    lines = []
+    for (service, operation), totals in sorted(stats.items()):
+        latencies = [round(value, 1) for value in totals["latencies"]]
+        chunks = [
+            latencies[start:start + MAX_VALUES] for start in range(0, len(latencies), MAX_VALUES)
+        ] or [[]]
+        for index, chunk in enumerate(chunks):
+            metrics = [{"Name": "ApiLatency", "Unit": "Milliseconds"}]
+            document = {
+                "Service": service,
+                "Operation": operation,
+                "FunctionName": function_name,
+                "ApiLatency": chunk,
+            }
+            # Counts are written once, with the first latencies
+            if index == 0:
+                metrics += [
+                    {"Name": "ApiCalls", "Unit": "Count"},
+                    {"Name": "ApiErrors", "Unit": "Count"},
+                    {"Name": "ApiRetries", "Unit": "Count"},
+                    {"Name": "ApiThrottles", "Unit": "Count"},
+                ]
+                document.update({
+                    "ApiCalls": totals["calls"],
+                    "ApiErrors": totals["errors"],
+                    "ApiRetries": totals["retries"],
+                    "ApiThrottles": totals["throttles"],
+                })
+            lines.append(json.dumps({
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": namespace,
+                            "Dimensions": [["Service", "Operation"]],
+                            "Metrics": metrics,
+                        }
+                    ],
+                },
+                **document,
+            }))
+    return lines
+
+
+def flush_metrics(function_name: str = "") -> None:
+    """Print the EMF lines of this invocation, subject to ``MetricsSampleRate``."""
+    lines = format_metrics(function_name)
+    sample_rate = float(os.environ.get("MetricsSampleRate", "1"))
+    if lines and random.random() < sample_rate:
+        print("\n".join(lines), flush=True)
+
+
+def emit_api_metrics(handler: Callable[[Any, Any], Any]) -> Callable[[Any, Any], Any]:
+    """Decorate a Lambda handler to emit its API call metrics when it returns or raises."""
+    @functools.wraps(handler)
+    def wrapper(event: Any, context: Any) -> Any:
+        try:
+            return handler(event, context)
+        finally:
+            flush_metrics(getattr(context, "function_name", "") or "")
+    return wrapper
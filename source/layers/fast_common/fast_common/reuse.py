@@ -0,0 +1,230 @@
+"""
+Content-Addressed Transcode Reuse
+
+The same mezzanine file often arrives more than once, as a re-delivery or
+after a move between folders. A source is identified by a fingerprint of its
+content, and every completed transcode is indexed in S3 under a key derived
+from that fingerprint, the job template and the ad offsets, which together
+decide the output. When a new upload matches an index entry, its existing
+HLS output is packaged again with the new tags instead of being re-encoded.
+
+Fingerprints, in order of preference:
+ - a full-object S3 checksum (CRC64NVME, CRC32, CRC32C, SHA1 or SHA256)
+ - the ETag of a single-part upload not encrypted with KMS, which is its MD5
+ - in ``SAMPLED`` mode, a SHA-256 of the size and evenly spaced range reads
+
+Every packaged upload also gets a source record, keyed by its bucket and key,
+with the ETag and ad offsets it was packaged with. When only the tags of the
+object change afterwards, the record identifies the asset to update, so new
+ad breaks are applied without transcoding or packaging again.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+from typing import Any
+
+from fast_common.clients import get_client
+from fast_common.tracing import format_timestamp
+
+logger = logging.getLogger(__name__)
+
+REUSE_MODES = ("DISABLED", "CHECKSUM", "SAMPLED")
+
+DEFAULT_PREFIX = "index/transcodes/"
+DEFAULT_SOURCE_PREFIX = "index/sources/"
+
+# User metadata that carries the index key through the job, and marks reuse
+REUSE_KEY = "TranscodeReuseKey"
+REUSED_JOB_KEY = "ReusedJobId"
+
+# User metadata that identifies the source object and its content
+SOURCE_ID_KEY = "SourceId"
+SOURCE_ETAG_KEY = "SourceETag"
+
+# Event the MediaConvert function emits in place of a COMPLETE event on reuse
+REUSED_DETAIL_TYPE = "MediaConvert Job Reused"
+
+# Event the MediaConvert function emits when only the ad offsets changed
+AD_BREAKS_DETAIL_TYPE = "Ad Breaks Changed"
+
+CHECKSUM_FIELDS = (
+    "ChecksumCRC64NVME",
+    "ChecksumSHA256",
+    "ChecksumSHA1",
+    "ChecksumCRC32C",
+    "ChecksumCRC32",
+)
+
+# Range reads hashed for a sampled fingerprint
+SAMPLE_COUNT = 16
+SAMPLE_BYTES = 1024 * 1024
+
+
+def get_reuse_mode() -> str:
+    """Return the ``TranscodeReuse`` mode, raising ValueError for unknown modes."""
+    mode = os.environ.get("TranscodeReuse", "DISABLED").upper()
+    if mode not in REUSE_MODES:
+        raise ValueError(f"Invalid TranscodeReuse: {mode}. Must be one of {REUSE_MODES}")
+    return mode
+
+
+def get_checksum_fingerprint(head: dict[str, Any]) -> str | None:
+    """Return a fingerprint from the checksum or ETag of a HeadObject response."""
+    if head.get("ChecksumType", "FULL_OBJECT") == "FULL_OBJECT":
+        for field in CHECKSUM_FIELDS:
+            if head.get(field):
+                return f"{field.removeprefix('Checksum').lower()}:{head[field]}"
+
+    etag = head.get("ETag", "").strip('"')
+    # Multipart ETags depend on the part size, and KMS ETags are not an MD5
+    if etag and "-" not in etag and head.get("ServerSideEncryption") != "aws:kms":
+        return f"md5:{etag}"
+    return None
+
+
+def get_sampled_fingerprint(bucket: str, key: str, size: int) -> str:
+    """Hash the size of an object and ``SAMPLE_COUNT`` evenly spaced ranges of it."""
+    import hashlib
+    from concurrent.futures import ThreadPoolExecutor
+
+    s3 = get_client("s3")
+    if size <= SAMPLE_COUNT * SAMPLE_BYTES:
+        ranges = [(0, size - 1)] if size else []
+    else:
+        step = (size - SAMPLE_BYTES) // (SAMPLE_COUNT - 1)
+        ranges = [(index * step, index * step + SAMPLE_BYTES - 1) for index in range(SAMPLE_COUNT)]
+
+    def read(byte_range: tuple[int, int]) -> bytes:
+        return s3.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes={byte_range[0]}-{byte_range[1]}"
+        )["Body"].read()
+
+    digest = hashlib.sha256(str(size).encode())
+    with ThreadPoolExecutor(max_workers=min(len(ranges), 8) or 1) as executor:
+        for sample in executor.map(read, ranges):
+            digest.update(sample)
+    return f"sampled:{digest.hexdigest()}"
+
+
+def head_source(bucket: str, key: str) -> dict[str, Any]:
+    """Return the HeadObject response of a source, with its checksum if it has one."""
+    return get_client("s3").head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+
+
+def get_fingerprint(bucket: str, key: str, mode: str, head: dict[str, Any]) -> str | None:
+    """Return the content fingerprint of an object, or None if it cannot be trusted."""
+    if mode == "DISABLED":
+        return None
+    fingerprint = get_checksum_fingerprint(head)
+    if fingerprint is None and mode == "SAMPLED":
+        fingerprint = get_sampled_fingerprint(bucket, key, head.get("ContentLength", 0))
+    return fingerprint
+
+
+def get_reuse_key(
+    fingerprint: str, template: dict[str, Any], ad_offsets: list[str] | None
+) -> str:
+    """Return the index key of the output a source would get from a job template."""
+    import hashlib
+
+    identity = {
+        "Fingerprint": fingerprint,
+        "JobTemplate": template["Name"],
+        "TemplateUpdated": str(template.get("LastUpdated", "")),
+        "AdOffsets": " ".join(ad_offsets or []),
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+
+def get_source_id(bucket: str, key: str) -> str:
+    """Return the short, tag-safe identifier of a source object's bucket and key."""
+    import hashlib
+
+    return hashlib.sha256(f"{bucket}/{key}".encode()).hexdigest()[:32]
+
+
+def _get_index_location(
+    name: str, prefix_variable: str, default_prefix: str
+) -> tuple[str, str] | None:
+    bucket = os.environ.get("TranscodeIndexBucket")
+    if not bucket:
+        return None
+    return bucket, f"{os.environ.get(prefix_variable, default_prefix)}{name}.json"
+
+
+def _read_location(location: tuple[str, str] | None) -> dict[str, Any] | None:
+    if location is None:
+        return None
+    s3 = get_client("s3")
+    try:
+        body = s3.get_object(Bucket=location[0], Key=location[1])["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(body)
+
+
+def _write_location(location: tuple[str, str] | None, entry: dict[str, Any]) -> str | None:
+    if location is None:
+        return None
+    get_client("s3").put_object(
+        Bucket=location[0],
+        Key=location[1],
+        Body=json.dumps(entry).encode("utf-8"),
+        ContentType="application/json",
+    )
+    return f"s3://{location[0]}/{location[1]}"
+
+
+def read_index(reuse_key: str) -> dict[str, Any] | None:
+    """Return the index entry of a reuse key, or None when there is none."""
+    return _read_location(_get_index_location(reuse_key, "TranscodeIndexPrefix", DEFAULT_PREFIX))
+
+
+def find_reusable_output(reuse_key: str) -> dict[str, Any] | None:
+    """Return the index entry of a reuse key if its master playlist still exists."""
+    from urllib.parse import urlparse
+
+    entry = read_index(reuse_key)
+    if entry is None:
+        return None
+
+    parsed = urlparse(entry["Playlist"])
+    s3 = get_client("s3")
+    try:
+        s3.head_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"))
+    except s3.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        logger.info("Indexed output %s no longer exists", entry["Playlist"])
+        return None
+    return entry
+
+
+def write_index(reuse_key: str, detail: dict[str, Any], playlist: str) -> str | None:
+    """Index the output of a completed job under its reuse key."""
+    entry = {
+        "JobId": detail.get("jobId", ""),
+        "Playlist": playlist,
+        "OutputGroupDetails": detail.get("outputGroupDetails", []),
+        "IndexedAt": format_timestamp(),
+    }
+    return _write_location(
+        _get_index_location(reuse_key, "TranscodeIndexPrefix", DEFAULT_PREFIX), entry
+    )
+
+
+def read_source_record(source_id: str) -> dict[str, Any] | None:
+    """Return the record of the last packaging of a source, or None when there is none."""
+    return _read_location(
+        _get_index_location(source_id, "SourceIndexPrefix", DEFAULT_SOURCE_PREFIX)
+    )
+
+
+def write_source_record(source_id: str, record: dict[str, Any]) -> str | None:
+    """Record the asset a source was packaged as, with its ETag and ad offsets."""
+    return _write_location(
+        _get_index_location(source_id, "SourceIndexPrefix", DEFAULT_SOURCE_PREFIX),
+        {**record, "SourceId": source_id, "RecordedAt": format_timestamp()},
+    )
@@ -0,0 +1,86 @@
+"""
+Channel Scheduling
+
+LOOP channels play their programs over and over, in the order they were
+added. LINEAR channels play programs at the times they are scheduled, so they
+need programs added ahead of the wall clock and removed once they have aired.
+The refill worker keeps each LINEAR channel filled for the next hours from a
+rotation pool: every VOD source of the source location except the slates,
+taken in name order and resumed after the last source scheduled. Each new
+program starts right after the previous one through a RELATIVE transition,
+and a schedule that ran dry starts again at an ABSOLUTE time.
+
+Programs are named after their VOD source and expected start time, so the
+same VOD source can be scheduled many times on one channel.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any
+
+PLAYBACK_MODES = ("LOOP", "LINEAR")
+
+# Tag of the slate assets and VOD sources that the slates custom resource registers
+SLATE_TAG_KEY = "SlateDurationMillis"
+
+# Slate played during ad breaks that no ad fills
+AD_BREAK_SLATE = "AdBreakSlate30000"
+
+
+def create_ad_breaks(tags: dict[str, str], source_location: str) -> list[dict[str, Any]]:
+    """Create ad break configurations from asset tags."""
+    ad_breaks = []
+
+    offsets_str = tags.get("AdOffsets", "")
+    if not offsets_str:
+        return ad_breaks
+
+    offsets = offsets_str.split()
+
+    for index, offset in enumerate(offsets):
+        ad_breaks.append({
+            "OffsetMillis": int(offset),
+            "MessageType": "SPLICE_INSERT",
+            "SpliceInsertMessage": {
+                "AvailNum": index,
+                "AvailsExpected": 1,
+                "SpliceEventId": index,
+                "UniqueProgramId": index,
+            },
+            "Slate": {
+                "SourceLocationName": source_location,
+                "VodSourceName": AD_BREAK_SLATE,
+            },
+        })
+
+    return ad_breaks
+
+
+def is_slate(vod_source: dict[str, Any]) -> bool:
+    """Return whether a VOD source is an ad break or filler slate."""
+    return SLATE_TAG_KEY in vod_source.get("Tags", {}) or vod_source[
+        "VodSourceName"
+    ].startswith("AdBreakSlate")
+
+
+def get_rotation_pool(vod_sources: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Return the VOD sources a LINEAR channel rotates through, in name order."""
+    pool = [vod_source for vod_source in vod_sources if not is_slate(vod_source)]
+    return sorted(pool, key=lambda vod_source: vod_source["VodSourceName"])
+
+
+def get_next_source(
+    pool: list[dict[str, Any]], last_vod_source_name: str | None
+) -> dict[str, Any]:
+    """Return the VOD source that follows the last one scheduled, wrapping around the pool."""
+    names = [vod_source["VodSourceName"] for vod_source in pool]
+    if last_vod_source_name not in names:
+        # Resume at the first source after the last one, which may have left the pool
+        following = [name > (last_vod_source_name or "") for name in names]
+        return pool[following.index(True) if any(following) else 0]
+    return pool[(names.index(last_vod_source_name) + 1) % len(pool)]
+
+
+def get_program_name(vod_source_name: str, start: datetime) -> str:
+    """Return the unique name of a program of a VOD source starting at ``start``."""
+    return f"{vod_source_name}-{int(start.timestamp())}"
@@ -0,0 +1,88 @@
+"""
+Correlation IDs and Stage Timestamps
+
+Each upload gets a correlation ID when its MediaConvert job is created. The ID
+and a UTC timestamp for every pipeline stage travel through the job user
+metadata into MediaPackage asset tags, MediaTailor VOD source tags and the
+Playback URLs event, so the time from upload to playable can be measured for
+every asset.
+"""
+from __future__ import annotations
+
+from datetime import UTC, datetime
+from typing import Any
+
+CORRELATION_ID_KEY = "CorrelationId"
+
+# Stage transition timestamps, in pipeline order
+STAGE_KEYS = (
+    "UploadedAt",
+    "TranscodeSubmittedAt",
+    "TranscodedAt",
+    "PackagingStartedAt",
+    "PlayableAt",
+    "VodSourceCreatedAt",
+)
+
+# End-to-end latency measured by the time-to-playable SLA
+TIME_TO_PLAYABLE = ("UploadedAt", "PlayableAt")
+
+
+def new_correlation_id() -> str:
+    """Return a new correlation ID."""
+    import uuid
+
+    return str(uuid.uuid4())
+
+
+def format_timestamp(value: datetime | None = None) -> str:
+    """Format a time (default now) as an ISO 8601 UTC timestamp with milliseconds."""
+    value = (value or datetime.now(UTC)).astimezone(UTC)
+    return value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}Z"
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp such as the ``time`` of an EventBridge event."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=UTC)
+
+
+def get_event_timestamp(event: dict[str, Any]) -> str:
+    """Return the time an EventBridge event occurred, or now for events without one."""
+    if event.get("time"):
+        try:
+            return format_timestamp(parse_timestamp(event["time"]))
+        except ValueError:
+            pass
+    return format_timestamp()
+
+
+def get_stage_times(tags: dict[str, str]) -> dict[str, str]:
+    """Return the stage timestamps found in a set of tags, in pipeline order."""
+    return {key: tags[key] for key in STAGE_KEYS if tags.get(key)}
+
+
+def get_stage_durations(tags: dict[str, str]) -> dict[str, float]:
+    """
+    Return the seconds spent between consecutive recorded stages.
+
+    Keys are ``<from>-><to>`` for each pair of consecutive stages present in
+    the tags, plus ``TimeToPlayable`` when the upload and playable times are
+    both known.
+    """
+    times = {}
+    for key, value in get_stage_times(tags).items():
+        try:
+            times[key] = parse_timestamp(value)
+        except ValueError:
+            continue
+
+    durations = {}
+    recorded = list(times.items())
+    for (previous, start), (current, end) in zip(recorded, recorded[1:], strict=False):
+        durations[f"{previous}->{current}"] = (end - start).total_seconds()
+
+    start_key, end_key = TIME_TO_PLAYABLE
+    if start_key in times and end_key in times:
+        durations["TimeToPlayable"] = (times[end_key] - times[start_key]).total_seconds()
+    return durations
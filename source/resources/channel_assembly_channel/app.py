@@ -2,17 +2,39 @@
 MediaTailor Channel Assembly Channel Custom Resource
 
 CloudFormation custom resource for creating and managing MediaTailor channels.
+
+A single resource can manage a fleet of channels through the optional
+``Channels`` property. Channels are created, updated and deleted concurrently,
+and updates only touch the channels whose specification changed.
+
+Every channel is tagged with a claim of each resource that manages it. A
+stack update that removes channels returns a new physical resource ID, so the
+removed channels are deleted when CloudFormation cleans up the old resource
+after the update succeeds, and not at all if the update rolls back. A delete
+drops the resource's claim and deletes only the channels no other resource
+claims.
+
+Channels play in ``LOOP`` mode unless ``PlaybackMode`` (for every channel, or
+per channel spec) is ``LINEAR``. LINEAR channels fill gaps in their schedule
+with ``FillerSlate``, and are kept scheduled by the refill worker.
 """
 from __future__ import annotations
 
+import hashlib
 import json
 import logging
 import os
+import uuid
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Any
 
-import boto3
-from botocore.config import Config
 from crhelper import CfnResource
+from fast_common.clients import get_client
+from fast_common.governor import is_not_found
+from fast_common.logs import as_json
+from fast_common.metrics import emit_api_metrics
+from fast_common.schedule import PLAYBACK_MODES
 
 # Configure logging
 boto_level = os.environ.get("LOG_LEVEL", "INFO").upper()
@@ -30,35 +52,54 @@ helper = CfnResource(
     ssl_verify=None,
 )
 
-# Initialize AWS clients
-config = Config(retries={"max_attempts": 3, "mode": "adaptive"})
-mediatailor = boto3.client("mediatailor", config=config)
-mediapackage = boto3.client("mediapackage-vod", config=config)
+# Maximum number of channels processed in parallel
+DEFAULT_MAX_CONCURRENCY = 8
 
+# Channel properties that UpdateChannel cannot change in place, and their defaults
+IMMUTABLE_CHANNEL_KEYS = ("PlaybackMode", "Tier")
+CHANNEL_DEFAULTS = {"PlaybackMode": "LOOP", "Tier": "BASIC"}
 
-def get_channel_outputs_from_mediapackage(packaging_group_id: str) -> list[dict[str, Any]]:
+# Tags that record which physical resources manage a channel
+CLAIM_TAG_PREFIX = "fast-channels:claim:"
+
+
+def list_packaging_configurations(packaging_group_id: str) -> list[dict[str, Any]]:
+    """List every packaging configuration in a MediaPackage packaging group."""
+    paginator = get_client("mediapackage-vod").get_paginator("list_packaging_configurations")
+    configurations = []
+
+    for page in paginator.paginate(PackagingGroupId=packaging_group_id):
+        configurations.extend(page.get("PackagingConfigurations", []))
+
+    logger.info("Found %d packaging configurations", len(configurations))
+    return configurations
+
+
+def build_channel_outputs(
+    packaging_configurations: list[dict[str, Any]],
+    source_groups: list[str] | None = None,
+) -> list[dict[str, Any]]:
     """Generate channel outputs from MediaPackage packaging configurations."""
     outputs = []
-    
-    response = mediapackage.list_packaging_configurations(
-        PackagingGroupId=packaging_group_id
-    )
-    
-    for config in response.get("PackagingConfigurations", []):
+
+    for config in packaging_configurations:
+        if source_groups and config["Id"] not in source_groups:
+            continue
+
         logger.info("Processing packaging configuration: %s", config.get("Id"))
-        
+
         output_base = {
             "ManifestName": config["Id"],
             "SourceGroup": config["Id"],
         }
-        
+
         if "HlsPackage" in config or "CmafPackage" in config:
             output = {
                 **output_base,
                 "HlsPlaylistSettings": {"ManifestWindowSeconds": 60},
             }
             outputs.append(output)
-        
+
         if "DashPackage" in config:
             output = {
                 **output_base,
@@ -70,34 +111,141 @@ def get_channel_outputs_from_mediapackage(packaging_group_id: str) -> list[dict[
                 },
             }
             outputs.append(output)
-    
+
     logger.info("Generated %d channel outputs", len(outputs))
     return outputs
 
 
-@helper.create
-def create(event: dict[str, Any], context: Any) -> str:
-    """Handle CloudFormation Create event."""
-    logger.info("Processing Create request")
-    
-    properties = event["ResourceProperties"]
-    packaging_group_id = properties["MediaPackagePackagingGroup"]["Id"]
-    physical_resource_id = event.get("PhysicalResourceId") or properties.get("Name")
+def get_channel_outputs_from_mediapackage(packaging_group_id: str) -> list[dict[str, Any]]:
+    """Generate channel outputs from MediaPackage packaging configurations."""
+    return build_channel_outputs(list_packaging_configurations(packaging_group_id))
+
+
+def get_default_name(properties: dict[str, Any], physical_resource_id: str) -> str:
+    """Return the name of the channel of a resource without a ``Channels`` property."""
+    return properties.get("Name") or physical_resource_id
+
+
+def get_claim_tag_key(physical_resource_id: str) -> str:
+    """Return the tag key that records a physical resource's claim on a channel."""
+    return CLAIM_TAG_PREFIX + hashlib.sha256(physical_resource_id.encode()).hexdigest()[:16]
+
+
+def get_channel_specs(properties: dict[str, Any], default_name: str) -> list[dict[str, Any]]:
+    """
+    Return the channel specifications declared by the resource properties.
+
+    Without a ``Channels`` property the resource manages one channel named
+    after the resource, as it always has. Specs default to the resource's
+    ``PlaybackMode`` (LOOP if unset), and LINEAR specs to its ``FillerSlate``.
+    """
+    specs = properties.get("Channels") or [{"Name": default_name}]
+
+    names = [spec["Name"] for spec in specs]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate channel names: {', '.join(sorted(duplicates))}")
+
+    resolved = []
+    for spec in specs:
+        spec = {"PlaybackMode": properties.get("PlaybackMode", "LOOP"), **spec}
+        if spec["PlaybackMode"] not in PLAYBACK_MODES:
+            raise ValueError(
+                f"Invalid PlaybackMode for {spec['Name']}: {spec['PlaybackMode']}. "
+                f"Must be one of {PLAYBACK_MODES}"
+            )
+        if spec["PlaybackMode"] == "LINEAR":
+            spec.setdefault("FillerSlate", properties.get("FillerSlate"))
+            if not spec["FillerSlate"]:
+                raise ValueError(f"LINEAR channel {spec['Name']} needs a FillerSlate")
+        else:
+            spec.pop("FillerSlate", None)
+        resolved.append(spec)
 
-    outputs = get_channel_outputs_from_mediapackage(packaging_group_id)
-    
-    channel = mediatailor.create_channel(
-        ChannelName=physical_resource_id,
-        Outputs=outputs,
-        PlaybackMode="LOOP",
-        Tags={
-            "stack-id": event["StackId"],
-            "stack-name": properties["StackName"],
-        },
+    return resolved
+
+
+def diff_channel_specs(
+    old_specs: list[dict[str, Any]],
+    new_specs: list[dict[str, Any]],
+    force_update: bool = False,
+) -> dict[str, list[dict[str, Any]]]:
+    """
+    Compare two sets of channel specifications by channel name.
+
+    Returns the specs to create, recreate, update and delete, plus the
+    unchanged specs. ``force_update`` treats every surviving channel as changed,
+    for example when the packaging group (and therefore every output) changed.
+    """
+    old_by_name = {spec["Name"]: spec for spec in old_specs}
+    new_by_name = {spec["Name"]: spec for spec in new_specs}
+
+    diff: dict[str, list[dict[str, Any]]] = {
+        "create": [],
+        "recreate": [],
+        "update": [],
+        "delete": [spec for name, spec in old_by_name.items() if name not in new_by_name],
+        "unchanged": [],
+    }
+
+    for name, spec in new_by_name.items():
+        old_spec = old_by_name.get(name)
+        if old_spec is None:
+            diff["create"].append(spec)
+        elif any(old_spec.get(key) != spec.get(key) for key in IMMUTABLE_CHANNEL_KEYS):
+            diff["recreate"].append(spec)
+        elif force_update or old_spec != spec:
+            diff["update"].append(spec)
+        else:
+            diff["unchanged"].append(spec)
+
+    logger.info(
+        "Channel diff: %s",
+        as_json({action: [spec["Name"] for spec in specs] for action, specs in diff.items()}),
     )
-    logger.info("Created channel: %s", channel["ChannelName"])
+    return diff
+
+
+def run_concurrently(
+    func: Callable[[dict[str, Any]], Any],
+    specs: list[dict[str, Any]],
+    max_workers: int = DEFAULT_MAX_CONCURRENCY,
+) -> dict[str, Any]:
+    """
+    Apply ``func`` to every channel spec in parallel.
+
+    All channels are attempted even if some fail; failures are reported
+    together so a retry only needs to converge the channels that failed.
+    """
+    if not specs:
+        return {}
+
+    results = {}
+    errors = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(specs)))) as executor:
+        futures = {executor.submit(func, spec): spec["Name"] for spec in specs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as error:
+                logger.error("Channel %s failed: %s", name, error)
+                errors[name] = str(error)
+
+    if errors:
+        raise ValueError(f"Failed to process channels: {json.dumps(errors)}")
+
+    return results
+
+
+def get_playback_base_url(channel: dict[str, Any]) -> str:
+    """Extract the playback base URL of a channel for CloudFormation outputs."""
+    return channel["Outputs"][0]["PlaybackUrl"].rsplit("/", 1)[0]
+
 
-    # Create channel policy allowing anonymous manifest access
+def put_anonymous_channel_policy(channel_name: str, channel_arn: str) -> None:
+    """Apply a channel policy allowing anonymous manifest access."""
     policy = {
         "Version": "2012-10-17",
         "Statement": [
@@ -106,19 +254,211 @@ def create(event: dict[str, Any], context: Any) -> str:
                 "Effect": "Allow",
                 "Principal": "*",
                 "Action": "mediatailor:GetManifest",
-                "Resource": channel["Arn"],
+                "Resource": channel_arn,
             }
         ],
     }
-    logger.info("Applying channel policy")
-    mediatailor.put_channel_policy(
-        ChannelName=physical_resource_id,
+    logger.info("Applying channel policy: %s", channel_name)
+    get_client("mediatailor").put_channel_policy(
+        ChannelName=channel_name,
         Policy=json.dumps(policy),
     )
 
-    # Extract playback base URL for CloudFormation outputs
-    playback_base_url = channel["Outputs"][0]["PlaybackUrl"].rsplit("/", 1)[0]
-    helper.Data["PlaybackBaseUrl"] = playback_base_url
+
+def get_immutable_changes(spec: dict[str, Any], channel: dict[str, Any]) -> list[str]:
+    """Return the immutable settings in which an existing channel differs from its spec."""
+    return [
+        key
+        for key in IMMUTABLE_CHANNEL_KEYS
+        if (spec.get(key) or CHANNEL_DEFAULTS[key]) != (channel.get(key) or CHANNEL_DEFAULTS[key])
+    ]
+
+
+def create_channel(
+    spec: dict[str, Any],
+    outputs: list[dict[str, Any]],
+    tags: dict[str, str],
+    replace: bool = True,
+) -> dict[str, Any]:
+    """
+    Create a channel, updating it instead if it already exists.
+
+    An existing channel whose ``PlaybackMode`` or ``Tier`` differs from the
+    spec cannot be updated to match, so it is recreated, or with
+    ``replace=False`` a ValueError is raised.
+    """
+    channel_name = spec["Name"]
+    channel_settings = {
+        "ChannelName": channel_name,
+        "Outputs": outputs,
+        "PlaybackMode": spec["PlaybackMode"],
+        "Tags": {**tags, **spec.get("Tags", {})},
+    }
+    if spec.get("Tier"):
+        channel_settings["Tier"] = spec["Tier"]
+    if spec.get("FillerSlate"):
+        channel_settings["FillerSlate"] = spec["FillerSlate"]
+
+    mediatailor = get_client("mediatailor")
+
+    try:
+        channel = mediatailor.create_channel(**channel_settings)
+        logger.info("Created channel: %s", channel["ChannelName"])
+    except mediatailor.exceptions.BadRequestException as error:
+        if "exists" not in error.response["Error"]["Message"]:
+            raise
+        channel = mediatailor.describe_channel(ChannelName=channel_name)
+        changes = get_immutable_changes(spec, channel)
+        if changes and not replace:
+            raise ValueError(
+                f"Channel {channel_name} exists with a different {', '.join(changes)}"
+            ) from error
+        if changes:
+            logger.info("Channel %s exists with a different %s, recreating", channel_name, changes)
+            return recreate_channel(spec, outputs, tags)
+        logger.info("Channel already exists, updating: %s", channel_name)
+        channel = update_channel(spec, outputs)
+        claim_channel(channel, tags)
+        return channel
+
+    put_anonymous_channel_policy(channel_name, channel["Arn"])
+    return channel
+
+
+def update_channel(spec: dict[str, Any], outputs: list[dict[str, Any]]) -> dict[str, Any]:
+    """Update the outputs, and the filler slate of a LINEAR channel, of an existing channel."""
+    channel_settings = {"ChannelName": spec["Name"], "Outputs": outputs}
+    if spec.get("FillerSlate"):
+        channel_settings["FillerSlate"] = spec["FillerSlate"]
+
+    channel = get_client("mediatailor").update_channel(**channel_settings)
+    logger.info("Updated channel: %s", spec["Name"])
+    return channel
+
+
+def delete_channel(channel_name: str) -> None:
+    """Stop and delete a channel, succeeding if it no longer exists."""
+    mediatailor = get_client("mediatailor")
+    try:
+        # Stop the channel first if running
+        try:
+            mediatailor.stop_channel(ChannelName=channel_name)
+            logger.info("Stopped channel: %s", channel_name)
+        except mediatailor.exceptions.BadRequestException:
+            pass  # Channel might already be stopped or not exist
+
+        mediatailor.delete_channel(ChannelName=channel_name)
+        logger.info("Deleted channel: %s", channel_name)
+
+    except mediatailor.exceptions.BadRequestException as error:
+        error_message = error.response["Error"]["Message"]
+        if "not found" in error_message.lower():
+            logger.info("Channel already deleted: %s", channel_name)
+        else:
+            raise ValueError(error_message) from error
+    except Exception as error:
+        raise ValueError(str(error)) from error
+
+
+def recreate_channel(
+    spec: dict[str, Any],
+    outputs: list[dict[str, Any]],
+    tags: dict[str, str],
+) -> dict[str, Any]:
+    """Delete and recreate a channel whose immutable settings changed."""
+    delete_channel(spec["Name"])
+    return create_channel(spec, outputs, tags, replace=False)
+
+
+def claim_channel(channel: dict[str, Any], tags: dict[str, str]) -> None:
+    """Add the claim tags of ``tags`` that an existing channel does not have yet."""
+    missing = {
+        key: value
+        for key, value in tags.items()
+        if key.startswith(CLAIM_TAG_PREFIX) and key not in channel.get("Tags", {})
+    }
+    if missing:
+        get_client("mediatailor").tag_resource(ResourceArn=channel["Arn"], Tags=missing)
+
+
+def release_channel(channel_name: str, physical_resource_id: str) -> None:
+    """
+    Drop a resource's claim on a channel, deleting the channel if nothing else claims it.
+
+    Channels created before claims were recorded have no claims and are deleted.
+    """
+    mediatailor = get_client("mediatailor")
+    claim = get_claim_tag_key(physical_resource_id)
+    try:
+        channel = mediatailor.describe_channel(ChannelName=channel_name)
+    except Exception as error:
+        if not is_not_found(error):
+            raise ValueError(str(error)) from error
+        logger.info("Channel already deleted: %s", channel_name)
+        return
+
+    others = [
+        key
+        for key in channel.get("Tags", {})
+        if key.startswith(CLAIM_TAG_PREFIX) and key != claim
+    ]
+    if not others:
+        delete_channel(channel_name)
+        return
+
+    logger.info("Channel %s is managed by another resource, keeping it", channel_name)
+    if claim in channel.get("Tags", {}):
+        mediatailor.untag_resource(ResourceArn=channel["Arn"], TagKeys=[claim])
+
+
+def set_playback_data(
+    specs: list[dict[str, Any]],
+    channels: dict[str, dict[str, Any]],
+) -> None:
+    """Expose the playback base URL of every channel as resource attributes."""
+    for spec in specs:
+        helper.Data[f"{spec['Name']}.PlaybackBaseUrl"] = get_playback_base_url(
+            channels[spec["Name"]]
+        )
+
+    # The first channel keeps the attribute names used by single-channel stacks
+    helper.Data["PlaybackBaseUrl"] = get_playback_base_url(channels[specs[0]["Name"]])
+    helper.Data["ChannelName"] = specs[0]["Name"]
+    helper.Data["ChannelNames"] = ",".join(spec["Name"] for spec in specs)
+
+
+def get_max_concurrency(properties: dict[str, Any]) -> int:
+    """Return the configured channel concurrency."""
+    return int(properties.get("MaxConcurrency", DEFAULT_MAX_CONCURRENCY))
+
+
+@helper.create
+def create(event: dict[str, Any], context: Any) -> str:
+    """Handle CloudFormation Create event."""
+    logger.info("Processing Create request")
+
+    properties = event["ResourceProperties"]
+    packaging_group_id = properties["MediaPackagePackagingGroup"]["Id"]
+    physical_resource_id = event.get("PhysicalResourceId") or properties.get("Name")
+
+    specs = get_channel_specs(properties, get_default_name(properties, physical_resource_id))
+    packaging_configurations = list_packaging_configurations(packaging_group_id)
+    tags = {
+        "stack-id": event["StackId"],
+        "stack-name": properties["StackName"],
+        get_claim_tag_key(physical_resource_id): "true",
+    }
+
+    channels = run_concurrently(
+        lambda spec: create_channel(
+            spec,
+            build_channel_outputs(packaging_configurations, spec.get("SourceGroups")),
+            tags,
+        ),
+        specs,
+        get_max_concurrency(properties),
+    )
+    set_playback_data(specs, channels)
 
     return physical_resource_id
 
@@ -127,20 +467,70 @@ def create(event: dict[str, Any], context: Any) -> str:
 def update(event: dict[str, Any], context: Any) -> str:
     """Handle CloudFormation Update event."""
     logger.info("Processing Update request")
-    
+
     properties = event["ResourceProperties"]
+    old_properties = event.get("OldResourceProperties", {})
     packaging_group_id = properties["MediaPackagePackagingGroup"]["Id"]
     physical_resource_id = event["PhysicalResourceId"]
+    max_concurrency = get_max_concurrency(properties)
 
-    outputs = get_channel_outputs_from_mediapackage(packaging_group_id)
-    
-    channel = mediatailor.update_channel(
-        ChannelName=physical_resource_id,
-        Outputs=outputs,
+    specs = get_channel_specs(properties, get_default_name(properties, physical_resource_id))
+    old_specs = get_channel_specs(
+        old_properties, get_default_name(old_properties, physical_resource_id)
     )
-    
-    playback_base_url = channel["Outputs"][0]["PlaybackUrl"].rsplit("/", 1)[0] + "/"
-    helper.Data["PlaybackBaseUrl"] = playback_base_url
+    packaging_group_changed = (
+        old_properties.get("MediaPackagePackagingGroup", {}).get("Id") != packaging_group_id
+    )
+    diff = diff_channel_specs(old_specs, specs, force_update=packaging_group_changed)
+
+    # Removed channels are deleted with the old resource once the update succeeds
+    old_physical_resource_id = physical_resource_id
+    if diff["delete"]:
+        physical_resource_id = (
+            f"{get_default_name(properties, physical_resource_id)}-{uuid.uuid4().hex[:8]}"
+        )
+        logger.info("Channels removed, replacing the resource with %s", physical_resource_id)
+
+    packaging_configurations = list_packaging_configurations(packaging_group_id)
+    tags = {
+        "stack-id": event["StackId"],
+        "stack-name": properties["StackName"],
+        get_claim_tag_key(physical_resource_id): "true",
+    }
+
+    def outputs_for(spec: dict[str, Any]) -> list[dict[str, Any]]:
+        return build_channel_outputs(packaging_configurations, spec.get("SourceGroups"))
+
+    channels = {
+        **run_concurrently(
+            lambda spec: create_channel(spec, outputs_for(spec), tags),
+            diff["create"],
+            max_concurrency,
+        ),
+        **run_concurrently(
+            lambda spec: recreate_channel(spec, outputs_for(spec), tags),
+            diff["recreate"],
+            max_concurrency,
+        ),
+        **run_concurrently(
+            lambda spec: update_channel(spec, outputs_for(spec)),
+            diff["update"],
+            max_concurrency,
+        ),
+        **run_concurrently(
+            lambda spec: get_client("mediatailor").describe_channel(ChannelName=spec["Name"]),
+            diff["unchanged"],
+            max_concurrency,
+        ),
+    }
+    # Kept channels are claimed by both resources, so a rollback keeps them too
+    claims = {**tags, get_claim_tag_key(old_physical_resource_id): "true"}
+    run_concurrently(
+        lambda spec: claim_channel(channels[spec["Name"]], claims),
+        diff["update"] + diff["unchanged"],
+        max_concurrency,
+    )
+    set_playback_data(specs, channels)
 
     return physical_resource_id
 
@@ -149,34 +539,23 @@ def update(event: dict[str, Any], context: Any) -> str:
 def delete(event: dict[str, Any], context: Any) -> None:
     """Handle CloudFormation Delete event."""
     logger.info("Processing Delete request")
-    
-    physical_resource_id = event["PhysicalResourceId"]
 
-    try:
-        # Stop the channel first if running
-        try:
-            mediatailor.stop_channel(ChannelName=physical_resource_id)
-            logger.info("Stopped channel: %s", physical_resource_id)
-        except mediatailor.exceptions.BadRequestException:
-            pass  # Channel might already be stopped or not exist
-
-        mediatailor.delete_channel(ChannelName=physical_resource_id)
-        logger.info("Deleted channel: %s", physical_resource_id)
+    properties = event["ResourceProperties"]
+    physical_resource_id = event["PhysicalResourceId"]
 
-    except mediatailor.exceptions.BadRequestException as error:
-        error_message = error.response["Error"]["Message"]
-        if "not found" in error_message.lower():
-            logger.info("Channel already deleted: %s", physical_resource_id)
-        else:
-            raise ValueError(error_message) from error
-    except Exception as error:
-        raise ValueError(str(error)) from error
+    specs = get_channel_specs(properties, get_default_name(properties, physical_resource_id))
+    run_concurrently(
+        lambda spec: release_channel(spec["Name"], physical_resource_id),
+        specs,
+        get_max_concurrency(properties),
+    )
 
 
+@emit_api_metrics
 def lambda_handler(event: dict[str, Any], context: Any) -> None:
     """Lambda entry point for CloudFormation custom resource."""
     if "PhysicalResourceId" not in event:
         event["PhysicalResourceId"] = event["ResourceProperties"].get("Name")
-    
-    logger.info("Received event: %s", json.dumps(event, default=str))
+
+    logger.info("Received event: %s", as_json(event))
     helper(event, context)
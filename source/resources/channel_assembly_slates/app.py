@@ -2,19 +2,39 @@
 MediaConvert Slates Custom Resource
 
 CloudFormation custom resource for creating ad break slate videos using MediaConvert.
+
+With a ``SlateDurationsInMillis`` list, one resource creates slates of every
+duration from a single job. MediaConvert joins all inputs of a job into every
+output, so the job encodes only the longest slate, cut into segments that
+divide every duration; each shorter slate is a playlist of the first segments
+of that encode. The resource then registers every slate as a MediaPackage
+asset and a MediaTailor VOD source in parallel, so adding durations does not
+add jobs or deployment time.
 """
 from __future__ import annotations
 
-import json
+import copy
 import logging
+import math
 import os
-import random
+import posixpath
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
+from urllib.parse import urlparse
 
-import boto3
-from botocore.config import Config
 from crhelper import CfnResource
+from fast_common.alignment import plan_alignment
+from fast_common.clients import get_client, get_resource
+from fast_common.hls import (
+    parse_master_playlist,
+    resolve_uri,
+    rewrite_master_playlist,
+    truncate_media_playlist,
+)
+from fast_common.logs import as_json
+from fast_common.metrics import emit_api_metrics
+from fast_common.schedule import SLATE_TAG_KEY
 
 # Configure logging
 boto_level = os.environ.get("LOG_LEVEL", "INFO").upper()
@@ -32,25 +52,29 @@ helper = CfnResource(
     ssl_verify=None,
 )
 
-# Initialize AWS clients
-config = Config(retries={"max_attempts": 3, "mode": "adaptive"})
-
-try:
-    mediaconvert_client = boto3.client("mediaconvert", config=config)
-    endpoint = mediaconvert_client.describe_endpoints()["Endpoints"][0]["Url"]
-    logger.info("MediaConvert endpoint URL: %s", endpoint)
-    mediaconvert = boto3.client("mediaconvert", endpoint_url=endpoint, config=config)
-    mediapackage = boto3.client("mediapackage-vod", config=config)
-    mediatailor = boto3.client("mediatailor", config=config)
-    s3 = boto3.resource("s3")
-except Exception as e:
-    helper.init_failure(e)
-
-
-def generate_settings_from_preset(preset_name: str) -> dict[str, Any]:
-    """Generate output settings from a MediaConvert preset."""
-    preset = mediaconvert.get_preset(Name=preset_name)["Preset"]["Settings"]
-    logger.info("Preset settings: %s", json.dumps(preset, default=str))
+# Short segments keep slates of any duration close to their requested length
+SLATE_SEGMENT_LENGTH = 2
+
+# Slates are named as the MediaTailor function refers to them in ad breaks
+SLATE_NAME_PREFIX = "AdBreakSlate"
+
+# Slates of the single-duration resources, replaced by the list of slates
+LEGACY_SLATE_NAME_PREFIX = "AdBreakSlate_"
+
+# Maximum number of slates registered in parallel
+MAX_CONCURRENCY = 8
+
+# Properties that decide the encode shared by a list of slates
+ENCODE_PROPERTIES = ("MediaConvertJobTemplate", "MediaConvertTranscodeRoleArn", "FrameRate")
+
+
+def generate_settings_from_preset(
+    preset_name: str,
+    alignment: dict[str, Any],
+) -> dict[str, Any]:
+    """Generate output settings from a MediaConvert preset at the planned frame rate and GOP."""
+    preset = get_client("mediaconvert").get_preset(Name=preset_name)["Preset"]["Settings"]
+    logger.debug("Preset settings: %s", as_json(preset))
     
     if "VideoDescription" in preset:
         codec_settings = preset["VideoDescription"]["CodecSettings"]
@@ -58,8 +82,10 @@ def generate_settings_from_preset(preset_name: str) -> dict[str, Any]:
         
         framerate_settings = {
             "FramerateControl": "SPECIFIED",
-            "FramerateNumerator": 30,
-            "FramerateDenominator": 1,
+            "FramerateNumerator": alignment["FramerateNumerator"],
+            "FramerateDenominator": alignment["FramerateDenominator"],
+            "GopSize": alignment["GopSize"],
+            "GopSizeUnits": "FRAMES",
         }
         
         if codec == "H_265":
@@ -72,13 +98,37 @@ def generate_settings_from_preset(preset_name: str) -> dict[str, Any]:
     return preset
 
 
+def get_output_group_settings(output_group: dict[str, Any]) -> dict[str, Any]:
+    """Return the HLS or CMAF settings of a job template output group."""
+    settings = output_group["OutputGroupSettings"]
+    group_type = settings.get("Type")
+
+    if group_type == "HLS_GROUP_SETTINGS":
+        return settings["HlsGroupSettings"]
+    elif group_type == "CMAF_GROUP_SETTINGS":
+        return settings["CmafGroupSettings"]
+    else:
+        raise ValueError(f"Unsupported output group: {group_type}. Must be HLS or CMAF")
+
+
 def format_template_for_slate(
     template: dict[str, Any],
     duration_millis: int,
     slate_name: str,
     transcode_role_arn: str,
+    frame_rate: str | float = 30,
+    segment_length: int = SLATE_SEGMENT_LENGTH,
 ) -> dict[str, Any]:
-    """Format a MediaConvert job template for slate video generation."""
+    """
+    Format a MediaConvert job template for slate video generation.
+
+    Slates are generated at ``frame_rate`` with GOPs that divide their short
+    segments, so splicing them into content of the same frame-rate family
+    keeps segment durations even.
+    """
+    alignment = plan_alignment(frame_rate, segment_length, segment_length)
+    logger.info("Slate alignment: %s", as_json(alignment))
+
     job_settings = {
         "Role": transcode_role_arn,
         "Settings": {
@@ -94,21 +144,348 @@ def format_template_for_slate(
         },
     }
     
-    # Update output group settings
-    output_group = job_settings["Settings"]["OutputGroups"][0]
-    hls_settings = output_group["OutputGroupSettings"]["HlsGroupSettings"]
-    hls_settings["Destination"] += slate_name
-    hls_settings["SegmentLength"] = 2
-    
-    # Update outputs with preset settings
-    for output in output_group["Outputs"]:
-        logger.info("Processing output: %s", json.dumps(output, default=str))
-        output.update(generate_settings_from_preset(output["Preset"]))
+    for output_group in job_settings["Settings"]["OutputGroups"]:
+        # Update output group settings (HLS or CMAF)
+        group_settings = get_output_group_settings(output_group)
+        group_settings["Destination"] += slate_name
+        group_settings["SegmentLength"] = alignment["SegmentLength"]
+        if "FragmentLength" in group_settings:
+            group_settings["FragmentLength"] = alignment["GopSeconds"]
 
-    logger.info("Formatted job settings: %s", json.dumps(job_settings, default=str))
+        # Update outputs with preset settings
+        for output in output_group["Outputs"]:
+            logger.debug("Processing output: %s", as_json(output))
+            output.update(generate_settings_from_preset(output["Preset"], alignment))
+
+    logger.debug("Formatted job settings: %s", as_json(job_settings))
     return job_settings
 
 
+def wait_for_job(job: dict[str, Any]) -> dict[str, Any]:
+    """Wait for a MediaConvert job to finish, raising ValueError if it fails."""
+    mediaconvert = get_client("mediaconvert")
+    result = {"Status": job["Status"], "Id": job["Id"]}
+    logger.info("Created job: %s", as_json(result))
+
+    while result["Status"] in ("SUBMITTED", "PROGRESSING"):
+        time.sleep(5)
+        result["Status"] = mediaconvert.get_job(Id=result["Id"])["Job"]["Status"]
+        logger.info("Job status: %s", result["Status"])
+
+    if result["Status"] == "ERROR":
+        raise ValueError(f"MediaConvert job {result['Id']} failed. Check MediaConvert console.")
+    return result
+
+
+def get_slate_durations(properties: dict[str, Any]) -> list[int]:
+    """
+    Return the sorted slate durations of a ``SlateDurationsInMillis`` list.
+
+    Raises ValueError for durations that are not positive, or, when there are
+    several, not whole seconds, since shorter slates end on segment boundaries.
+    """
+    durations = sorted({int(duration) for duration in properties["SlateDurationsInMillis"]})
+    if not durations or durations[0] <= 0:
+        raise ValueError(f"Invalid SlateDurationsInMillis: {durations}. Must be positive")
+    if len(durations) > 1 and any(duration % 1000 for duration in durations):
+        raise ValueError(
+            f"Invalid SlateDurationsInMillis: {durations}. Must be whole seconds"
+        )
+    return durations
+
+
+def get_slate_segment_length(durations: list[int]) -> int:
+    """Return the longest segment length, up to 2 seconds, that divides every duration."""
+    if len(durations) == 1:
+        return SLATE_SEGMENT_LENGTH
+    return math.gcd(SLATE_SEGMENT_LENGTH, *(duration // 1000 for duration in durations))
+
+
+def get_slate_name(duration_millis: int) -> str:
+    """Return the asset and VOD source name of the slate of a duration."""
+    return f"{SLATE_NAME_PREFIX}{duration_millis}"
+
+
+def select_output_group(template: dict[str, Any]) -> dict[str, Any]:
+    """Return the CMAF output group of a job template, or else its first HLS group."""
+    groups = template["Settings"]["OutputGroups"]
+    for group_type in ("CMAF_GROUP_SETTINGS", "HLS_GROUP_SETTINGS"):
+        for output_group in groups:
+            if output_group["OutputGroupSettings"].get("Type") == group_type:
+                return output_group
+    raise ValueError("The job template has no HLS or CMAF output group")
+
+
+def encode_slates(properties: dict[str, Any], prefix: str, durations: list[int]) -> str:
+    """
+    Encode the longest slate in one job and return the S3 URL of its master playlist.
+
+    Only the output group MediaPackage ingests is kept, so the job encodes
+    each rung once.
+    """
+    mediaconvert = get_client("mediaconvert")
+    template = mediaconvert.get_job_template(
+        Name=properties["MediaConvertJobTemplate"]["Name"]
+    )["JobTemplate"]
+    template = copy.deepcopy(template)
+    output_group = select_output_group(template)
+    template["Settings"]["OutputGroups"] = [output_group]
+    destination = get_output_group_settings(output_group)["Destination"]
+
+    job_settings = format_template_for_slate(
+        template,
+        durations[-1],
+        f"{prefix}{SLATE_NAME_PREFIX}",
+        properties["MediaConvertTranscodeRoleArn"],
+        properties.get("FrameRate", 30),
+        get_slate_segment_length(durations),
+    )
+    wait_for_job(mediaconvert.create_job(**job_settings)["Job"])
+    return f"{destination}{prefix}{SLATE_NAME_PREFIX}.m3u8"
+
+
+def read_lines(bucket: str, key: str) -> list[str]:
+    """Read the lines of a playlist from S3."""
+    body = get_client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+    return body.decode("utf-8").splitlines()
+
+
+def write_slate_playlists(master_url: str, durations: list[int]) -> dict[int, str]:
+    """
+    Write a master playlist and cut renditions for every slate duration.
+
+    Renditions are written next to the encoded ones, so their segment URIs
+    stay valid. Returns the S3 URL of each duration's master playlist.
+    """
+    parsed = urlparse(master_url)
+    bucket, master_key = parsed.netloc, parsed.path.lstrip("/")
+    stem = posixpath.splitext(posixpath.basename(master_key))[0]
+    master_lines = read_lines(bucket, master_key)
+    master = parse_master_playlist(master_lines)
+    if master["Errors"]:
+        raise ValueError(f"Invalid slate playlist {master_url}: {'; '.join(master['Errors'])}")
+
+    uris = [variant["Uri"] for variant in master["Variants"]]
+    uris += [rendition["Uri"] for rendition in master["Renditions"]]
+    renditions = {
+        uri: read_lines(bucket, resolve_uri(master_key, uri)) for uri in dict.fromkeys(uris)
+    }
+
+    s3 = get_client("s3")
+    masters = {}
+    for duration in durations:
+        name = get_slate_name(duration)
+        renamed = {}
+        for uri, lines in renditions.items():
+            directory, filename = posixpath.split(uri)
+            renamed[uri] = posixpath.join(directory, name + filename.removeprefix(stem))
+            s3.put_object(
+                Bucket=bucket,
+                Key=resolve_uri(master_key, renamed[uri]),
+                Body=truncate_media_playlist(lines, duration / 1000).encode("utf-8"),
+                ContentType="application/vnd.apple.mpegurl",
+            )
+        key = posixpath.join(posixpath.dirname(master_key), f"{name}.m3u8")
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=rewrite_master_playlist(master_lines, renamed).encode("utf-8"),
+            ContentType="application/vnd.apple.mpegurl",
+        )
+        masters[duration] = f"s3://{bucket}/{key}"
+    return masters
+
+
+def get_package_configurations(egress_endpoints: list[dict[str, Any]]) -> list[dict[str, str]]:
+    """Return the VOD source package configurations of a MediaPackage asset's endpoints."""
+    types = {".m3u8": "HLS", ".mpd": "DASH"}
+    configurations = []
+    for endpoint in egress_endpoints:
+        path = urlparse(endpoint["Url"]).path
+        package_type = types.get(posixpath.splitext(path)[1])
+        if package_type:
+            configurations.append({
+                "Path": path,
+                "SourceGroup": endpoint["PackagingConfigurationId"],
+                "Type": package_type,
+            })
+    return configurations
+
+
+def register_slate(properties: dict[str, Any], duration: int, master_url: str) -> str:
+    """Create, or recreate, the MediaPackage asset and MediaTailor VOD source of a slate."""
+    name = get_slate_name(duration)
+    tags = {SLATE_TAG_KEY: str(duration)}
+    if properties.get("StackName"):
+        tags["StackName"] = properties["StackName"]
+    parsed = urlparse(master_url)
+
+    mediapackage = get_client("mediapackage-vod")
+    asset = {
+        "Id": name,
+        "PackagingGroupId": properties["MediaPackagePackagingGroup"]["Id"],
+        "SourceArn": f"arn:aws:s3:::{parsed.netloc}{parsed.path}",
+        "SourceRoleArn": properties["MediaPackageReadS3RoleArn"],
+        "Tags": tags,
+    }
+    try:
+        response = mediapackage.create_asset(**asset)
+    except mediapackage.exceptions.UnprocessableEntityException as error:
+        if "exists" not in error.response["Error"]["Message"]:
+            raise
+        # Assets cannot be updated, and the encode behind this one may have changed
+        logger.info("Asset %s exists, recreating", name)
+        mediapackage.delete_asset(Id=name)
+        response = mediapackage.create_asset(**asset)
+
+    mediatailor = get_client("mediatailor")
+    vod_source = {
+        "SourceLocationName": properties["MediaTailorSourceLocation"],
+        "VodSourceName": name,
+        "HttpPackageConfigurations": get_package_configurations(response["EgressEndpoints"]),
+    }
+    try:
+        mediatailor.create_vod_source(**vod_source, Tags=tags)
+    except mediatailor.exceptions.BadRequestException as error:
+        if "exists" not in error.response["Error"]["Message"]:
+            raise
+        mediatailor.update_vod_source(**vod_source)
+
+    logger.info("Registered slate %s from %s", name, master_url)
+    return name
+
+
+def delete_slate(properties: dict[str, Any], duration: int) -> None:
+    """Delete the MediaTailor VOD source and MediaPackage asset of a slate."""
+    name = get_slate_name(duration)
+    try:
+        get_client("mediatailor").delete_vod_source(
+            SourceLocationName=properties["MediaTailorSourceLocation"],
+            VodSourceName=name,
+        )
+        logger.info("Deleted VOD source: %s", name)
+    except Exception as error:
+        logger.warning("Failed to delete VOD source %s: %s", name, error)
+    try:
+        get_client("mediapackage-vod").delete_asset(Id=name)
+        logger.info("Deleted asset: %s", name)
+    except Exception as error:
+        logger.warning("Failed to delete asset %s: %s", name, error)
+
+
+def delete_legacy_slates(properties: dict[str, Any]) -> None:
+    """
+    Delete the VOD sources and assets of slates named ``AdBreakSlate_<ms>``.
+
+    Stacks created before slates were registered as a list kept these when the
+    single-duration resources were removed. Failures are logged, so a legacy
+    slate still in use does not fail the stack update.
+    """
+    mediatailor = get_client("mediatailor")
+    source_location = properties["MediaTailorSourceLocation"]
+    try:
+        paginator = mediatailor.get_paginator("list_vod_sources")
+        names = [
+            item["VodSourceName"]
+            for page in paginator.paginate(SourceLocationName=source_location)
+            for item in page.get("Items", [])
+            if item["VodSourceName"].startswith(LEGACY_SLATE_NAME_PREFIX)
+        ]
+    except Exception as error:
+        logger.warning("Error listing legacy slate VOD sources: %s", error)
+        names = []
+    for name in names:
+        try:
+            mediatailor.delete_vod_source(SourceLocationName=source_location, VodSourceName=name)
+            logger.info("Deleted legacy VOD source: %s", name)
+        except Exception as error:
+            logger.warning("Failed to delete legacy VOD source %s: %s", name, error)
+
+    mediapackage = get_client("mediapackage-vod")
+    try:
+        paginator = mediapackage.get_paginator("list_assets")
+        asset_ids = [
+            asset["Id"]
+            for page in paginator.paginate(
+                PackagingGroupId=properties["MediaPackagePackagingGroup"]["Id"]
+            )
+            for asset in page.get("Assets", [])
+            if asset["Id"].startswith(LEGACY_SLATE_NAME_PREFIX)
+        ]
+    except Exception as error:
+        logger.warning("Error listing legacy slate assets: %s", error)
+        asset_ids = []
+    for asset_id in asset_ids:
+        try:
+            mediapackage.delete_asset(Id=asset_id)
+            logger.info("Deleted legacy asset: %s", asset_id)
+        except Exception as error:
+            logger.warning("Failed to delete legacy asset %s: %s", asset_id, error)
+
+
+def run_slates(function: Any, properties: dict[str, Any], durations: list[int]) -> list[Any]:
+    """Run a slate operation for several durations in parallel."""
+    if not durations:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(durations), MAX_CONCURRENCY)) as executor:
+        return list(executor.map(lambda duration: function(properties, duration), durations))
+
+
+def create_slates(event: dict[str, Any]) -> str:
+    """
+    Create or update a list of slates from one encode.
+
+    An update encodes again only when the encode changed: the job template,
+    role, frame rate, longest duration or segment length. Otherwise only the
+    added durations are cut from the existing encode and registered, and the
+    removed ones are deleted. Slates left behind by the single-duration
+    resources are deleted last.
+    """
+    properties = event["ResourceProperties"]
+    physical_resource_id = event.get("PhysicalResourceId") or properties.get(
+        "Name", f"{SLATE_NAME_PREFIX}s"
+    )
+    prefix = f"{physical_resource_id}/"
+    durations = get_slate_durations(properties)
+
+    old_properties = event.get("OldResourceProperties") or {}
+    old_durations = (
+        get_slate_durations(old_properties) if "SlateDurationsInMillis" in old_properties else []
+    )
+    reencode = (
+        not old_durations
+        or any(properties.get(key) != old_properties.get(key) for key in ENCODE_PROPERTIES)
+        or durations[-1] != old_durations[-1]
+        or get_slate_segment_length(durations) != get_slate_segment_length(old_durations)
+    )
+
+    if reencode:
+        master_url = encode_slates(properties, prefix, durations)
+        added = durations
+    else:
+        template = get_client("mediaconvert").get_job_template(
+            Name=properties["MediaConvertJobTemplate"]["Name"]
+        )["JobTemplate"]
+        destination = get_output_group_settings(select_output_group(template))["Destination"]
+        master_url = f"{destination}{prefix}{SLATE_NAME_PREFIX}.m3u8"
+        added = [duration for duration in durations if duration not in old_durations]
+
+    masters = write_slate_playlists(master_url, added)
+    names = run_slates(
+        lambda props, duration: register_slate(props, duration, masters[duration]),
+        properties,
+        added,
+    )
+    run_slates(delete_slate, properties, [d for d in old_durations if d not in durations])
+    # The new slates are registered, so ad breaks no longer need the legacy ones
+    delete_legacy_slates(properties)
+
+    helper.Data["SlateNames"] = ",".join(get_slate_name(duration) for duration in durations)
+    helper.Data["LongestSlateName"] = get_slate_name(durations[-1])
+    logger.info("Registered slates: %s", ", ".join(names))
+    return physical_resource_id
+
+
 @helper.create
 @helper.update
 def create(event: dict[str, Any], context: Any) -> str:
@@ -116,31 +493,28 @@ def create(event: dict[str, Any], context: Any) -> str:
     logger.info("Processing Create/Update request")
     
     properties = event["ResourceProperties"]
+    if "SlateDurationsInMillis" in properties:
+        return create_slates(event)
+
     physical_resource_id = properties.get("Name", f"AdBreakSlate_{properties['SlateDurationInMillis']}")
 
     slate_duration_millis = int(properties["SlateDurationInMillis"])
     transcode_role_arn = properties["MediaConvertTranscodeRoleArn"]
     
+    mediaconvert = get_client("mediaconvert")
     template = mediaconvert.get_job_template(
         Name=properties["MediaConvertJobTemplate"]["Name"]
     )["JobTemplate"]
     
     job_settings = format_template_for_slate(
-        template, slate_duration_millis, physical_resource_id, transcode_role_arn
+        template,
+        slate_duration_millis,
+        physical_resource_id,
+        transcode_role_arn,
+        properties.get("FrameRate", 30),
     )
     
-    job = mediaconvert.create_job(**job_settings)["Job"]
-    result = {"Status": job["Status"], "Id": job["Id"]}
-    logger.info("Created job: %s", json.dumps(result))
-    
-    # Wait for job completion
-    while result["Status"] in ("SUBMITTED", "PROGRESSING"):
-        time.sleep(5)
-        result["Status"] = mediaconvert.get_job(Id=result["Id"])["Job"]["Status"]
-        logger.info("Job status: %s", result["Status"])
-    
-    if result["Status"] == "ERROR":
-        raise ValueError(f"MediaConvert job {result['Id']} failed. Check MediaConvert console.")
+    wait_for_job(mediaconvert.create_job(**job_settings)["Job"])
 
     return physical_resource_id
 
@@ -153,7 +527,18 @@ def delete(event: dict[str, Any], context: Any) -> None:
     physical_resource_id = event["PhysicalResourceId"]
     properties = event["ResourceProperties"]
 
+    if "SlateDurationsInMillis" in properties:
+        run_slates(delete_slate, properties, get_slate_durations(properties))
+        try:
+            bucket = get_resource("s3").Bucket(properties["VideoDestinationBucket"])
+            bucket.objects.filter(Prefix=f"{physical_resource_id}/").delete()
+            logger.info("Deleted S3 objects with prefix: %s/", physical_resource_id)
+        except Exception as error:
+            logger.warning("Error deleting S3 objects: %s", error)
+        return
+
     # Delete VOD sources from MediaTailor
+    mediatailor = get_client("mediatailor")
     try:
         vod_sources = mediatailor.list_vod_sources(
             SourceLocationName=physical_resource_id,
@@ -175,6 +560,7 @@ def delete(event: dict[str, Any], context: Any) -> None:
 
     # Delete assets from MediaPackage
     if "MediaPackagePackagingGroup" in properties:
+        mediapackage = get_client("mediapackage-vod")
         try:
             assets = mediapackage.list_assets(
                 PackagingGroupId=properties["MediaPackagePackagingGroup"]["Id"],
@@ -195,18 +581,15 @@ def delete(event: dict[str, Any], context: Any) -> None:
 
     # Delete S3 objects
     try:
-        bucket = s3.Bucket(properties["VideoDestinationBucket"])
+        bucket = get_resource("s3").Bucket(properties["VideoDestinationBucket"])
         bucket.objects.filter(Prefix=physical_resource_id).delete()
         logger.info("Deleted S3 objects with prefix: %s", physical_resource_id)
     except Exception as error:
         logger.warning("Error deleting S3 objects: %s", error)
 
 
+@emit_api_metrics
 def lambda_handler(event: dict[str, Any], context: Any) -> None:
     """Lambda entry point for CloudFormation custom resource."""
-    logger.info("Received event: %s", json.dumps(event, default=str))
-    
-    # Stagger completion to avoid resource conflicts
-    time.sleep(random.randint(1, 10))
-    
+    logger.info("Received event: %s", as_json(event))
     helper(event, context)
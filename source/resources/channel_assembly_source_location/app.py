@@ -5,14 +5,14 @@ CloudFormation custom resource for creating and managing MediaTailor source loca
 """
 from __future__ import annotations
 
-import json
 import logging
 import os
 from typing import Any
 
-import boto3
-from botocore.config import Config
 from crhelper import CfnResource
+from fast_common.clients import get_client
+from fast_common.logs import as_json
+from fast_common.metrics import emit_api_metrics
 
 # Configure logging
 boto_level = os.environ.get("LOG_LEVEL", "INFO").upper()
@@ -30,10 +30,6 @@ helper = CfnResource(
     ssl_verify=None,
 )
 
-# Initialize AWS client
-config = Config(retries={"max_attempts": 3, "mode": "adaptive"})
-client = boto3.client("mediatailor", config=config)
-
 
 def build_source_location_config(
     event: dict[str, Any],
@@ -74,13 +70,14 @@ def build_source_location_config(
 def create(event: dict[str, Any], context: Any) -> str:
     """Handle CloudFormation Create event."""
     logger.info("Processing Create request")
+    client = get_client("mediatailor")
     
     properties = event["ResourceProperties"]
     physical_resource_id = properties.get("Name") or helper.generate_physical_id(event)
 
     source_location_config = build_source_location_config(event, physical_resource_id)
     
-    logger.info("Creating source location: %s", json.dumps(source_location_config, default=str))
+    logger.info("Creating source location: %s", as_json(source_location_config))
     
     try:
         client.create_source_location(**source_location_config)
@@ -98,6 +95,7 @@ def create(event: dict[str, Any], context: Any) -> str:
 def update(event: dict[str, Any], context: Any) -> str:
     """Handle CloudFormation Update event."""
     logger.info("Processing Update request")
+    client = get_client("mediatailor")
     
     physical_resource_id = event["PhysicalResourceId"]
     source_location_config = build_source_location_config(
@@ -118,6 +116,7 @@ def update(event: dict[str, Any], context: Any) -> str:
 def delete(event: dict[str, Any], context: Any) -> None:
     """Handle CloudFormation Delete event."""
     logger.info("Processing Delete request")
+    client = get_client("mediatailor")
     
     physical_resource_id = event["PhysicalResourceId"]
 
@@ -178,7 +177,8 @@ def delete(event: dict[str, Any], context: Any) -> None:
             raise ValueError(str(error)) from error
 
 
+@emit_api_metrics
 def lambda_handler(event: dict[str, Any], context: Any) -> None:
     """Lambda entry point for CloudFormation custom resource."""
-    logger.info("Received event: %s", json.dumps(event, default=str))
+    logger.info("Received event: %s", as_json(event))
     helper(event, context)
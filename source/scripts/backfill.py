@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Backfill an existing library of videos through the pipeline at a controlled rate.
+
+Onboarding a library that is already in the source bucket would otherwise need
+every object to be re-uploaded or re-tagged so that S3 events start its
+MediaConvert job, all at once. This script lists the bucket in parallel, one
+listing per top-level prefix, keeps the keys the MediaConvert function would
+process (same video extensions), skips titles that already have a MediaPackage
+asset, and invokes the MediaConvert function with a synthetic S3 Object
+Created event for each remaining title at ``--rate`` jobs per second.
+
+Every result is appended to a checkpoint file (JSON lines), so a run that
+stops can be started again with the same command and continues where it left
+off. Titles that failed are retried on the next run.
+
+Usage:
+    cd source/scripts
+    python3 backfill.py --stack-name <stack-name> --dry-run
+    python3 backfill.py --stack-name <stack-name> --rate 2 --checkpoint backfill.jsonl
+    python3 backfill.py --function-name <name> --bucket <bucket> --packaging-group <id>
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+SOURCE_DIR = Path(__file__).resolve().parent.parent
+
+# Share the rate limiter and the handlers' own rules with the Lambda functions
+sys.path.insert(0, str(SOURCE_DIR / "layers" / "fast_common"))
+from fast_common.governor import MAX_WAIT_SECONDS, MemoryBucketStore, RateGovernor  # noqa: E402
+from fast_common.tracing import format_timestamp  # noqa: E402
+
+# Prefixes the job template writes the MediaPackage source playlist under:
+# the first output group writes to the bucket root, later groups to <group>/
+OUTPUT_PREFIXES = ("", "cmaf/", "hls/")
+
+# Checkpoint statuses that are not submitted again
+DONE_STATUSES = frozenset({"SUBMITTED", "EXISTS"})
+
+
+def load_function_module(name: str) -> Any:
+    """Import a Lambda function's app module under its own module name."""
+    spec = importlib.util.spec_from_file_location(
+        f"{name}_app", SOURCE_DIR / "functions" / name / "app.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+media_convert_job = load_function_module("media_convert_job")
+mediapackage_vod_asset = load_function_module("mediapackage_vod_asset")
+
+
+def is_video(key: str) -> bool:
+    """Return whether the MediaConvert function would transcode an object key."""
+    return os.path.splitext(key)[1].lower() in media_convert_job.VIDEO_EXTENSIONS
+
+
+def get_asset_ids(bucket: str, key: str) -> set[str]:
+    """Return the MediaPackage asset IDs the pipeline may create for a source key."""
+    stem = os.path.splitext(key.rsplit("/", 1)[-1])[0]
+    return {
+        mediapackage_vod_asset.create_resource_id_from_mediaconvert_job_output(
+            f"s3://{bucket}/{prefix}{stem}.m3u8"
+        )
+        for prefix in OUTPUT_PREFIXES
+    }
+
+
+def resolve_stack(stack_name: str, region: str | None) -> dict[str, str]:
+    """Look up the function, buckets and packaging group of a deployed stack."""
+    import boto3
+
+    cloudformation = boto3.client("cloudformation", region_name=region)
+    resources = {
+        resource["LogicalResourceId"]: resource["PhysicalResourceId"]
+        for resource in cloudformation.describe_stack_resources(StackName=stack_name)[
+            "StackResources"
+        ]
+    }
+    return {
+        "function_name": resources["MediaConvertFunction"],
+        "bucket": resources["VideoSourceBucket"],
+        "destination_bucket": resources["VideoDestinationBucket"],
+        "packaging_group": resources["MediaPackagePackagingGroup"],
+    }
+
+
+def list_partition(s3: Any, bucket: str, prefix: str, recursive: bool) -> list[dict[str, Any]]:
+    """List the objects under a prefix, or only the objects directly in it."""
+    params = {"Bucket": bucket, "Prefix": prefix}
+    if not recursive:
+        params["Delimiter"] = "/"
+    paginator = s3.get_paginator("list_objects_v2")
+    return [
+        {"Key": item["Key"], "Size": item["Size"], "ETag": item["ETag"].strip('"')}
+        for page in paginator.paginate(**params)
+        for item in page.get("Contents", [])
+    ]
+
+
+def list_videos(s3: Any, bucket: str, prefix: str, workers: int) -> list[dict[str, Any]]:
+    """List the video objects of a bucket, one parallel listing per top-level prefix."""
+    paginator = s3.get_paginator("list_objects_v2")
+    partitions = [
+        common["Prefix"]
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/")
+        for common in page.get("CommonPrefixes", [])
+    ]
+
+    objects = list_partition(s3, bucket, prefix, recursive=False)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for listed in executor.map(
+            lambda partition: list_partition(s3, bucket, partition, recursive=True),
+            partitions,
+        ):
+            objects.extend(listed)
+
+    print(f"Listed {len(objects)} objects in {len(partitions) + 1} partitions", file=sys.stderr)
+    return sorted((item for item in objects if is_video(item["Key"])), key=lambda item: item["Key"])
+
+
+def list_asset_ids(mediapackage: Any, packaging_group: str) -> set[str]:
+    """Return the IDs of every MediaPackage VOD asset in a packaging group."""
+    paginator = mediapackage.get_paginator("list_assets")
+    return {
+        asset["Id"]
+        for page in paginator.paginate(PackagingGroupId=packaging_group)
+        for asset in page.get("Assets", [])
+    }
+
+
+def read_checkpoint(path: Path | None) -> dict[str, dict[str, Any]]:
+    """Return the last recorded result of every key in a checkpoint file."""
+    results: dict[str, dict[str, Any]] = {}
+    if path and path.exists():
+        for line in path.read_text().splitlines():
+            if line.strip():
+                record = json.loads(line)
+                results[record["Key"]] = record
+    return results
+
+
+class Checkpoint:
+    """Append results to a JSON lines file, flushed to disk after every record."""
+
+    def __init__(self, path: Path | None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = path.open("a") if path else None
+
+    def record(self, result: dict[str, Any]) -> None:
+        if not self._file:
+            return
+        with self._lock:
+            self._file.write(json.dumps(result, default=str) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+
+
+def create_event(bucket: str, item: dict[str, Any], region: str) -> dict[str, Any]:
+    """Create the EventBridge S3 Object Created event the MediaConvert function expects."""
+    return {
+        "version": "0",
+        "source": "aws.s3",
+        "detail-type": "Object Created",
+        "time": format_timestamp(),
+        "region": region,
+        "resources": [f"arn:aws:s3:::{bucket}"],
+        "detail": {
+            "bucket": {"name": bucket},
+            "object": {"key": item["Key"], "size": item["Size"], "etag": item["ETag"]},
+            "reason": "Backfill",
+        },
+    }
+
+
+def submit(
+    lambda_client: Any,
+    function_name: str,
+    bucket: str,
+    item: dict[str, Any],
+) -> dict[str, Any]:
+    """Invoke the MediaConvert function for one object and return its result."""
+    response = lambda_client.invoke(
+        FunctionName=function_name,
+        Payload=json.dumps(create_event(bucket, item, lambda_client.meta.region_name)),
+    )
+    payload = json.loads(response["Payload"].read() or "null")
+    result = {"Key": item["Key"], "Time": datetime.now(UTC).isoformat()}
+    if response.get("FunctionError"):
+        result.update(Status="FAILED", Error=(payload or {}).get("errorMessage", ""))
+    else:
+        result.update(
+            Status="SUBMITTED",
+            JobId=payload.get("Id"),
+            CorrelationId=payload.get("CorrelationId"),
+        )
+    return result
+
+
+def backfill(args: argparse.Namespace) -> dict[str, int]:
+    """Submit every video in the bucket that has no asset and no completed checkpoint entry."""
+    import boto3
+    from botocore.config import Config
+
+    config = Config(retries={"max_attempts": 10, "mode": "adaptive"})
+    s3 = boto3.client("s3", region_name=args.region, config=config)
+    videos = list_videos(s3, args.bucket, args.prefix, args.list_workers)
+
+    checkpoint = read_checkpoint(args.checkpoint)
+    existing: set[str] = set()
+    if args.packaging_group and not args.no_skip_existing:
+        mediapackage = boto3.client("mediapackage-vod", region_name=args.region, config=config)
+        existing = list_asset_ids(mediapackage, args.packaging_group)
+
+    counts = {"videos": len(videos), "done": 0, "exists": 0, "submitted": 0, "failed": 0}
+    pending = []
+    new_records = []
+    for item in videos:
+        if checkpoint.get(item["Key"], {}).get("Status") in DONE_STATUSES:
+            counts["done"] += 1
+        elif existing & get_asset_ids(args.destination_bucket, item["Key"]):
+            counts["exists"] += 1
+            new_records.append({"Key": item["Key"], "Status": "EXISTS"})
+        else:
+            pending.append(item)
+    pending = pending[: args.limit] if args.limit else pending
+
+    print(
+        f"{counts['videos']} videos: {counts['done']} already in the checkpoint, "
+        f"{counts['exists']} with an existing asset, {len(pending)} to submit",
+        file=sys.stderr,
+    )
+    if args.dry_run:
+        for item in pending:
+            print(f"s3://{args.bucket}/{item['Key']}")
+        counts["pending"] = len(pending)
+        return counts
+
+    writer = Checkpoint(args.checkpoint)
+    for record in new_records:
+        writer.record(record)
+
+    lambda_client = boto3.client("lambda", region_name=args.region, config=config)
+    governor = RateGovernor({"backfill": (args.rate, max(1, int(args.rate)))}, MemoryBucketStore())
+
+    def run(item: dict[str, Any]) -> dict[str, Any]:
+        # A wait that reaches the cap returns without a token, so wait again
+        while governor.acquire("backfill", "Submit") >= MAX_WAIT_SECONDS:
+            pass
+        try:
+            return submit(lambda_client, args.function_name, args.bucket, item)
+        except Exception as error:
+            return {"Key": item["Key"], "Status": "FAILED", "Error": str(error)}
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [executor.submit(run, item) for item in pending]
+            for index, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                writer.record(result)
+                counts["submitted" if result["Status"] == "SUBMITTED" else "failed"] += 1
+                if result["Status"] == "FAILED":
+                    print(f"Failed {result['Key']}: {result['Error']}", file=sys.stderr)
+                if index % 100 == 0 or index == len(futures):
+                    print(f"{index}/{len(futures)} processed", file=sys.stderr)
+    finally:
+        writer.close()
+    return counts
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments and resolve the stack resources."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stack-name", help="look up the function, buckets and packaging group")
+    parser.add_argument("--function-name", help="MediaConvert function to invoke")
+    parser.add_argument("--bucket", help="source bucket to backfill")
+    parser.add_argument("--destination-bucket", help="bucket MediaConvert writes to")
+    parser.add_argument("--packaging-group", help="MediaPackage packaging group of the assets")
+    parser.add_argument("--region", help="AWS region of the stack")
+    parser.add_argument("--prefix", default="", help="only backfill keys under this prefix")
+    parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        default=Path("backfill.jsonl"),
+        help="JSON lines file of results, read to resume (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1.0,
+        help="jobs submitted per second (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="function invocations in flight at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--list-workers",
+        type=int,
+        default=16,
+        help="prefixes listed in parallel (default: %(default)s)",
+    )
+    parser.add_argument("--limit", type=int, help="submit at most this many titles")
+    parser.add_argument(
+        "--no-skip-existing",
+        action="store_true",
+        help="submit titles even when their MediaPackage asset exists",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the titles that would be submitted without invoking anything",
+    )
+    args = parser.parse_args()
+
+    if args.stack_name:
+        for key, value in resolve_stack(args.stack_name, args.region).items():
+            if not getattr(args, key):
+                setattr(args, key, value)
+    if not args.bucket or (not args.function_name and not args.dry_run):
+        parser.error("--stack-name, or --bucket and --function-name, are required")
+    if args.packaging_group and not args.destination_bucket:
+        parser.error("--destination-bucket is required with --packaging-group")
+    if args.rate <= 0:
+        parser.error("--rate must be greater than 0")
+    return args
+
+
+def main() -> None:
+    """Run the backfill and exit with status 1 if any title failed."""
+    args = parse_args()
+    counts = backfill(args)
+    print(json.dumps(counts))
+    if counts["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
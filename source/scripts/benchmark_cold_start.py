@@ -0,0 +1,738 @@
+#!/usr/bin/env python3
+"""
+Measure cold-start import time and first-invocation latency of every Lambda.
+
+Each handler is imported in a fresh interpreter started with ``-X importtime``,
+then invoked twice against stubbed AWS clients (botocore Stubber), so no AWS
+account or network access is needed. The script reports, per handler:
+
+ - wall time to import the handler module
+ - the heaviest modules imported by the handler and by its first invocation
+ - wall time of the first (cold) and second (warm) invocation
+
+Sleeps inside handlers are skipped and reported separately so results are not
+dominated by fixed or random delays.
+
+Usage:
+    cd source/scripts
+    python3 benchmark_cold_start.py                       # print results
+    python3 benchmark_cold_start.py --output benchmarks/cold_start_baseline.json
+    python3 benchmark_cold_start.py --compare benchmarks/cold_start_baseline.json
+
+With ``--compare`` the script exits with status 1 when a handler is slower than
+the baseline by more than the tolerance.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+SOURCE_DIR = Path(__file__).resolve().parent.parent
+LAYER_DIR = SOURCE_DIR / "layers" / "fast_common"
+RESULT_PREFIX = "BENCHMARK_RESULT "
+IMPORT_START_MARKER = "BENCHMARK_IMPORT_START"
+IMPORT_END_MARKER = "BENCHMARK_IMPORT_END"
+INVOKE_START_MARKER = "BENCHMARK_INVOKE_START"
+INVOKE_END_MARKER = "BENCHMARK_INVOKE_END"
+
+ACCOUNT_ID = "123456789012"
+REGION = "us-east-1"
+STACK_ID = f"arn:aws:cloudformation:{REGION}:{ACCOUNT_ID}:stack/fast/abcd1234-0000-0000-0000-000000000000"
+EGRESS_URL = "https://abc.egress.mediapackage-vod.us-east-1.amazonaws.com/out/v1/abc/video"
+CHANNEL_URL = f"https://channel-assembly.mediatailor.{REGION}.amazonaws.com/v1/channel/fast-Sample"
+
+JOB_TEMPLATE = {
+    "Name": "fast-MediaConvertJobTemplate",
+    "Settings": {
+        "Inputs": [{"TimecodeSource": "ZEROBASED"}],
+        "OutputGroups": [
+            {
+                "Name": "Apple HLS",
+                "Outputs": [{"Preset": "fast-MediaConvertPreset720AVC3000", "NameModifier": "_1"}],
+                "OutputGroupSettings": {
+                    "Type": "HLS_GROUP_SETTINGS",
+                    "HlsGroupSettings": {"SegmentLength": 6, "Destination": "s3://output/"},
+                },
+            }
+        ],
+    },
+}
+
+SCHEDULE_START = datetime.now(UTC).replace(microsecond=0)
+
+CUSTOM_RESOURCE_EVENT = {
+    "RequestType": "Create",
+    "StackId": STACK_ID,
+    "ResponseURL": "https://cloudformation-custom-resource-response.example.com/",
+    "RequestId": "request-1",
+    "LogicalResourceId": "Resource",
+    "ResourceType": "Custom::Benchmark",
+}
+
+PLAYBACK_URLS_DETAIL = {
+    "playbackUrls": [
+        {
+            "assetId": "video",
+            "packagingConfigurationId": "fast-Hls",
+            "vodPlaybackUrl": f"{EGRESS_URL}/index.m3u8",
+            "adOffsets": "30000 90000",
+        }
+    ]
+}
+
+MASTER_PLAYLIST = "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=3000000\nvideo_1.m3u8\n"
+MEDIA_PLAYLIST = (
+    "#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXTINF:6.000,\nvideo_1_00001.ts\n"
+    "#EXTINF:4.000,\nvideo_1_00002.ts\n#EXT-X-ENDLIST\n"
+)
+
+
+def playlist_response(playlist: str) -> dict[str, Any]:
+    """Return a GetObject response with a fresh streaming body."""
+    import io
+
+    from botocore.response import StreamingBody
+
+    body = playlist.encode()
+    return {"Body": StreamingBody(io.BytesIO(body), len(body)), "ContentLength": len(body)}
+
+
+# Each scenario lists the handler, its environment, the event, and the stubbed
+# AWS responses in the order the handler requests them.
+SCENARIOS: dict[str, dict[str, Any]] = {
+    "media_convert_job": {
+        "path": "functions/media_convert_job/app.py",
+        "entry": "lambda_handler",
+        "env": {
+            "MediaConvertJobTemplate": "fast-MediaConvertJobTemplate",
+            "MediaConvertTranscodeRoleArn": f"arn:aws:iam::{ACCOUNT_ID}:role/transcode",
+        },
+        "event": {
+            "detail-type": "Object Created",
+            "detail": {"bucket": {"name": "input"}, "object": {"key": "video.mp4"}},
+        },
+        "responses": [
+            ("s3", "get_object_tagging", {"TagSet": [{"Key": "AdOffsets", "Value": "30000 90000"}]}),
+            ("mediaconvert", "get_job_template", {"JobTemplate": JOB_TEMPLATE}),
+            ("s3", "head_object", {"ETag": '"9b2cf535f27731c974343645a3985328"'}),
+            (
+                "mediaconvert",
+                "create_job",
+                {"Job": {"Id": "job-1", "Status": "SUBMITTED", "Role": "role", "Settings": {}}},
+            ),
+        ],
+    },
+    "mediapackage_vod_asset": {
+        "path": "functions/mediapackage_vod_asset/app.py",
+        "entry": "lambda_handler",
+        "env": {
+            "MediaPackagePackagingGroupId": "fast-PackagingGroup",
+            "MediaPackageReadS3RoleArn": f"arn:aws:iam::{ACCOUNT_ID}:role/read-s3",
+            "MediaTailorPlaybackConfigurationVodHls": "https://tailor.example.com/v1/master/abc/vod/",
+            "MediaTailorPlaybackConfigurationVodDash": "https://tailor.example.com/v1/dash/abc/vod/",
+            "StackName": "fast",
+        },
+        "event": {
+            "detail": {
+                "status": "COMPLETE",
+                "userMetadata": {"AdOffsets": "30000 90000"},
+                "outputGroupDetails": [{"playlistFilePaths": ["s3://output/video.m3u8"]}],
+            }
+        },
+        "responses": [
+            ("s3", "get_object", lambda: playlist_response(MASTER_PLAYLIST)),
+            ("s3", "get_object", lambda: playlist_response(MEDIA_PLAYLIST)),
+            (
+                "s3",
+                "list_objects_v2",
+                {"Contents": [{"Key": "video_1_00001.ts"}, {"Key": "video_1_00002.ts"}]},
+            ),
+            ("s3", "put_object", {"ETag": '"etag"'}),
+            (
+                "mediapackage-vod",
+                "create_asset",
+                {
+                    "Id": "video",
+                    "EgressEndpoints": [
+                        {"PackagingConfigurationId": "fast-Hls", "Url": f"{EGRESS_URL}/index.m3u8"},
+                        {"PackagingConfigurationId": "fast-Dash", "Url": f"{EGRESS_URL}/index.mpd"},
+                    ],
+                },
+            ),
+            ("events", "put_events", {"FailedEntryCount": 0, "Entries": [{"EventId": "event-1"}]}),
+            ("mediapackage-vod", "describe_asset", {"Id": "video"}),
+        ],
+    },
+    "mediatailor_vod_source": {
+        "path": "functions/mediatailor_vod_source/app.py",
+        "entry": "lambda_handler",
+        "env": {
+            "MediaTailorSourceLocation": "fast-SourceLocation",
+            "MediaTailorChannelName": "fast-Sample",
+        },
+        "event": {
+            "resources": [f"arn:aws:mediapackage-vod:{REGION}:{ACCOUNT_ID}:assets/video"],
+            "detail": {
+                "event": "VodAssetPlayable",
+                "manifest_urls": [f"{EGRESS_URL}/index.m3u8"],
+                "packaging_configuration_id": "fast-Hls",
+            },
+        },
+        "responses": [
+            ("mediapackage-vod", "list_tags_for_resource", {"Tags": {"AdOffsets": "30000 90000"}}),
+            ("mediatailor", "create_vod_source", {"VodSourceName": "video"}),
+            ("mediatailor", "describe_vod_source", {"VodSourceName": "video"}),
+            ("mediatailor", "get_channel_schedule", {"Items": []}),
+            ("mediatailor", "create_program", {"ProgramName": "video"}),
+            ("events", "put_events", {"FailedEntryCount": 0, "Entries": [{"EventId": "event-1"}]}),
+        ],
+    },
+    "epg_exporter": {
+        "path": "functions/epg_exporter/app.py",
+        "entry": "lambda_handler",
+        "env": {"EpgBucket": "output", "EpgChannelNames": "fast-Sample"},
+        "event": {"detail-type": "Scheduled Event", "source": "aws.events", "detail": {}},
+        "responses": [
+            ("s3", "get_object", lambda: playlist_response("{}")),
+            (
+                "mediatailor",
+                "describe_channel",
+                {"PlaybackMode": "LOOP", "LogConfiguration": {"LogTypes": []}},
+            ),
+            (
+                "mediatailor",
+                "get_channel_schedule",
+                {
+                    "Items": [
+                        {
+                            "ChannelName": "fast-Sample",
+                            "ProgramName": f"video{index}",
+                            "SourceLocationName": "fast-SourceLocation",
+                            "VodSourceName": f"video{index % 2}",
+                            "ApproximateStartTime": SCHEDULE_START + timedelta(minutes=30 * index),
+                            "ApproximateDurationSeconds": 1800,
+                            "ScheduleEntryType": "PROGRAM",
+                            "Arn": f"arn:aws:mediatailor:{REGION}:{ACCOUNT_ID}:program/video{index}",
+                        }
+                        for index in range(48)
+                    ]
+                },
+            ),
+            ("mediapackage-vod", "describe_asset", {"Id": "video0", "Tags": {"Genre": "Drama"}}),
+            ("mediatailor", "describe_vod_source", {"Tags": {"Title": "Video 0"}}),
+            ("mediapackage-vod", "describe_asset", {"Id": "video1", "Tags": {"Genre": "Drama"}}),
+            ("mediatailor", "describe_vod_source", {"Tags": {"Title": "Video 1"}}),
+            ("s3", "put_object", {}),
+            ("s3", "put_object", {}),
+            ("s3", "put_object", {}),
+        ],
+    },
+    "schedule_refill": {
+        "path": "functions/schedule_refill/app.py",
+        "entry": "lambda_handler",
+        "env": {
+            "MediaTailorSourceLocation": "fast-SourceLocation",
+            "ScheduleBucket": "output",
+            "ScheduleChannelNames": "fast-Sample",
+            "ScheduleHorizonHours": "1",
+        },
+        "event": {"detail-type": "Scheduled Event", "source": "aws.events", "detail": {}},
+        "responses": [
+            (
+                "mediatailor",
+                "list_vod_sources",
+                {
+                    "Items": [
+                        {
+                            "Arn": f"arn:aws:mediatailor:{REGION}:{ACCOUNT_ID}:vodSource/{name}",
+                            "HttpPackageConfigurations": [
+                                {"Path": "/index.m3u8", "SourceGroup": "fast-Hls", "Type": "HLS"}
+                            ],
+                            "SourceLocationName": "fast-SourceLocation",
+                            "VodSourceName": name,
+                            "Tags": tags,
+                        }
+                        for name, tags in (
+                            ("video0", {"AdOffsets": "30000 90000"}),
+                            ("video1", {}),
+                            ("AdBreakSlate30000", {"SlateDurationMillis": "30000"}),
+                        )
+                    ]
+                },
+            ),
+            (
+                "mediatailor",
+                "describe_channel",
+                {"PlaybackMode": "LINEAR", "LogConfiguration": {"LogTypes": []}},
+            ),
+            ("s3", "get_object", lambda: playlist_response("{}")),
+            ("mediatailor", "get_channel_schedule", {"Items": []}),
+            (
+                "mediatailor",
+                "create_program",
+                {
+                    "ProgramName": "video0",
+                    "ScheduledStartTime": SCHEDULE_START,
+                    "DurationMillis": 1800000,
+                },
+            ),
+            (
+                "mediatailor",
+                "create_program",
+                {
+                    "ProgramName": "video1",
+                    "ScheduledStartTime": SCHEDULE_START + timedelta(minutes=30),
+                    "DurationMillis": 3600000,
+                },
+            ),
+            ("s3", "put_object", {}),
+            ("events", "put_events", {"FailedEntryCount": 0, "Entries": [{"EventId": "event-1"}]}),
+        ],
+    },
+    "hls_stitcher": {
+        "path": "functions/hls_stitcher/app.py",
+        "entry": "lambda_handler",
+        "env": {"StackName": "fast"},
+        "event": {
+            "detail": {
+                "status": "COMPLETE",
+                "jobId": "job-2",
+                "userMetadata": {
+                    "CorrelationId": "group-1",
+                    "ChunkGroup": "group-1",
+                    "ChunkIndex": "1",
+                    "ChunkCount": "2",
+                },
+                "outputGroupDetails": [
+                    {"playlistFilePaths": ["s3://output/chunks/group-1/001/video.m3u8"]}
+                ],
+            }
+        },
+        "responses": [
+            ("s3", "put_object", {}),
+            (
+                "s3",
+                "list_objects_v2",
+                {
+                    "Contents": [
+                        {"Key": f"chunks/group-1/complete/{index:03d}.json"} for index in range(2)
+                    ]
+                },
+            ),
+            ("s3", "put_object", {}),
+            *[
+                (
+                    "s3",
+                    "get_object",
+                    lambda index=index: playlist_response(json.dumps({
+                        "Index": index,
+                        "JobId": f"job-{index + 1}",
+                        "Queue": "",
+                        "Timing": {},
+                        "Playlist": f"s3://output/chunks/group-1/{index:03d}/video.m3u8",
+                        "Type": "HLS_GROUP",
+                        "UserMetadata": {"ChunkGroup": "group-1", "ChunkIndex": str(index)},
+                    })),
+                )
+                for index in range(2)
+            ],
+            ("s3", "get_object", lambda: playlist_response(MASTER_PLAYLIST)),
+            ("s3", "get_object", lambda: playlist_response(MASTER_PLAYLIST)),
+            ("s3", "get_object", lambda: playlist_response(MEDIA_PLAYLIST)),
+            ("s3", "get_object", lambda: playlist_response(MEDIA_PLAYLIST)),
+            ("s3", "put_object", {}),
+            ("s3", "put_object", {}),
+            ("events", "put_events", {"FailedEntryCount": 0, "Entries": [{"EventId": "event-1"}]}),
+        ],
+    },
+    "sns_email_sender": {
+        "path": "functions/sns_email_sender/app.py",
+        "entry": "lambda_handler",
+        "env": {"SnsTopicArn": f"arn:aws:sns:{REGION}:{ACCOUNT_ID}:topic", "StackName": "fast"},
+        "event": {"detail-type": "Playback URLs", "detail": PLAYBACK_URLS_DETAIL},
+        "responses": [("sns", "publish", {"MessageId": "message-1"})],
+    },
+    "sns_email_sender_digest": {
+        "path": "functions/sns_email_sender/app.py",
+        "entry": "lambda_handler",
+        "env": {
+            "SnsTopicArn": f"arn:aws:sns:{REGION}:{ACCOUNT_ID}:topic",
+            "StackName": "fast",
+            "DigestBucket": "output",
+        },
+        "event": {
+            "Records": [
+                {"body": json.dumps({"detail-type": "Playback URLs", "detail": PLAYBACK_URLS_DETAIL})}
+            ]
+            * 100
+        },
+        "responses": [
+            ("s3", "put_object", {}),
+            ("sns", "publish", {"MessageId": "message-1"}),
+        ],
+    },
+    "channel_assembly_channel": {
+        "path": "resources/channel_assembly_channel/app.py",
+        "entry": "create",
+        "env": {},
+        "event": {
+            **CUSTOM_RESOURCE_EVENT,
+            "ResourceProperties": {
+                "Name": "fast-Sample",
+                "StackName": "fast",
+                "MediaPackagePackagingGroup": {"Id": "fast-PackagingGroup"},
+            },
+        },
+        "responses": [
+            (
+                "mediapackage-vod",
+                "list_packaging_configurations",
+                {
+                    "PackagingConfigurations": [
+                        {"Id": "fast-Hls", "HlsPackage": {"HlsManifests": [{"ManifestName": "hls"}]}}
+                    ]
+                },
+            ),
+            (
+                "mediatailor",
+                "create_channel",
+                {
+                    "Arn": f"arn:aws:mediatailor:{REGION}:{ACCOUNT_ID}:channel/fast-Sample",
+                    "ChannelName": "fast-Sample",
+                    "Outputs": [
+                        {
+                            "ManifestName": "fast-Hls",
+                            "SourceGroup": "fast-Hls",
+                            "PlaybackUrl": f"{CHANNEL_URL}/fast-Hls.m3u8",
+                        }
+                    ],
+                },
+            ),
+            ("mediatailor", "put_channel_policy", {}),
+        ],
+    },
+    "channel_assembly_source_location": {
+        "path": "resources/channel_assembly_source_location/app.py",
+        "entry": "create",
+        "env": {},
+        "event": {
+            **CUSTOM_RESOURCE_EVENT,
+            "ResourceProperties": {
+                "Name": "fast-SourceLocation",
+                "StackName": "fast",
+                "MediaPackageAccessSecretArn": f"arn:aws:secretsmanager:{REGION}:{ACCOUNT_ID}:secret:s",
+                "CloudFrontDistribution": {"DomainName": "d123.cloudfront.net"},
+                "MediaPackagePackagingGroup": {"DomainName": EGRESS_URL},
+            },
+        },
+        "responses": [("mediatailor", "create_source_location", {})],
+    },
+    "channel_assembly_slates": {
+        "path": "resources/channel_assembly_slates/app.py",
+        "entry": "create",
+        "env": {},
+        "event": {
+            **CUSTOM_RESOURCE_EVENT,
+            "ResourceProperties": {
+                "SlateDurationInMillis": "30000",
+                "MediaConvertTranscodeRoleArn": f"arn:aws:iam::{ACCOUNT_ID}:role/transcode",
+                "MediaConvertJobTemplate": {"Name": "fast-MediaConvertJobTemplate"},
+                "VideoDestinationBucket": "output",
+            },
+        },
+        "responses": [
+            ("mediaconvert", "get_job_template", {"JobTemplate": JOB_TEMPLATE}),
+            (
+                "mediaconvert",
+                "get_preset",
+                {
+                    "Preset": {
+                        "Name": "fast-MediaConvertPreset720AVC3000",
+                        "Settings": {
+                            "VideoDescription": {
+                                "CodecSettings": {"Codec": "H_264", "H264Settings": {}}
+                            }
+                        },
+                    }
+                },
+            ),
+            (
+                "mediaconvert",
+                "create_job",
+                {"Job": {"Id": "job-1", "Status": "COMPLETE", "Role": "role", "Settings": {}}},
+            ),
+        ],
+    },
+}
+
+
+class LambdaContext:
+    """Minimal stand-in for the Lambda context object."""
+
+    function_name = "benchmark"
+    aws_request_id = "benchmark-request"
+    invoked_function_arn = f"arn:aws:lambda:{REGION}:{ACCOUNT_ID}:function:benchmark"
+
+    def get_remaining_time_in_millis(self) -> int:
+        return 60_000
+
+
+def mark(marker: str) -> None:
+    """Write a marker to stderr so the importtime output can be split by phase."""
+    sys.stderr.write(f"{marker}\n")
+    sys.stderr.flush()
+
+
+def install_stubs(scenario: dict[str, Any], invocations: int) -> list[float]:
+    """
+    Stub every AWS client the handler creates and skip its sleeps.
+
+    Returns a list that accumulates the sleep durations the handler requested.
+    """
+    from fast_common import clients
+
+    create_client = clients.create_client
+
+    def create_stubbed_client(service_name: str, endpoint_url: str | None = None) -> Any:
+        client = create_client(service_name, endpoint_url)
+        # Imported only once boto3 is loaded so it does not skew the import breakdown
+        from botocore.stub import Stubber
+
+        stubber = Stubber(client)
+        for _ in range(invocations):
+            for service, operation, response in scenario["responses"]:
+                if service == service_name:
+                    # Callables build responses that can only be read once
+                    stubber.add_response(operation, response() if callable(response) else response)
+        stubber.activate()
+        return client
+
+    clients.create_client = create_stubbed_client
+
+    slept: list[float] = []
+
+    def skip_sleep(seconds: float) -> None:
+        slept.append(seconds)
+
+    time.sleep = skip_sleep
+    return slept
+
+
+def run_child(name: str) -> None:
+    """Import and invoke one handler, printing the measurements as JSON."""
+    scenario = SCENARIOS[name]
+    handler_path = SOURCE_DIR / scenario["path"]
+
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": REGION,
+        "AWS_EC2_METADATA_DISABLED": "true",
+        "LOG_LEVEL": "WARNING",
+        **scenario["env"],
+    })
+    sys.path[:0] = [str(LAYER_DIR), str(handler_path.parent)]
+
+    mark(IMPORT_START_MARKER)
+    start = time.perf_counter()
+    spec = importlib.util.spec_from_file_location("app", handler_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["app"] = module
+    spec.loader.exec_module(module)
+    import_ms = (time.perf_counter() - start) * 1000
+    mark(IMPORT_END_MARKER)
+
+    slept = install_stubs(scenario, invocations=2)
+    if hasattr(module, "sleep"):
+        module.sleep = time.sleep
+    entry = getattr(module, scenario["entry"])
+    context = LambdaContext()
+
+    timings = []
+    for invocation in range(2):
+        event = json.loads(json.dumps(scenario["event"]))
+        if invocation == 0:
+            mark(INVOKE_START_MARKER)
+        start = time.perf_counter()
+        entry(event, context)
+        timings.append((time.perf_counter() - start) * 1000)
+        if invocation == 0:
+            mark(INVOKE_END_MARKER)
+
+    print(RESULT_PREFIX + json.dumps({
+        "import_ms": import_ms,
+        "first_invocation_ms": timings[0],
+        "warm_invocation_ms": timings[1],
+        "skipped_sleep_s": sum(slept) / 2,
+    }))
+
+
+def parse_importtime(stderr: str, start_marker: str, end_marker: str | None) -> dict[str, float]:
+    """Return cumulative import time in ms of the top-level imports between two markers."""
+    modules: dict[str, float] = {}
+    active = False
+
+    for line in stderr.splitlines():
+        if line == start_marker:
+            active = True
+            continue
+        if end_marker and line == end_marker:
+            break
+        if not active or not line.startswith("import time:"):
+            continue
+
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        # Nested imports are indented by two spaces per level
+        if name.startswith("  "):
+            continue
+        modules[name.strip()] = int(cumulative) / 1000
+
+    return modules
+
+
+def top_modules(modules: dict[str, float], count: int = 5) -> dict[str, float]:
+    """Return the slowest ``count`` modules, rounded for reporting."""
+    ranked = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:count]
+    return {name: round(ms, 1) for name, ms in ranked}
+
+
+def benchmark(name: str, runs: int) -> dict[str, Any]:
+    """Benchmark one handler over several fresh interpreters and return medians."""
+    samples = []
+    import_breakdown: dict[str, list[float]] = {}
+    invoke_breakdown: dict[str, list[float]] = {}
+
+    for _ in range(runs):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", __file__, "--child", name],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        result_lines = [
+            line for line in process.stdout.splitlines() if line.startswith(RESULT_PREFIX)
+        ]
+        if process.returncode != 0 or not result_lines:
+            raise RuntimeError(f"Benchmark of {name} failed:\n{process.stderr[-4000:]}")
+
+        samples.append(json.loads(result_lines[-1][len(RESULT_PREFIX):]))
+        for module, ms in parse_importtime(
+            process.stderr, IMPORT_START_MARKER, IMPORT_END_MARKER
+        ).items():
+            import_breakdown.setdefault(module, []).append(ms)
+        for module, ms in parse_importtime(
+            process.stderr, INVOKE_START_MARKER, INVOKE_END_MARKER
+        ).items():
+            invoke_breakdown.setdefault(module, []).append(ms)
+
+    def median(key: str) -> float:
+        return round(statistics.median(sample[key] for sample in samples), 1)
+
+    return {
+        "import_ms": median("import_ms"),
+        "first_invocation_ms": median("first_invocation_ms"),
+        "warm_invocation_ms": median("warm_invocation_ms"),
+        "skipped_sleep_s": median("skipped_sleep_s"),
+        "import_top_modules": top_modules(
+            {module: statistics.median(values) for module, values in import_breakdown.items()}
+        ),
+        "first_invocation_top_modules": top_modules(
+            {module: statistics.median(values) for module, values in invoke_breakdown.items()}
+        ),
+    }
+
+
+def compare(
+    results: dict[str, dict[str, Any]],
+    baseline: dict[str, dict[str, Any]],
+    tolerance: float,
+    floor_ms: float,
+) -> list[str]:
+    """Return a description of every measurement that regressed against the baseline."""
+    regressions = []
+
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for key in ("import_ms", "first_invocation_ms", "warm_invocation_ms"):
+            limit = previous[key] * (1 + tolerance) + floor_ms
+            if result[key] > limit:
+                regressions.append(
+                    f"{name} {key}: {result[key]:.1f} ms > {limit:.1f} ms "
+                    f"(baseline {previous[key]:.1f} ms)"
+                )
+
+    return regressions
+
+
+def print_table(results: dict[str, dict[str, Any]]) -> None:
+    """Print the benchmark results as a plain text table."""
+    print(f"{'handler':36} {'import':>9} {'first':>9} {'warm':>9} {'sleep':>7}  heaviest imports")
+    for name, result in results.items():
+        heaviest = ", ".join(
+            f"{module} {ms:.0f}"
+            for module, ms in list(result["import_top_modules"].items())[:3]
+        )
+        print(
+            f"{name:36} {result['import_ms']:7.1f}ms {result['first_invocation_ms']:7.1f}ms "
+            f"{result['warm_invocation_ms']:7.1f}ms {result['skipped_sleep_s']:6.1f}s  {heaviest}"
+        )
+
+
+def main() -> None:
+    """Run the benchmark for every (or the selected) handler."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--handler", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per handler")
+    parser.add_argument("--output", type=Path, help="write results to a JSON file")
+    parser.add_argument("--compare", type=Path, help="baseline JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative slowdown")
+    parser.add_argument("--floor-ms", type=float, default=10.0, help="allowed absolute slowdown")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    results = {name: benchmark(name, args.runs) for name in args.handler or SCENARIOS}
+    print_table(results)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps({
+            "environment": {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "system": platform.system(),
+                "runs": args.runs,
+            },
+            "handlers": results,
+        }, indent=2) + "\n")
+        print(f"Wrote {args.output}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())["handlers"]
+        regressions = compare(results, baseline, args.tolerance, args.floor_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Generate the CloudFront distribution in front of MediaPackage and MediaTailor.
+
+Manifests, media segments and MediaTailor ad segments are requested at very
+different rates and change at very different rates, so each gets its own
+cache behavior and cache policy:
+
+- ``*.m3u8`` and ``*.mpd`` manifests are cached briefly and compressed.
+- Media segments, the default behavior, are cached for a day and sent as-is,
+  because compressing compressed media only costs CPU at the edge.
+- ``/tm/*`` ad segments transcoded by MediaTailor come from the MediaTailor
+  segment origin, cached for a day like content segments.
+
+Cache keys hold no headers or cookies, and only manifests keep the MediaPackage
+manifest filter query string, so every viewer of a title shares one cached
+object per edge. Origin Shield adds a regional cache in front of MediaPackage,
+so a popular premiere reaches the origin once per object instead of once per
+edge location.
+
+With ``--check`` nothing is written: the template is validated and compared
+with the committed file, and the script exits with an error if either check
+fails. TTLs that are not given are read from the committed file, so a
+template generated with ``--manifest-ttl`` or ``--segment-ttl`` still checks
+as up to date. The tests under source/tests/cdn cover the generated behaviors.
+
+Usage:
+    cd source/scripts
+    python3 generate_cdn.py
+    python3 generate_cdn.py --manifest-ttl 30 --segment-ttl 604800
+    python3 generate_cdn.py --check
+
+The generated template is written to deployment/cdn.deployment
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any
+
+import cfn_flip
+import troposphere.cloudfront as cloudfront
+from troposphere import (
+    Equals,
+    GetAtt,
+    If,
+    Not,
+    Output,
+    Parameter,
+    Ref,
+    Select,
+    Split,
+    Sub,
+    Template,
+)
+
+# Managed CORS-With-Preflight response headers policy, so browser players can fetch
+CORS_RESPONSE_HEADERS_POLICY = "5cc3b908-e619-4b99-88e5-2cf7f45965bd"
+
+MEDIAPACKAGE_ORIGIN = "MediaPackage"
+MEDIATAILOR_ORIGIN = "MediaTailorAdSegments"
+
+# Query string MediaPackage VOD reads to filter the renditions of a manifest
+MANIFEST_QUERY_STRINGS = ["aws.manifestfilter"]
+
+DEFAULT_MANIFEST_TTL = 60
+DEFAULT_SEGMENT_TTL = 86400
+MAX_SEGMENT_TTL = 31536000
+
+OUTPUT_FILE = Path(__file__).resolve().parent.parent.parent / "deployment" / "cdn.deployment"
+
+# Origin Shield settings of the MediaPackage origin, enabled by the UseOriginShield condition
+ORIGIN_SHIELD = {
+    "Enabled": {"Fn::If": ["UseOriginShield", True, False]},
+    "OriginShieldRegion": {
+        "Fn::If": ["UseOriginShield", {"Ref": "OriginShieldRegion"}, {"Ref": "AWS::NoValue"}]
+    },
+}
+
+# Cache behaviors in evaluation order; the behavior without a path pattern is the default
+BEHAVIORS = [
+    {"PathPattern": "/tm/*", "Origin": MEDIATAILOR_ORIGIN, "CachePolicy": "AdSegment"},
+    {"PathPattern": "*.m3u8", "Origin": MEDIAPACKAGE_ORIGIN, "CachePolicy": "Manifest"},
+    {"PathPattern": "*.mpd", "Origin": MEDIAPACKAGE_ORIGIN, "CachePolicy": "Manifest"},
+    {"PathPattern": None, "Origin": MEDIAPACKAGE_ORIGIN, "CachePolicy": "Segment"},
+]
+
+
+def get_cache_policies(manifest_ttl: int, segment_ttl: int) -> dict[str, dict[str, Any]]:
+    """Return the TTLs, query strings and compression of each cache policy."""
+    return {
+        "Manifest": {
+            "Comment": "Manifests, cached briefly and compressed",
+            # A one second floor collapses simultaneous requests even for no-cache responses
+            "MinTTL": 1,
+            "DefaultTTL": manifest_ttl,
+            "MaxTTL": max(manifest_ttl, 300),
+            "QueryStrings": MANIFEST_QUERY_STRINGS,
+            "Compress": True,
+        },
+        "Segment": {
+            "Comment": "Media segments, cached for long and never compressed",
+            "MinTTL": 0,
+            "DefaultTTL": segment_ttl,
+            "MaxTTL": max(segment_ttl, MAX_SEGMENT_TTL),
+            "QueryStrings": [],
+            "Compress": False,
+        },
+        "AdSegment": {
+            "Comment": "MediaTailor ad segments, cached for long and never compressed",
+            "MinTTL": 0,
+            "DefaultTTL": segment_ttl,
+            "MaxTTL": max(segment_ttl, MAX_SEGMENT_TTL),
+            "QueryStrings": [],
+            "Compress": False,
+        },
+    }
+
+
+def create_cache_policy(name: str, settings: dict[str, Any]) -> cloudfront.CachePolicy:
+    """Create a cache policy whose key holds no headers or cookies."""
+    if settings["QueryStrings"]:
+        query_strings = cloudfront.CacheQueryStringsConfig(
+            QueryStringBehavior="whitelist", QueryStrings=settings["QueryStrings"]
+        )
+    else:
+        query_strings = cloudfront.CacheQueryStringsConfig(QueryStringBehavior="none")
+
+    return cloudfront.CachePolicy(
+        f"{name}CachePolicy",
+        CachePolicyConfig=cloudfront.CachePolicyConfig(
+            Name=Sub(f"${{StackName}}-{name}"),
+            Comment=settings["Comment"],
+            MinTTL=settings["MinTTL"],
+            DefaultTTL=settings["DefaultTTL"],
+            MaxTTL=settings["MaxTTL"],
+            ParametersInCacheKeyAndForwardedToOrigin=(
+                cloudfront.ParametersInCacheKeyAndForwardedToOrigin(
+                    CookiesConfig=cloudfront.CacheCookiesConfig(CookieBehavior="none"),
+                    HeadersConfig=cloudfront.CacheHeadersConfig(HeaderBehavior="none"),
+                    QueryStringsConfig=query_strings,
+                    # Accept-Encoding only joins the cache key where responses are compressed
+                    EnableAcceptEncodingGzip=settings["Compress"],
+                    EnableAcceptEncodingBrotli=settings["Compress"],
+                )
+            ),
+        ),
+    )
+
+
+def create_behavior(
+    behavior: dict[str, Any], policy: cloudfront.CachePolicy, compress: bool
+) -> dict[str, Any]:
+    """Return the properties shared by a path pattern behavior and the default behavior."""
+    properties = {
+        "TargetOriginId": behavior["Origin"],
+        "CachePolicyId": Ref(policy),
+        "ResponseHeadersPolicyId": CORS_RESPONSE_HEADERS_POLICY,
+        "ViewerProtocolPolicy": "redirect-to-https",
+        "Compress": compress,
+    }
+    if behavior["PathPattern"]:
+        properties["PathPattern"] = behavior["PathPattern"]
+    return properties
+
+
+def create_origins() -> list[cloudfront.Origin]:
+    """Create the MediaPackage origin, behind Origin Shield, and the MediaTailor ad origin."""
+    origin_config = cloudfront.CustomOriginConfig(
+        OriginProtocolPolicy="https-only",
+        OriginSSLProtocols=["TLSv1.2"],
+    )
+    return [
+        cloudfront.Origin(
+            Id=MEDIAPACKAGE_ORIGIN,
+            DomainName=Select(1, Split("https://", Ref("PackagingGroupDomainName"))),
+            CustomOriginConfig=origin_config,
+            OriginCustomHeaders=[
+                cloudfront.OriginCustomHeader(
+                    HeaderName="X-MediaPackage-CDNIdentifier",
+                    HeaderValue=Ref("CdnIdentifier"),
+                )
+            ],
+            OriginShield=cloudfront.OriginShield(
+                Enabled=If("UseOriginShield", True, False),
+                OriginShieldRegion=If(
+                    "UseOriginShield", Ref("OriginShieldRegion"), Ref("AWS::NoValue")
+                ),
+            ),
+        ),
+        cloudfront.Origin(
+            Id=MEDIATAILOR_ORIGIN,
+            DomainName=Sub("segments.mediatailor.${AWS::Region}.amazonaws.com"),
+            CustomOriginConfig=origin_config,
+        ),
+    ]
+
+
+def build_template(
+    manifest_ttl: int = DEFAULT_MANIFEST_TTL,
+    segment_ttl: int = DEFAULT_SEGMENT_TTL,
+) -> Template:
+    """
+    Build the CloudFront distribution and its cache policies.
+
+    ``manifest_ttl`` and ``segment_ttl`` are the default TTLs in seconds of
+    manifests and of media and ad segments, used when the origin sends no
+    ``Cache-Control`` header.
+    """
+    template = Template()
+    template.set_transform("AWS::Serverless-2016-10-31")
+    template.set_version("2010-09-09")
+    template.set_description(
+        "CloudFront distribution for FAST channel manifests, segments and ad segments"
+    )
+
+    # Add parameters
+    template.add_parameter(Parameter(
+        "StackName",
+        Type="String",
+        Description="Name of Parent Stack",
+    ))
+
+    template.add_parameter(Parameter(
+        "PackagingGroupDomainName",
+        Type="String",
+        Description="The https:// domain name of the MediaPackage packaging group",
+    ))
+
+    template.add_parameter(Parameter(
+        "CdnIdentifier",
+        Type="String",
+        NoEcho=True,
+        Description="The CDN identifier MediaPackage requires in the X-MediaPackage-CDNIdentifier header",
+    ))
+
+    template.add_parameter(Parameter(
+        "OriginShieldRegion",
+        Type="String",
+        Default="",
+        Description="Region of the Origin Shield in front of MediaPackage (empty disables it)",
+    ))
+
+    template.add_condition("UseOriginShield", Not(Equals(Ref("OriginShieldRegion"), "")))
+
+    # Create one cache policy per content type
+    settings = get_cache_policies(manifest_ttl, segment_ttl)
+    policies = {name: create_cache_policy(name, policy) for name, policy in settings.items()}
+    for policy in policies.values():
+        template.add_resource(policy)
+
+    behaviors = [
+        create_behavior(
+            behavior,
+            policies[behavior["CachePolicy"]],
+            settings[behavior["CachePolicy"]]["Compress"],
+        )
+        for behavior in BEHAVIORS
+    ]
+
+    distribution = cloudfront.Distribution(
+        "CloudFrontDistribution",
+        DistributionConfig=cloudfront.DistributionConfig(
+            Comment=Sub("${StackName} FAST channels"),
+            Enabled=True,
+            HttpVersion="http2and3",
+            Origins=create_origins(),
+            CacheBehaviors=[
+                cloudfront.CacheBehavior(**properties)
+                for properties in behaviors
+                if "PathPattern" in properties
+            ],
+            DefaultCacheBehavior=cloudfront.DefaultCacheBehavior(
+                **next(properties for properties in behaviors if "PathPattern" not in properties)
+            ),
+        ),
+    )
+    template.add_resource(distribution)
+
+    # Add outputs
+    template.add_output(Output(
+        "DomainName",
+        Description="CloudFront Distribution Domain Name",
+        Value=GetAtt(distribution, "DomainName"),
+    ))
+
+    template.add_output(Output(
+        "DistributionId",
+        Description="CloudFront Distribution ID",
+        Value=Ref(distribution),
+    ))
+
+    return template
+
+
+def validate_template(template: dict[str, Any]) -> list[str]:
+    """
+    Check a rendered template for cache behaviors that would defeat caching.
+
+    Returns one message per problem: a behavior without its origin or cache
+    policy, a duplicate path pattern, compression that the cache policy does
+    not key on or that is enabled for segments, a cache key with headers,
+    cookies or (outside manifests) query strings, an ad segment behavior that
+    does not reach MediaTailor, or a MediaPackage origin whose Origin Shield
+    is not switched by the ``UseOriginShield`` condition.
+    """
+    errors = []
+    resources = template.get("Resources", {})
+    config = resources.get("CloudFrontDistribution", {}).get("Properties", {}).get(
+        "DistributionConfig", {}
+    )
+    origins = {origin["Id"]: origin for origin in config.get("Origins", [])}
+    behaviors = [config.get("DefaultCacheBehavior", {})] + config.get("CacheBehaviors", [])
+
+    # Compare as plain JSON types, since loaded templates use ordered dictionaries
+    origin_shield = json.loads(json.dumps(origins.get(MEDIAPACKAGE_ORIGIN, {}).get("OriginShield")))
+    if origin_shield != ORIGIN_SHIELD:
+        errors.append("The MediaPackage origin Origin Shield is not switched by UseOriginShield")
+    if "UseOriginShield" not in template.get("Conditions", {}):
+        errors.append("The template has no UseOriginShield condition")
+
+    patterns = [behavior.get("PathPattern") for behavior in behaviors[1:]]
+    for pattern in {pattern for pattern in patterns if patterns.count(pattern) > 1}:
+        errors.append(f"Duplicate path pattern {pattern}")
+
+    for behavior in behaviors:
+        name = behavior.get("PathPattern", "default")
+        if behavior.get("TargetOriginId") not in origins:
+            errors.append(f"Behavior {name} targets unknown origin {behavior.get('TargetOriginId')}")
+
+        policy_id = behavior.get("CachePolicyId", {})
+        policy = resources.get(policy_id.get("Ref", "") if isinstance(policy_id, dict) else "")
+        if policy is None:
+            errors.append(f"Behavior {name} has no generated cache policy")
+            continue
+        key = policy["Properties"]["CachePolicyConfig"]["ParametersInCacheKeyAndForwardedToOrigin"]
+
+        if key["HeadersConfig"]["HeaderBehavior"] != "none":
+            errors.append(f"Behavior {name} has headers in its cache key")
+        if key["CookiesConfig"]["CookieBehavior"] != "none":
+            errors.append(f"Behavior {name} has cookies in its cache key")
+
+        manifest = name.endswith((".m3u8", ".mpd"))
+        if not manifest and key["QueryStringsConfig"]["QueryStringBehavior"] != "none":
+            errors.append(f"Behavior {name} has query strings in its cache key")
+        if behavior.get("Compress") and not manifest:
+            errors.append(f"Behavior {name} compresses media segments")
+        if bool(behavior.get("Compress")) != bool(key["EnableAcceptEncodingGzip"]):
+            errors.append(f"Behavior {name} compression does not match its cache policy")
+
+        if name.startswith("/tm/") and behavior.get("TargetOriginId") != MEDIATAILOR_ORIGIN:
+            errors.append(f"Behavior {name} does not target the MediaTailor ad segment origin")
+
+    return errors
+
+
+def load_template(path: Path = OUTPUT_FILE) -> dict[str, Any]:
+    """Load a YAML template, expanding short-form intrinsic functions."""
+    return cfn_flip.load(path.read_text())[0]
+
+
+def get_template_ttls(template: dict[str, Any]) -> tuple[int, int]:
+    """Return the default manifest and segment TTLs of a rendered template."""
+    resources = template["Resources"]
+    return tuple(
+        resources[f"{name}CachePolicy"]["Properties"]["CachePolicyConfig"]["DefaultTTL"]
+        for name in ("Manifest", "Segment")
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Generate the CloudFront distribution.")
+    parser.add_argument(
+        "--manifest-ttl",
+        type=int,
+        help=f"default TTL of manifests in seconds (default {DEFAULT_MANIFEST_TTL})",
+    )
+    parser.add_argument(
+        "--segment-ttl",
+        type=int,
+        help=f"default TTL of media and ad segments in seconds (default {DEFAULT_SEGMENT_TTL})",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="validate the template and compare it with the committed file instead of writing it",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Main function to generate the CloudFront template."""
+    args = parse_args()
+    output_file = OUTPUT_FILE
+
+    manifest_ttl, segment_ttl = DEFAULT_MANIFEST_TTL, DEFAULT_SEGMENT_TTL
+    if args.check and output_file.exists():
+        # Check against the TTLs the committed file was generated with
+        manifest_ttl, segment_ttl = get_template_ttls(load_template(output_file))
+    if args.manifest_ttl is not None:
+        manifest_ttl = args.manifest_ttl
+    if args.segment_ttl is not None:
+        segment_ttl = args.segment_ttl
+
+    if manifest_ttl < 1 or segment_ttl < 1:
+        raise SystemExit("TTLs must be at least 1 second")
+
+    template = build_template(manifest_ttl, segment_ttl)
+    errors = validate_template(template.to_dict())
+    if errors:
+        raise SystemExit("\n".join(errors))
+
+    if args.check:
+        if not output_file.exists() or output_file.read_text() != template.to_yaml():
+            raise SystemExit(f"{output_file} is out of date, run generate_cdn.py")
+        print(f"{output_file} is up to date")
+        return
+
+    # Write template
+    with open(output_file, "w") as f:
+        f.write(template.to_yaml())
+
+    print(f"Generated {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,27 +5,80 @@ Generate MediaConvert presets and job template from presets.csv.
 This script reads the presets.csv file and generates a CloudFormation-compatible
 MediaConvert deployment template with all necessary presets and job template.
 
+With ``--optimize`` the video rows of presets.csv are first recomputed from
+target resolutions, codecs and a bitrate budget: rungs are spaced evenly in
+log-bitrate, assigned the largest resolution their bitrate can sustain, and
+rungs too close to their neighbour are dropped. Audio rows are kept as-is.
+
+With ``--output-groups cmaf`` the job template writes a CMAF output group:
+fragmented MP4 segments encoded once and referenced from both an HLS and a
+DASH manifest.
+
+GOP sizes and segment lengths are planned for the source frame rate
+(``--frame-rate``, ``--segment-length``) so every segment holds whole GOPs.
+
 Usage:
     cd source/scripts
     python3 generate_presets.py
+    python3 generate_presets.py --optimize --min-bitrate 300 --max-bitrate 15000
+    python3 generate_presets.py --output-groups cmaf
+    python3 generate_presets.py --frame-rate 25
 
 The generated template is written to deployment/mediaconvert.deployment
 """
 from __future__ import annotations
 
+import argparse
 import csv
+import sys
 from pathlib import Path
 from typing import Any
 
-from troposphere import GetAtt, Output, Parameter, Ref, Sub, Template
+import numpy as np
 import troposphere.mediaconvert as mediaconvert
+from troposphere import GetAtt, Output, Parameter, Ref, Sub, Template
+
+# Share the GOP and segment planner with the Lambda functions
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "fast_common"))
+from fast_common.alignment import plan_alignment  # noqa: E402
+
+PRESET_FIELDS = ["type", "width", "height", "bitrate", "qvbr", "codec"]
+
+DEFAULT_RESOLUTIONS = "3840x2160,1920x1080,1280x720,960x540,768x432,640x360,416x234"
 
+# Lowest AVC bitrate (Kbit/s) at which 1920x1080 at 30 fps beats a smaller resolution
+REFERENCE_BITRATE = 3000
+REFERENCE_PIXEL_RATE = 1920 * 1080 * 30
 
-def get_codec_settings(codec: str, bitrate: int, qvbr: int) -> dict[str, Any] | None:
+# Bitrate needed for equal quality relative to AVC
+CODEC_EFFICIENCY = {"avc": 1.0, "hevc": 0.6}
+
+# QVBR quality level by output height
+QVBR_HEIGHTS = [234, 360, 540, 720, 1080, 2160]
+QVBR_LEVELS = [4, 4, 6, 7, 8, 9]
+
+# Presets created in parallel by CloudFormation, kept low for MediaConvert API limits
+DEFAULT_WAVE_WIDTH = 4
+
+# Job template output groups, each with its own presets built from the same rows
+OUTPUT_GROUPS = {
+    "hls": {"Name": "Apple HLS", "Container": "M3U8", "CustomName": "Output for MediaPackage"},
+    "cmaf": {"Name": "CMAF", "Container": "CMFC", "CustomName": "CMAF output for MediaPackage"},
+}
+DEFAULT_OUTPUT_GROUPS = "hls"
+
+
+def get_codec_settings(
+    codec: str,
+    bitrate: int,
+    qvbr: int,
+    gop_size: int = 90,
+) -> dict[str, Any] | None:
     """
     Generate codec settings for MediaConvert presets.
     
     Supports AVC (H.264) and HEVC (H.265) codecs with QVBR rate control.
+    ``gop_size`` is in frames, as planned by ``plan_alignment``.
     """
     codec_lower = codec.lower()
     
@@ -38,7 +91,7 @@ def get_codec_settings(codec: str, bitrate: int, qvbr: int) -> dict[str, Any] |
                 "QvbrSettings": {"QvbrQualityLevel": qvbr},
                 "CodecProfile": "MAIN_MAIN",
                 "CodecLevel": "AUTO",
-                "GopSize": 90,
+                "GopSize": gop_size,
                 "GopSizeUnits": "FRAMES",
             },
         }
@@ -51,7 +104,7 @@ def get_codec_settings(codec: str, bitrate: int, qvbr: int) -> dict[str, Any] |
                 "QvbrSettings": {"QvbrQualityLevel": qvbr},
                 "CodecProfile": "HIGH",
                 "CodecLevel": "AUTO",
-                "GopSize": 90,
+                "GopSize": gop_size,
                 "GopSizeUnits": "FRAMES",
             },
         }
@@ -59,31 +112,271 @@ def get_codec_settings(codec: str, bitrate: int, qvbr: int) -> dict[str, Any] |
         return None
 
 
-def generate_job_outputs(presets: dict[str, Any]) -> list[dict[str, Any]]:
-    """Generate job template outputs from preset resources."""
-    outputs = []
-    count = 1
-    
-    for resource_name in presets.get("Resources", {}):
-        if resource_name.startswith("MediaConvertPreset"):
-            outputs.append({
-                "Preset": Ref(resource_name),
-                "NameModifier": f"_{count}",
+def generate_job_outputs(preset_names: list[str]) -> list[dict[str, Any]]:
+    """Generate job template outputs from preset resource names."""
+    return [
+        {"Preset": Ref(preset_name), "NameModifier": f"_{count}"}
+        for count, preset_name in enumerate(preset_names, start=1)
+    ]
+
+
+def create_preset(
+    row: dict[str, Any],
+    container: str = "M3U8",
+    gop_size: int = 90,
+) -> mediaconvert.Preset | None:
+    """
+    Create a MediaConvert preset resource from a preset row.
+
+    ``container`` is M3U8 for HLS transport stream outputs or CMFC for CMAF
+    fragmented MP4 outputs. Returns None for rows without a bitrate or type.
+    """
+    preset_type = row.get("type", "").lower()
+    codec = row.get("codec", "avc")
+    bitrate = row.get("bitrate", "")
+    prefix = "MediaConvertPreset" if container == "M3U8" else "MediaConvertPresetCmaf"
+    suffix = "" if container == "M3U8" else " (CMAF)"
+
+    if not bitrate:
+        return None
+
+    if container == "M3U8":
+        video_container = {"Container": "M3U8"}
+        audio_container = {"Container": "M3U8", "M3u8Settings": {}}
+    else:
+        video_container = {"Container": container}
+        audio_container = {"Container": container}
+
+    if preset_type == "video":
+        height = row.get("height", "")
+        width = row.get("width", "")
+        qvbr = int(row.get("qvbr", 7))
+
+        preset_name = f"{prefix}{height}{codec.upper()}{bitrate}"
+        preset = mediaconvert.Preset(preset_name)
+        preset.Description = (
+            f"{width}x{height} resolution at {bitrate}Kbit/s in {codec.upper()}{suffix}"
+        )
+        preset.SettingsJson = {
+            "VideoDescription": {
+                "Width": int(width),
+                "Height": int(height),
+                "CodecSettings": get_codec_settings(codec, int(bitrate) * 1000, qvbr, gop_size),
+            },
+            "ContainerSettings": video_container,
+        }
+
+    elif preset_type == "audio":
+        preset_name = f"{prefix}{codec.upper()}{bitrate}"
+        preset = mediaconvert.Preset(preset_name)
+        preset.Description = f"{bitrate}Kbit/s in {codec.upper()}{suffix}"
+        preset.SettingsJson = {
+            "AudioDescriptions": [
+                {
+                    "AudioTypeControl": "FOLLOW_INPUT",
+                    "AudioSourceName": "Audio Selector 1",
+                    "CodecSettings": {
+                        "Codec": "AAC",
+                        "AacSettings": {
+                            "AudioDescriptionBroadcasterMix": "NORMAL",
+                            "Bitrate": int(bitrate) * 1000,
+                            "RateControlMode": "CBR",
+                            "CodecProfile": "LC",
+                            "CodingMode": "CODING_MODE_2_0",
+                            "RawFormat": "NONE",
+                            "SampleRate": 48000,
+                            "Specification": "MPEG4",
+                        },
+                    },
+                    "LanguageCodeControl": "FOLLOW_INPUT",
+                }
+            ],
+            "ContainerSettings": audio_container,
+        }
+    else:
+        return None
+
+    preset.Name = Sub(f"${{StackName}}-{preset_name}")
+    preset.Category = Ref("StackName")
+    return preset
+
+
+def generate_output_group(
+    output_group: str,
+    preset_names: list[str],
+    prefix: str = "",
+    alignment: dict[str, Any] | None = None,
+) -> dict[str, Any]:
+    """
+    Generate a job template output group.
+
+    HLS writes transport stream segments. CMAF writes fragmented MP4 segments
+    once and references them from both an HLS and a DASH manifest. Segments
+    are cut on GOP boundaries from the ``alignment`` plan.
+    """
+    settings = OUTPUT_GROUPS[output_group]
+    alignment = alignment or plan_alignment(30)
+    destination = Sub(f"s3://${{VideoDestinationBucket}}/{prefix}")
+
+    if output_group == "hls":
+        group_settings = {
+            "Type": "HLS_GROUP_SETTINGS",
+            "HlsGroupSettings": {
+                "SegmentLength": alignment["SegmentLength"],
+                "SegmentLengthControl": "GOP_MULTIPLE",
+                "MinSegmentLength": 0,
+                "Destination": destination,
+            },
+        }
+    else:
+        group_settings = {
+            "Type": "CMAF_GROUP_SETTINGS",
+            "CmafGroupSettings": {
+                "SegmentLength": alignment["SegmentLength"],
+                "SegmentLengthControl": "GOP_MULTIPLE",
+                "FragmentLength": alignment["GopSeconds"],
+                "MinFinalSegmentLength": 0,
+                "SegmentControl": "SEGMENTED_FILES",
+                "WriteHlsManifest": "ENABLED",
+                "WriteDashManifest": "ENABLED",
+                "Destination": destination,
+            },
+        }
+
+    return {
+        "Name": settings["Name"],
+        "Outputs": generate_job_outputs(preset_names),
+        "OutputGroupSettings": group_settings,
+        "CustomName": settings["CustomName"],
+    }
+
+
+def read_presets(presets_file: Path) -> list[dict[str, str]]:
+    """Read preset rows from a presets CSV file."""
+    with open(presets_file, encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+
+def write_presets(rows: list[dict[str, Any]], presets_file: Path) -> None:
+    """Write preset rows to a presets CSV file."""
+    with open(presets_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=PRESET_FIELDS, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_resolutions(resolutions: str) -> list[tuple[int, int]]:
+    """Parse a comma-separated list of WIDTHxHEIGHT resolutions, largest first."""
+    parsed = []
+    for resolution in resolutions.split(","):
+        width, height = resolution.strip().lower().split("x")
+        parsed.append((int(width), int(height)))
+    return sorted(parsed, key=lambda size: size[0] * size[1], reverse=True)
+
+
+def round_bitrate(bitrate: float) -> int:
+    """Round a bitrate in Kbit/s to two significant digits."""
+    magnitude = 10 ** max(int(np.floor(np.log10(bitrate))) - 1, 0)
+    return int(round(bitrate / magnitude) * magnitude)
+
+
+def optimize_ladder(
+    resolutions: list[tuple[int, int]],
+    codecs: list[str],
+    min_bitrate: int,
+    max_bitrate: int,
+    rungs: int = 10,
+    min_step: float = 1.35,
+    frame_rate: float = 30,
+    hevc_min_height: int = 1080,
+) -> list[dict[str, Any]]:
+    """
+    Compute video preset rows for a bitrate budget.
+
+    For each codec, ``rungs`` candidate bitrates are spaced evenly in log-bitrate
+    between ``min_bitrate`` and ``max_bitrate`` (Kbit/s). HEVC candidates are
+    scaled by its efficiency factor so each HEVC rung matches the quality of the
+    AVC rung it replaces. Each candidate gets the largest resolution whose
+    minimum bitrate it reaches, and a candidate is dropped when it is less than
+    ``min_step`` times the bitrate of the previous kept rung. HEVC rungs are only
+    kept at or above ``hevc_min_height``.
+    """
+    sizes = np.array([(width, height) for width, height in resolutions])
+    pixel_rates = sizes[:, 0] * sizes[:, 1] * frame_rate
+    rows = []
+
+    for codec in codecs:
+        efficiency = CODEC_EFFICIENCY[codec.lower()]
+        # Minimum bitrate per resolution, scaling sub-linearly with pixel rate
+        thresholds = REFERENCE_BITRATE * efficiency * (pixel_rates / REFERENCE_PIXEL_RATE) ** 0.75
+        candidates = np.geomspace(min_bitrate, max_bitrate, rungs) * efficiency
+
+        # Index of the largest resolution each candidate reaches (sizes are largest first)
+        reached = candidates[:, None] >= thresholds[None, :]
+        indices = np.where(reached.any(axis=1), reached.argmax(axis=1), len(sizes) - 1)
+
+        kept: list[tuple[int, int]] = []
+        for bitrate, index in zip(candidates, indices, strict=True):
+            bitrate = round_bitrate(float(bitrate))
+            if codec.lower() == "hevc" and sizes[index][1] < hevc_min_height:
+                continue
+            if kept and bitrate < kept[-1][0] * min_step:
+                # Too close to the previous rung: keep the higher of the two
+                kept.pop()
+            kept.append((bitrate, int(index)))
+
+        for bitrate, index in kept:
+            width, height = (int(value) for value in sizes[index])
+            rows.append({
+                "type": "Video",
+                "width": width,
+                "height": height,
+                "bitrate": bitrate,
+                "qvbr": int(round(np.interp(height, QVBR_HEIGHTS, QVBR_LEVELS))),
+                "codec": codec.lower(),
             })
-            count += 1
-    
-    return outputs
 
+    rows.sort(key=lambda row: (row["height"], row["bitrate"]), reverse=True)
+    return rows
 
-def main() -> None:
-    """Main function to generate the MediaConvert template."""
-    script_dir = Path(__file__).parent
-    presets_file = script_dir / "../../assets/presets.csv"
-    output_file = script_dir / "../../deployment/mediaconvert.deployment"
 
+def wave_dependency(waves: list[list[str]]) -> str | list[str] | None:
+    """Return the DependsOn value that waits for the last completed wave."""
+    if not waves:
+        return None
+    previous_wave = waves[-1]
+    return previous_wave[0] if len(previous_wave) == 1 else list(previous_wave)
+
+
+def build_template(
+    rows: list[dict[str, Any]],
+    wave_width: int = DEFAULT_WAVE_WIDTH,
+    output_groups: tuple[str, ...] = ("hls",),
+    alignment: dict[str, Any] | None = None,
+) -> Template:
+    """
+    Build the MediaConvert presets and job template from preset rows.
+
+    Each of ``output_groups`` (hls, cmaf) gets its own presets built from the
+    same rows and its own output group in the job template. The first group
+    writes to the root of the bucket, later groups under a prefix named after
+    the group.
+
+    Presets are created in waves of ``wave_width``: every preset in a wave
+    depends on all presets of the previous wave, so CloudFormation creates
+    ``wave_width`` presets at a time without exceeding MediaConvert API limits.
+    A width of 1 creates the presets strictly one after another.
+
+    ``alignment`` is a GOP and segment plan from ``plan_alignment``; it
+    defaults to 6 second segments of 3 second GOPs at 30 fps.
+    """
+    alignment = alignment or plan_alignment(30)
     template = Template()
     template.set_transform("AWS::Serverless-2016-10-31")
     template.set_version("2010-09-09")
+    template.set_description(
+        "MediaConvert presets and job template for FAST channel encoding (4K/HEVC enabled)"
+    )
 
     # Add parameters
     template.add_parameter(Parameter(
@@ -103,78 +396,35 @@ def main() -> None:
     queue.Name = Sub("${StackName}-Queue")
     template.add_resource(queue)
 
-    # Read presets from CSV
-    previous_name = None
-    
-    with open(presets_file, mode="r", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        
-        for row in reader:
-            preset_type = row.get("type", "").lower()
-            codec = row.get("codec", "avc")
-            bitrate = row.get("bitrate", "")
-            
-            if not bitrate:
-                continue
-            
-            if preset_type == "video":
-                height = row.get("height", "")
-                width = row.get("width", "")
-                qvbr = int(row.get("qvbr", 7))
-                
-                preset_name = f"MediaConvertPreset{height}{codec.upper()}{bitrate}"
-                preset = mediaconvert.Preset(preset_name)
-                preset.Description = f"{width}x{height} resolution at {bitrate}Kbit/s in {codec.upper()}"
-                preset.SettingsJson = {
-                    "VideoDescription": {
-                        "Width": int(width),
-                        "Height": int(height),
-                        "CodecSettings": get_codec_settings(codec, int(bitrate) * 1000, qvbr),
-                    },
-                    "ContainerSettings": {"Container": "M3U8"},
-                }
-            
-            elif preset_type == "audio":
-                preset_name = f"MediaConvertPreset{codec.upper()}{bitrate}"
-                preset = mediaconvert.Preset(preset_name)
-                preset.Description = f"{bitrate}Kbit/s in {codec.upper()}"
-                preset.SettingsJson = {
-                    "AudioDescriptions": [
-                        {
-                            "AudioTypeControl": "FOLLOW_INPUT",
-                            "AudioSourceName": "Audio Selector 1",
-                            "CodecSettings": {
-                                "Codec": "AAC",
-                                "AacSettings": {
-                                    "AudioDescriptionBroadcasterMix": "NORMAL",
-                                    "Bitrate": int(bitrate) * 1000,
-                                    "RateControlMode": "CBR",
-                                    "CodecProfile": "LC",
-                                    "CodingMode": "CODING_MODE_2_0",
-                                    "RawFormat": "NONE",
-                                    "SampleRate": 48000,
-                                    "Specification": "MPEG4",
-                                },
-                            },
-                            "LanguageCodeControl": "FOLLOW_INPUT",
-                        }
-                    ],
-                    "ContainerSettings": {
-                        "Container": "M3U8",
-                        "M3u8Settings": {},
-                    },
-                }
-            else:
+    # Create presets from CSV rows for each output group, in dependency waves
+    waves: list[list[str]] = []
+    current_wave: list[str] = []
+    group_presets: dict[str, list[str]] = {}
+
+    for output_group in output_groups:
+        group_presets[output_group] = []
+
+        for row in rows:
+            preset = create_preset(
+                row, OUTPUT_GROUPS[output_group]["Container"], alignment["GopSize"]
+            )
+            if preset is None:
                 continue
 
-            preset.Name = Sub(f"${{StackName}}-{preset_name}")
-            preset.Category = Ref("StackName")
-            
-            if previous_name:
-                preset.DependsOn = previous_name
-            
+            if len(current_wave) == wave_width:
+                waves.append(current_wave)
+                current_wave = []
+
+            depends_on = wave_dependency(waves)
+            if depends_on:
+                preset.DependsOn = depends_on
+
             template.add_resource(preset)
-            previous_name = preset_name
+            current_wave.append(preset.title)
+            group_presets[output_group].append(preset.title)
+
+    if current_wave:
+        waves.append(current_wave)
 
     # Create job template
     job_template = mediaconvert.JobTemplate("MediaConvertJobTemplate")
@@ -203,21 +453,19 @@ def main() -> None:
             }
         ],
         "OutputGroups": [
-            {
-                "Name": "Apple HLS",
-                "Outputs": generate_job_outputs(template.to_dict()),
-                "OutputGroupSettings": {
-                    "Type": "HLS_GROUP_SETTINGS",
-                    "HlsGroupSettings": {
-                        "SegmentLength": 6,
-                        "MinSegmentLength": 0,
-                        "Destination": Sub("s3://${VideoDestinationBucket}/"),
-                    },
-                },
-                "CustomName": "Output for MediaPackage",
-            }
+            generate_output_group(
+                output_group,
+                group_presets[output_group],
+                # Keep additional groups apart so manifest names don't collide
+                "" if index == 0 else f"{output_group}/",
+                alignment,
+            )
+            for index, output_group in enumerate(output_groups)
         ],
     }
+    depends_on = wave_dependency(waves)
+    if depends_on:
+        job_template.DependsOn = depends_on
     template.add_resource(job_template)
 
     # Add outputs
@@ -233,10 +481,115 @@ def main() -> None:
         Value=GetAtt(queue, "Arn"),
     ))
 
+    return template
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Generate MediaConvert presets and job template.")
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="recompute the video rows of presets.csv before generating the template",
+    )
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS, help="WIDTHxHEIGHT list")
+    parser.add_argument("--codecs", default="avc,hevc", help="comma-separated codecs")
+    parser.add_argument("--min-bitrate", type=int, default=300, help="lowest rung in Kbit/s")
+    parser.add_argument("--max-bitrate", type=int, default=15000, help="highest rung in Kbit/s")
+    parser.add_argument("--rungs", type=int, default=10, help="candidate rungs per codec")
+    parser.add_argument(
+        "--min-step",
+        type=float,
+        default=1.35,
+        help="minimum bitrate ratio between adjacent rungs of a codec",
+    )
+    parser.add_argument(
+        "--frame-rate",
+        default="30",
+        help="frame rate of the sources, e.g. 25, 29.97 or 30000/1001",
+    )
+    parser.add_argument("--segment-length", type=int, default=6, help="segment length in seconds")
+    parser.add_argument(
+        "--max-gop-seconds",
+        type=int,
+        default=3,
+        help="longest GOP in seconds, reduced until it divides the segment length",
+    )
+    parser.add_argument(
+        "--hevc-min-height",
+        type=int,
+        default=1080,
+        help="smallest output height encoded in HEVC",
+    )
+    parser.add_argument(
+        "--output-groups",
+        default=DEFAULT_OUTPUT_GROUPS,
+        help="comma-separated job template output groups: hls, cmaf",
+    )
+    parser.add_argument(
+        "--wave-width",
+        type=int,
+        default=DEFAULT_WAVE_WIDTH,
+        help="number of presets CloudFormation creates in parallel",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Main function to generate the MediaConvert template."""
+    args = parse_args()
+    script_dir = Path(__file__).parent
+    presets_file = script_dir / "../../assets/presets.csv"
+    output_file = script_dir / "../../deployment/mediaconvert.deployment"
+
+    rows = read_presets(presets_file)
+
+    try:
+        alignment = plan_alignment(args.frame_rate, args.segment_length, args.max_gop_seconds)
+    except ValueError as error:
+        raise SystemExit(str(error)) from error
+    print(
+        f"{alignment['Family']} {args.frame_rate} fps: GOP of {alignment['GopSize']} frames, "
+        f"{alignment['GopsPerSegment']} GOPs per {alignment['SegmentDuration']}s segment"
+    )
+
+    if args.optimize:
+        video_rows = optimize_ladder(
+            parse_resolutions(args.resolutions),
+            [codec.strip() for codec in args.codecs.split(",")],
+            args.min_bitrate,
+            args.max_bitrate,
+            rungs=args.rungs,
+            min_step=args.min_step,
+            frame_rate=alignment["FramerateNumerator"] / alignment["FramerateDenominator"],
+            hevc_min_height=args.hevc_min_height,
+        )
+        audio_rows = [row for row in rows if row.get("type", "").lower() == "audio"]
+        rows = video_rows + audio_rows
+        write_presets(rows, presets_file)
+
+        for row in video_rows:
+            print(f"{row['width']}x{row['height']} {row['codec'].upper()} {row['bitrate']}Kbit/s")
+        print(f"Generated {presets_file}")
+
+    output_groups = tuple(dict.fromkeys(
+        group.strip().lower() for group in args.output_groups.split(",")
+    ))
+    unknown = [group for group in output_groups if group not in OUTPUT_GROUPS]
+    if unknown:
+        raise SystemExit(f"Unknown output groups: {', '.join(unknown)}. Use hls and/or cmaf")
+
+    template = build_template(
+        rows,
+        wave_width=args.wave_width,
+        output_groups=output_groups,
+        alignment=alignment,
+    )
+
     # Write template
     with open(output_file, "w") as f:
         f.write(template.to_yaml())
-    
+
     print(f"Generated {output_file}")
 
 
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Report upload-to-playable latency from the stage timestamps of each asset.
+
+The pipeline records a correlation ID and a UTC timestamp per stage (uploaded,
+transcode submitted, transcoded, packaging started, playable, VOD source
+created) in the tags of every MediaTailor VOD source. This script reads those
+tags, either from a source location or from a JSON file, and reports the
+distribution of the time spent in each stage and of the end-to-end time to
+playable, with a histogram and the share of assets within an SLA.
+
+Usage:
+    cd source/scripts
+    python3 latency_report.py --source-location <stack-name>-SourceLocation
+    python3 latency_report.py --source-location <name> --since 2026-10-01 --sla-seconds 900
+    python3 latency_report.py --input vod_sources.json --output report.json
+
+``--input`` accepts a JSON list or JSON lines of VOD sources or assets (objects
+with ``Tags``), Playback URLs event details (objects with ``stageTimes``), or
+plain tag dictionaries.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import sys
+from pathlib import Path
+from typing import Any
+
+# Share the stage definitions with the Lambda functions
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "fast_common"))
+from fast_common.tracing import (  # noqa: E402
+    CORRELATION_ID_KEY,
+    get_stage_durations,
+    parse_timestamp,
+)
+
+# Upper bounds in seconds of the time-to-playable histogram buckets
+HISTOGRAM_BUCKETS = [60, 120, 300, 600, 900, 1800, 3600, 7200]
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Return the nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(math.ceil(percent / 100 * len(ordered)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """Return the count and percentiles of a list of durations in seconds."""
+    return {
+        "count": len(values),
+        "p50_s": round(percentile(values, 50), 1),
+        "p90_s": round(percentile(values, 90), 1),
+        "p99_s": round(percentile(values, 99), 1),
+        "max_s": round(max(values, default=0.0), 1),
+    }
+
+
+def histogram(values: list[float], buckets: list[int]) -> dict[str, int]:
+    """Count values per bucket, labelled by the bucket's upper bound."""
+    counts = {f"<={bucket}s": 0 for bucket in buckets}
+    counts[f">{buckets[-1]}s"] = 0
+    for value in values:
+        for bucket in buckets:
+            if value <= bucket:
+                counts[f"<={bucket}s"] += 1
+                break
+        else:
+            counts[f">{buckets[-1]}s"] += 1
+    return counts
+
+
+def get_tags(record: dict[str, Any]) -> dict[str, str]:
+    """Return the tags of a VOD source, asset, Playback URLs detail or tag dictionary."""
+    if "Tags" in record:
+        return record["Tags"] or {}
+    if "stageTimes" in record:
+        return {CORRELATION_ID_KEY: record.get("correlationId") or "", **record["stageTimes"]}
+    return record
+
+
+def read_records(input_file: Path) -> list[dict[str, Any]]:
+    """Read records from a JSON list, a JSON object with Items, or JSON lines."""
+    text = input_file.read_text()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        return data.get("Items", [data])
+    return data
+
+
+def list_vod_sources(source_location: str, region: str | None) -> list[dict[str, Any]]:
+    """List every VOD source of a MediaTailor source location, with its tags."""
+    import boto3
+
+    mediatailor = boto3.client("mediatailor", region_name=region)
+    paginator = mediatailor.get_paginator("list_vod_sources")
+    return [
+        item
+        for page in paginator.paginate(SourceLocationName=source_location)
+        for item in page.get("Items", [])
+    ]
+
+
+def build_report(
+    records: list[dict[str, Any]],
+    since: str | None = None,
+    sla_seconds: float | None = None,
+) -> dict[str, Any]:
+    """Compute per-stage and end-to-end latency distributions from tagged records."""
+    since_time = parse_timestamp(since) if since else None
+    stages: dict[str, list[float]] = {}
+    traced = 0
+    seen: set[str] = set()
+
+    for record in records:
+        tags = get_tags(record)
+        correlation_id = tags.get(CORRELATION_ID_KEY)
+        if not correlation_id or correlation_id in seen:
+            continue
+        if since_time and (
+            not tags.get("UploadedAt") or parse_timestamp(tags["UploadedAt"]) < since_time
+        ):
+            continue
+
+        seen.add(correlation_id)
+        traced += 1
+        for stage, seconds in get_stage_durations(tags).items():
+            stages.setdefault(stage, []).append(seconds)
+
+    time_to_playable = stages.pop("TimeToPlayable", [])
+    report = {
+        "records": len(records),
+        "traced": traced,
+        "stages": {stage: summarize(values) for stage, values in stages.items()},
+        "time_to_playable": summarize(time_to_playable),
+        "histogram": histogram(time_to_playable, HISTOGRAM_BUCKETS),
+    }
+    if sla_seconds is not None and time_to_playable:
+        within = sum(1 for value in time_to_playable if value <= sla_seconds)
+        report["sla"] = {
+            "seconds": sla_seconds,
+            "within": within,
+            "percent": round(100 * within / len(time_to_playable), 1),
+        }
+    return report
+
+
+def print_report(report: dict[str, Any]) -> None:
+    """Print a latency report as plain text."""
+    print(f"{report['traced']} traced assets out of {report['records']} records")
+    print(f"{'stage':44} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    rows = {**report["stages"], "TimeToPlayable": report["time_to_playable"]}
+    for stage, stats in rows.items():
+        print(
+            f"{stage:44} {stats['count']:6} {stats['p50_s']:7.1f}s {stats['p90_s']:7.1f}s "
+            f"{stats['p99_s']:7.1f}s {stats['max_s']:7.1f}s"
+        )
+
+    largest = max(report["histogram"].values(), default=0) or 1
+    print("Time to playable:")
+    for bucket, count in report["histogram"].items():
+        print(f"  {bucket:>8} {count:6} {'#' * round(40 * count / largest)}")
+
+    if "sla" in report:
+        sla = report["sla"]
+        print(f"Within {sla['seconds']:g}s SLA: {sla['within']} ({sla['percent']}%)")
+
+
+def main() -> None:
+    """Build the latency report from a source location or a JSON file."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--source-location", help="MediaTailor source location to read")
+    source.add_argument("--input", type=Path, help="JSON file of VOD sources, assets or events")
+    parser.add_argument("--region", help="AWS region of the source location")
+    parser.add_argument("--since", help="only include uploads at or after this ISO 8601 time")
+    parser.add_argument("--sla-seconds", type=float, help="report the share of assets within")
+    parser.add_argument("--output", type=Path, help="write the report to a JSON file")
+    args = parser.parse_args()
+
+    if args.input:
+        records = read_records(args.input)
+    else:
+        records = list_vod_sources(args.source_location, args.region)
+
+    report = build_report(records, args.since, args.sla_seconds)
+    print_report(report)
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Replay pipeline events that failed after every Lambda retry.
+
+The MediaConvert, MediaPackage and MediaTailor functions send the events they
+could not process, after their asynchronous retries, to the stack's failure
+queue (output ``PipelineFailureQueueUrl``). Each message records the function,
+the original EventBridge event and the error. This script reads the failed
+events from the queue or from a JSON file, removes duplicates, and replays
+each one with bounded concurrency and rate:
+
+    remote  invoke the function that failed (default)
+    local   run the handler in this process with the function's environment
+
+It reports the result for every event and deletes the queue messages of the
+events that were replayed successfully.
+
+Usage:
+    cd source/scripts
+    python3 replay_failures.py --stack-name <stack-name> --dry-run
+    python3 replay_failures.py --stack-name <stack-name> --concurrency 8 --rate 2
+    python3 replay_failures.py --input failures.jsonl --mode local --output results.json
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+SOURCE_DIR = Path(__file__).resolve().parent.parent
+
+# Share the rate limiter with the Lambda functions
+sys.path.insert(0, str(SOURCE_DIR / "layers" / "fast_common"))
+from fast_common.governor import MAX_WAIT_SECONDS, MemoryBucketStore, RateGovernor  # noqa: E402
+
+# Handlers of the functions that send failures to the queue, by logical ID.
+# CloudFormation names each function <stack>-<logical ID>-<suffix>.
+HANDLERS = {
+    "HlsStitcherFunction": "functions/hls_stitcher/app.py",
+    "MediaConvertFunction": "functions/media_convert_job/app.py",
+    "MediaPackageFunction": "functions/mediapackage_vod_asset/app.py",
+    "MediaTailorFunction": "functions/mediatailor_vod_source/app.py",
+}
+
+
+class LambdaContext:
+    """Minimal Lambda context for handlers run locally."""
+
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.aws_request_id = "replay"
+
+    def get_remaining_time_in_millis(self) -> int:
+        return 900_000
+
+
+def get_function_name(function_arn: str) -> str:
+    """Return the function name of a function ARN, without a version or alias."""
+    parts = function_arn.split(":")
+    return parts[6] if len(parts) > 6 else function_arn
+
+
+def parse_failure(body: dict[str, Any]) -> dict[str, Any]:
+    """Return the function, event and error of a Lambda on-failure destination record."""
+    context = body.get("requestContext", {})
+    response = body.get("responsePayload") or {}
+    return {
+        "function": get_function_name(context.get("functionArn", "")),
+        "event": body.get("requestPayload", {}),
+        "error": response.get("errorMessage") or context.get("condition", ""),
+        "attempts": context.get("approximateInvokeCount", 0),
+        "failed_at": body.get("timestamp"),
+    }
+
+
+def get_event_key(failure: dict[str, Any]) -> str:
+    """Identify a failed event by its function and EventBridge event ID or content."""
+    event = failure["event"]
+    identity = event.get("id") or hashlib.sha256(
+        json.dumps(event, sort_keys=True).encode()
+    ).hexdigest()
+    return f"{failure['function']}/{identity}"
+
+
+def deduplicate(failures: list[dict[str, Any]]) -> dict[str, dict[str, Any]]:
+    """Group failures by event, keeping the latest error and every queue receipt handle."""
+    events: dict[str, dict[str, Any]] = {}
+    for failure in failures:
+        key = get_event_key(failure)
+        receipts = failure.pop("receipts", [])
+        if key in events:
+            receipts = events[key]["receipts"] + receipts
+            failure["duplicates"] = events[key]["duplicates"] + 1
+        else:
+            failure["duplicates"] = 0
+        events[key] = {**failure, "key": key, "receipts": receipts}
+    return events
+
+
+def receive_failures(
+    sqs: Any,
+    queue_url: str,
+    max_messages: int,
+    visibility_timeout: int,
+) -> list[dict[str, Any]]:
+    """
+    Receive failure records from the queue until it is empty or ``max_messages``.
+
+    Received messages stay hidden for ``visibility_timeout`` seconds; the ones
+    not deleted after a successful replay reappear in the queue afterwards.
+    """
+    failures = []
+    while len(failures) < max_messages:
+        messages = sqs.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=min(10, max_messages - len(failures)),
+            VisibilityTimeout=visibility_timeout,
+            WaitTimeSeconds=1,
+        ).get("Messages", [])
+        if not messages:
+            break
+        for message in messages:
+            try:
+                failure = parse_failure(json.loads(message["Body"]))
+            except (json.JSONDecodeError, AttributeError):
+                print(f"Skipping unreadable message {message['MessageId']}", file=sys.stderr)
+                continue
+            failure["receipts"] = [message["ReceiptHandle"]]
+            failures.append(failure)
+    return failures
+
+
+def read_failures(input_file: Path) -> list[dict[str, Any]]:
+    """Read failure records from a JSON list or JSON lines file."""
+    text = input_file.read_text()
+    try:
+        records = json.loads(text)
+    except json.JSONDecodeError:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(records, dict):
+        records = [records]
+    # Accept SQS messages as saved by the AWS CLI as well as bare records
+    return [
+        parse_failure(json.loads(record["Body"]) if "Body" in record else record)
+        for record in records
+    ]
+
+
+def resolve_stack(stack_name: str, region: str | None) -> dict[str, str]:
+    """Return the failure queue URL and the function names of a deployed stack."""
+    import boto3
+
+    cloudformation = boto3.client("cloudformation", region_name=region)
+    return {
+        resource["LogicalResourceId"]: resource["PhysicalResourceId"]
+        for resource in cloudformation.describe_stack_resources(StackName=stack_name)[
+            "StackResources"
+        ]
+    }
+
+
+class LocalRunner:
+    """Run handlers in this process with the environment of their deployed function."""
+
+    def __init__(self, lambda_client: Any, functions: dict[str, str]):
+        self.lambda_client = lambda_client
+        self.functions = functions
+        self.handlers: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def get_logical_id(self, function_name: str) -> str:
+        for logical_id, name in self.functions.items():
+            if name == function_name:
+                return logical_id
+        for logical_id in HANDLERS:
+            if f"-{logical_id}-" in function_name:
+                return logical_id
+        raise ValueError(f"No local handler for function {function_name}")
+
+    def get_handler(self, function_name: str) -> Any:
+        with self._lock:
+            if function_name not in self.handlers:
+                logical_id = self.get_logical_id(function_name)
+                configuration = self.lambda_client.get_function_configuration(
+                    FunctionName=function_name
+                )
+                # Handlers read their settings at call time; the pipeline
+                # functions share the variables they have in common
+                os.environ.update(configuration.get("Environment", {}).get("Variables", {}))
+                os.environ["MetricsSampleRate"] = "0"
+
+                spec = importlib.util.spec_from_file_location(
+                    f"{logical_id}_app", SOURCE_DIR / HANDLERS[logical_id]
+                )
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                self.handlers[function_name] = module.lambda_handler
+        return self.handlers[function_name]
+
+    def __call__(self, function_name: str, event: dict[str, Any]) -> Any:
+        return self.get_handler(function_name)(event, LambdaContext(function_name))
+
+
+def invoke_remote(lambda_client: Any, function_name: str, event: dict[str, Any]) -> Any:
+    """Invoke a function synchronously and return its response, raising on function errors."""
+    response = lambda_client.invoke(FunctionName=function_name, Payload=json.dumps(event))
+    payload = json.loads(response["Payload"].read() or "null")
+    if response.get("FunctionError"):
+        raise RuntimeError((payload or {}).get("errorMessage", response["FunctionError"]))
+    return payload
+
+
+def replay(args: argparse.Namespace) -> list[dict[str, Any]]:
+    """Replay every distinct failed event and return one result per event."""
+    import boto3
+    from botocore.config import Config
+
+    config = Config(retries={"max_attempts": 10, "mode": "adaptive"})
+    functions = resolve_stack(args.stack_name, args.region) if args.stack_name else {}
+    queue_url = args.queue_url or functions.get("PipelineFailureQueue")
+
+    sqs = None
+    if args.input:
+        failures = read_failures(args.input)
+    else:
+        if not queue_url:
+            raise ValueError("--stack-name, --queue-url or --input is required")
+        sqs = boto3.client("sqs", region_name=args.region, config=config)
+        failures = receive_failures(sqs, queue_url, args.max_messages, args.visibility_timeout)
+
+    events = deduplicate(failures)
+    print(f"{len(failures)} failed events, {len(events)} distinct", file=sys.stderr)
+    if args.dry_run:
+        # Make the messages visible again right away
+        for event in events.values():
+            for receipt in event["receipts"]:
+                sqs.change_message_visibility(
+                    QueueUrl=queue_url, ReceiptHandle=receipt, VisibilityTimeout=0
+                )
+        return [
+            {
+                "key": key,
+                "function": event["function"],
+                "status": "PENDING",
+                "error": event["error"],
+                "duplicates": event["duplicates"],
+            }
+            for key, event in events.items()
+        ]
+
+    lambda_client = boto3.client("lambda", region_name=args.region, config=config)
+    if args.mode == "local":
+        run = LocalRunner(lambda_client, functions)
+    else:
+        def run(function_name: str, event: dict[str, Any]) -> Any:
+            return invoke_remote(lambda_client, function_name, event)
+
+    governor = RateGovernor({"replay": (args.rate, max(1, int(args.rate)))}, MemoryBucketStore())
+
+    def replay_event(failure: dict[str, Any]) -> dict[str, Any]:
+        result = {
+            "key": failure["key"],
+            "function": failure["function"],
+            "duplicates": failure["duplicates"],
+            "previous_error": failure["error"],
+        }
+        # A wait that reaches the cap returns without a token, so wait again
+        while governor.acquire("replay", "Invoke") >= MAX_WAIT_SECONDS:
+            pass
+        try:
+            response = run(failure["function"], failure["event"])
+            result.update(status="REPLAYED", response=response)
+        except Exception as error:
+            result.update(status="FAILED", error=str(error))
+            return result
+
+        if sqs and not args.keep:
+            for receipt in failure["receipts"]:
+                sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=receipt)
+        return result
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(replay_event, events.values()))
+    return results
+
+
+def print_results(results: list[dict[str, Any]]) -> None:
+    """Print one line per replayed event and a summary."""
+    counts: dict[str, int] = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        detail = result.get("error") or result.get("previous_error") or ""
+        print(f"{result['status']:9} {result['key']} {detail}".rstrip())
+    print(", ".join(f"{count} {status.lower()}" for status, count in sorted(counts.items())))
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--queue-url", help="failure queue to read")
+    source.add_argument("--input", type=Path, help="JSON file of failure records to replay")
+    parser.add_argument("--stack-name", help="look up the failure queue and the functions")
+    parser.add_argument("--region", help="AWS region of the stack")
+    parser.add_argument(
+        "--mode",
+        choices=("remote", "local"),
+        default="remote",
+        help="invoke the deployed function or run its handler here (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="events replayed at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=2.0,
+        help="events replayed per second (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-messages",
+        type=int,
+        default=1000,
+        help="most queue messages to read (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--visibility-timeout",
+        type=int,
+        default=900,
+        help="seconds received messages stay hidden while replaying (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="leave replayed messages in the queue",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="list the distinct failed events without replaying them",
+    )
+    parser.add_argument("--output", type=Path, help="write the results to a JSON file")
+    args = parser.parse_args()
+    if not (args.stack_name or args.queue_url or args.input):
+        parser.error("--stack-name, --queue-url or --input is required")
+    if args.rate <= 0:
+        parser.error("--rate must be greater than 0")
+    return args
+
+
+def main() -> None:
+    """Replay the failed events and exit with status 1 if any replay failed."""
+    args = parse_args()
+    results = replay(args)
+    print_results(results)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, default=str) + "\n")
+        print(f"Wrote {args.output}")
+
+    if any(result["status"] == "FAILED" for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,982 @@
+#!/usr/bin/env python3
+"""
+Simulate the upload-to-playback pipeline offline and measure its throughput.
+
+The MediaConvert job, MediaPackage asset, MediaTailor VOD source and email
+Lambda functions are loaded in-process and wired together through a simulated
+EventBridge bus that follows the rules of the deployment template:
+
+    S3 Object Created -> media_convert_job -> MediaConvert COMPLETE
+    -> mediapackage_vod_asset -> VodAssetPlayable (one per packaging configuration)
+    -> mediatailor_vod_source, and Playback URLs -> sns_email_sender
+
+Every AWS call goes through a real boto3 client whose HTTP layer is replaced by
+an in-memory fake of the services, so request parameters are still validated
+against the service models. Each call takes a configurable latency and can be
+throttled at random. Failed invocations are retried like asynchronous Lambda
+invocations. Sleeps inside handlers are scaled by ``--sleep-scale`` and
+reported separately, as is the time calls waited on the rate governor.
+
+The script replays N synthetic uploads and reports throughput, per-stage
+invocation latency percentiles, end-to-end latency and AWS call counts.
+
+Usage:
+    cd source/scripts
+    python3 simulate_pipeline.py --uploads 200
+    python3 simulate_pipeline.py --uploads 500 --concurrency 50 --throttle-rate 0.02
+    python3 simulate_pipeline.py --uploads 100 --output benchmarks/pipeline.json
+"""
+from __future__ import annotations
+
+import argparse
+import copy
+import heapq
+import importlib.util
+import io
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+SOURCE_DIR = Path(__file__).resolve().parent.parent
+LAYER_DIR = SOURCE_DIR / "layers" / "fast_common"
+
+ACCOUNT_ID = "123456789012"
+REGION = "us-east-1"
+INPUT_BUCKET = "fast-input"
+OUTPUT_BUCKET = "fast-output"
+PACKAGING_GROUP = "fast-PackagingGroup"
+PACKAGING_CONFIGURATIONS = {"fast-Hls": "index.m3u8", "fast-Dash": "index.mpd"}
+SOURCE_LOCATION = "fast-SourceLocation"
+CHANNEL_NAME = "fast-Sample"
+
+# Bitrate of the single simulated rung, which sizes its segments
+SIMULATED_BANDWIDTH = 3000000
+
+HANDLERS = {
+    "media_convert_job": "functions/media_convert_job/app.py",
+    "mediapackage_vod_asset": "functions/mediapackage_vod_asset/app.py",
+    "mediatailor_vod_source": "functions/mediatailor_vod_source/app.py",
+    "sns_email_sender": "functions/sns_email_sender/app.py",
+}
+
+HANDLER_ENV = {
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_DEFAULT_REGION": REGION,
+    "AWS_EC2_METADATA_DISABLED": "true",
+    "LOG_LEVEL": "CRITICAL",
+    "MetricsSampleRate": "0",
+    "StackName": "fast",
+    "StackId": f"arn:aws:cloudformation:{REGION}:{ACCOUNT_ID}:stack/fast/simulated",
+    "MediaConvertJobTemplate": "fast-MediaConvertJobTemplate",
+    "MediaConvertTranscodeRoleArn": f"arn:aws:iam::{ACCOUNT_ID}:role/transcode",
+    "MediaPackagePackagingGroupId": PACKAGING_GROUP,
+    "MediaPackageReadS3RoleArn": f"arn:aws:iam::{ACCOUNT_ID}:role/read-s3",
+    "MediaTailorPlaybackConfigurationVodHls": "https://tailor.example.com/v1/master/abc/vod/",
+    "MediaTailorPlaybackConfigurationVodDash": "https://tailor.example.com/v1/dash/abc/vod/",
+    "MediaTailorSourceLocation": SOURCE_LOCATION,
+    "MediaTailorChannelName": CHANNEL_NAME,
+    "SnsTopicArn": f"arn:aws:sns:{REGION}:{ACCOUNT_ID}:fast-notifications",
+    "DigestBucket": OUTPUT_BUCKET,
+    "JobStatsBucket": OUTPUT_BUCKET,
+    "TranscodeIndexBucket": OUTPUT_BUCKET,
+    "TranscodeReuse": "CHECKSUM",
+}
+
+# Error codes the services return when throttling
+THROTTLING_ERRORS = {
+    "s3": "SlowDown",
+    "events": "ThrottlingException",
+    "sns": "Throttling",
+}
+
+# The traces (uploads) the current thread is working on
+_current = threading.local()
+
+
+def current_traces() -> tuple[str, ...]:
+    """Return the traces of the invocation running on this thread."""
+    return getattr(_current, "traces", ())
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Return the nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(math.ceil(percent / 100 * len(ordered)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """Return the count and latency percentiles of a list of durations in seconds."""
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p90_ms": round(percentile(values, 90) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "max_ms": round(max(values, default=0.0) * 1000, 1),
+    }
+
+
+class LambdaContext:
+    """Minimal stand-in for the Lambda context object."""
+
+    function_name = "simulator"
+    aws_request_id = "simulator-request"
+    invoked_function_arn = f"arn:aws:lambda:{REGION}:{ACCOUNT_ID}:function:simulator"
+
+    def get_remaining_time_in_millis(self) -> int:
+        return 60_000
+
+
+class SimulatedError(Exception):
+    """An error response returned by the simulated services."""
+
+    def __init__(self, code: str, message: str, status: int = 400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+class EventBus:
+    """
+    Deliver events to handlers on a pool of workers, like EventBridge and Lambda.
+
+    Events can be delayed, failed invocations are retried with a growing
+    delay, and events for a batched target are buffered and delivered as one
+    SQS batch per window.
+    """
+
+    def __init__(
+        self,
+        routes: list[tuple[str, Callable[[dict[str, Any]], bool]]],
+        invoke: Callable[[str, dict[str, Any]], None],
+        concurrency: int,
+        retries: int,
+        retry_delay: float,
+        batch_window: float = 0.0,
+        batch_size: int = 10,
+        batched_targets: tuple[str, ...] = (),
+    ):
+        self.routes = routes
+        self.invoke = invoke
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.batched_targets = batched_targets
+        self.invocations: list[dict[str, Any]] = []
+        self.unrouted = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._heap: list[tuple[float, int, dict[str, Any]]] = []
+        self._sequence = itertools.count()
+        self._batches: dict[str, list[dict[str, Any]]] = {}
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def put(
+        self,
+        event: dict[str, Any],
+        delay: float = 0.0,
+        target: str | None = None,
+        attempt: int = 0,
+        traces: tuple[str, ...] | None = None,
+    ) -> None:
+        """Schedule an event for delivery after ``delay`` seconds."""
+        if "detail" in event and "time" not in event:
+            # EventBridge stamps events with the time they occurred
+            occurred = datetime.now(UTC) + timedelta(seconds=delay)
+            event["time"] = occurred.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        item = {
+            "event": event,
+            "target": target,
+            "attempt": attempt,
+            "traces": current_traces() if traces is None else traces,
+            "count": 1,
+        }
+        with self._condition:
+            self._pending += 1
+            due = time.perf_counter() + delay
+            heapq.heappush(self._heap, (due, next(self._sequence), item))
+            self._condition.notify_all()
+
+    def wait(self) -> None:
+        """Block until every event has been delivered and handled."""
+        with self._condition:
+            while self._pending:
+                self._condition.wait()
+
+    def close(self) -> None:
+        """Stop the dispatcher and the workers."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    def _route(self, event: dict[str, Any]) -> str | None:
+        for target, matches in self.routes:
+            if matches(event):
+                return target
+        return None
+
+    def _dispatch(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopped and (
+                    not self._heap or self._heap[0][0] > time.perf_counter()
+                ):
+                    timeout = self._heap[0][0] - time.perf_counter() if self._heap else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, item = heapq.heappop(self._heap)
+                ready = self._prepare(item)
+
+            if ready:
+                self._executor.submit(self._run, ready)
+
+    def _prepare(self, item: dict[str, Any]) -> dict[str, Any] | None:
+        """Resolve the target of an item, buffering batched targets. Holds the lock."""
+        if item["target"] == "flush":
+            # The flush timer itself is not work; the buffered events are
+            self._pending -= 1
+            return self._flush(item["event"]["target"])
+
+        if item["target"] is None:
+            item["target"] = self._route(item["event"])
+            if item["target"] is None:
+                self.unrouted += 1
+                self._pending -= 1
+                self._condition.notify_all()
+                return None
+
+            if item["target"] in self.batched_targets and self.batch_window > 0:
+                batch = self._batches.setdefault(item["target"], [])
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    return self._flush(item["target"])
+                if len(batch) == 1:
+                    self._pending += 1
+                    due = time.perf_counter() + self.batch_window
+                    flush = {"event": {"target": item["target"]}, "target": "flush"}
+                    heapq.heappush(self._heap, (due, next(self._sequence), flush))
+                return None
+
+            if item["target"] in self.batched_targets:
+                return {**item, "event": {"Records": [{"body": json.dumps(item["event"])}]}}
+
+        return item
+
+    def _flush(self, target: str) -> dict[str, Any] | None:
+        batch = self._batches.pop(target, [])
+        if not batch:
+            return None
+        return {
+            "event": {"Records": [{"body": json.dumps(item["event"])} for item in batch]},
+            "target": target,
+            "attempt": 0,
+            "traces": tuple(trace for item in batch for trace in item["traces"]),
+            "count": len(batch),
+        }
+
+    def _run(self, item: dict[str, Any]) -> None:
+        _current.traces = item["traces"]
+        start = time.perf_counter()
+        error = None
+        try:
+            self.invoke(item["target"], copy.deepcopy(item["event"]))
+        except Exception as exception:
+            error = f"{type(exception).__name__}: {exception}"
+            if item["attempt"] < self.retries:
+                self.put(
+                    item["event"],
+                    delay=self.retry_delay * (item["attempt"] + 1),
+                    target=item["target"],
+                    attempt=item["attempt"] + 1,
+                    traces=item["traces"],
+                )
+        finally:
+            end = time.perf_counter()
+            with self._condition:
+                self.invocations.append({
+                    "stage": item["target"],
+                    "start": start,
+                    "end": end,
+                    "attempt": item["attempt"],
+                    "traces": item["traces"],
+                    "error": error,
+                })
+                self._pending -= item["count"]
+                self._condition.notify_all()
+            _current.traces = ()
+
+
+class SimulatedAws:
+    """
+    In-memory fake of the services the pipeline calls.
+
+    Each operation is a method named ``<service>_<operation>``. Operations not
+    modelled here succeed with an empty response and are reported as such.
+    """
+
+    def __init__(self, bus: EventBus, args: argparse.Namespace, rng: random.Random):
+        self.bus = bus
+        self.args = args
+        self.rng = rng
+        self.calls: Counter[str] = Counter()
+        self.throttled: Counter[str] = Counter()
+        self.unmodelled: Counter[str] = Counter()
+        self.objects: dict[str, dict[str, Any]] = {}
+        self.jobs: dict[str, dict[str, Any]] = {}
+        self.assets: dict[str, dict[str, Any]] = {}
+        self.vod_sources: dict[str, dict[str, Any]] = {}
+        self.programs: dict[str, dict[str, Any]] = {}
+        self.messages: list[int] = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def call(self, service: str, operation: str, params: dict[str, Any]) -> dict[str, Any]:
+        """Handle one API call after its simulated latency."""
+        from botocore import xform_name
+
+        name = f"{service}.{operation}"
+        latency = self.args.api_latency_ms / 1000
+        jitter = self.args.latency_jitter
+        time.sleep(latency * self.rng.uniform(1 - jitter, 1 + jitter))
+
+        with self._lock:
+            self.calls[name] += 1
+            if self.rng.random() < self.args.throttle_rate:
+                self.throttled[name] += 1
+                code = THROTTLING_ERRORS.get(service, "TooManyRequestsException")
+                raise SimulatedError(code, "Rate exceeded", 429)
+
+            method = getattr(self, f"{service.replace('-', '_')}_{xform_name(operation)}", None)
+            if method is None:
+                self.unmodelled[name] += 1
+                return {}
+            return copy.deepcopy(method(**params))
+
+    # S3
+
+    def s3_get_object_tagging(self, Bucket: str, Key: str, **_: Any) -> dict[str, Any]:
+        return {"TagSet": self.objects.get(f"{Bucket}/{Key}", {}).get("TagSet", [])}
+
+    def s3_put_object(self, Bucket: str, Key: str, Body: bytes = b"", **_: Any) -> dict[str, Any]:
+        self.objects[f"{Bucket}/{Key}"] = {"TagSet": [], "Body": Body}
+        return {"ETag": '"simulated"'}
+
+    def s3_head_object(self, Bucket: str, Key: str, **_: Any) -> dict[str, Any]:
+        if f"{Bucket}/{Key}" not in self.objects:
+            raise SimulatedError("404", "Not Found", 404)
+        item = self.objects[f"{Bucket}/{Key}"]
+        size = item.get("Size", len(item.get("Body", b"")))
+        return {"ContentLength": size, **({"ETag": item["ETag"]} if "ETag" in item else {})}
+
+    def s3_get_object(self, Bucket: str, Key: str, **_: Any) -> dict[str, Any]:
+        from botocore.response import StreamingBody
+
+        if f"{Bucket}/{Key}" not in self.objects:
+            raise SimulatedError("NoSuchKey", "The specified key does not exist.", 404)
+        body = self.objects[f"{Bucket}/{Key}"].get("Body", b"")
+        return {"Body": StreamingBody(io.BytesIO(body), len(body)), "ContentLength": len(body)}
+
+    def s3_list_objects_v2(self, Bucket: str, Prefix: str = "", **_: Any) -> dict[str, Any]:
+        keys = sorted(
+            name.split("/", 1)[1]
+            for name in self.objects
+            if name.startswith(f"{Bucket}/{Prefix}")
+        )
+        contents = [
+            {"Key": key, "Size": self.objects[f"{Bucket}/{key}"].get("Size", 0)} for key in keys
+        ]
+        return {"Contents": contents, "KeyCount": len(keys), "IsTruncated": False}
+
+    def write_playlists(self, destination: str, stem: str, segment_length: int) -> None:
+        """Write the master playlist, one variant and its segments of a job output."""
+        bucket, prefix = destination.removeprefix("s3://").split("/", 1)
+        count = max(1, round(self.args.program_seconds / segment_length))
+        segment_size = SIMULATED_BANDWIDTH * segment_length // 8
+        variant = [f"#EXTM3U\n#EXT-X-TARGETDURATION:{segment_length}\n"]
+        for index in range(1, count + 1):
+            segment = f"{stem}_1_{index:05d}.ts"
+            self.objects[f"{bucket}/{prefix}{segment}"] = {"TagSet": [], "Size": segment_size}
+            variant.append(f"#EXTINF:{segment_length}.000,\n{segment}\n")
+        variant.append("#EXT-X-ENDLIST\n")
+        master = (
+            f"#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH={SIMULATED_BANDWIDTH},"
+            f'RESOLUTION=1280x720,CODECS="avc1.64001f,mp4a.40.2"\n{stem}_1.m3u8\n'
+        )
+        self.objects[f"{bucket}/{prefix}{stem}_1.m3u8"] = {"Body": "".join(variant).encode()}
+        self.objects[f"{bucket}/{prefix}{stem}.m3u8"] = {"Body": master.encode()}
+
+    # MediaConvert
+
+    def mediaconvert_get_job_template(self, Name: str, **_: Any) -> dict[str, Any]:
+        return {
+            "JobTemplate": {
+                "Name": Name,
+                "Settings": {
+                    "Inputs": [{"TimecodeSource": "ZEROBASED"}],
+                    "OutputGroups": [
+                        {
+                            "Name": "Apple HLS",
+                            "Outputs": [{"Preset": "fast-MediaConvertPreset720AVC3000"}],
+                            "OutputGroupSettings": {
+                                "Type": "HLS_GROUP_SETTINGS",
+                                "HlsGroupSettings": {
+                                    "SegmentLength": 6,
+                                    "Destination": f"s3://{OUTPUT_BUCKET}/",
+                                },
+                            },
+                        }
+                    ],
+                },
+            }
+        }
+
+    def mediaconvert_create_job(
+        self, Role: str, Settings: dict[str, Any], **params: Any
+    ) -> dict[str, Any]:
+        job_id = f"job-{next(self._ids)}"
+        stem = os.path.splitext(Settings["Inputs"][0]["FileInput"].rsplit("/", 1)[-1])[0]
+        group_details = []
+        for group in Settings["OutputGroups"]:
+            settings = group["OutputGroupSettings"]
+            group_type = settings["Type"].replace("_SETTINGS", "")
+            group_settings = next(value for key, value in settings.items() if key != "Type")
+            destination = group_settings["Destination"]
+            self.write_playlists(destination, stem, group_settings.get("SegmentLength", 6))
+            group_details.append({
+                "type": group_type,
+                "playlistFilePaths": [f"{destination}{stem}.m3u8"],
+            })
+
+        self.jobs[job_id] = {"Id": job_id, "Status": "SUBMITTED"}
+        submitted = round(time.time() * 1000)
+        self.bus.put(
+            {
+                "source": "aws.mediaconvert",
+                "detail-type": "MediaConvert Job State Change",
+                "detail": {
+                    "status": "COMPLETE",
+                    "jobId": job_id,
+                    "queue": f"arn:aws:mediaconvert:{REGION}:{ACCOUNT_ID}:queues/Default",
+                    "userMetadata": params.get("UserMetadata", {}),
+                    "outputGroupDetails": group_details,
+                    "timing": {
+                        "submitTime": submitted,
+                        "startTime": submitted,
+                        "finishTime": submitted + round(self.args.transcode_seconds * 1000),
+                    },
+                },
+            },
+            delay=self.args.transcode_seconds,
+        )
+        return {"Job": {"Id": job_id, "Status": "SUBMITTED", "Role": Role, "Settings": {}}}
+
+    # MediaPackage VOD
+
+    def mediapackage_vod_create_asset(self, Id: str, **params: Any) -> dict[str, Any]:
+        if Id in self.assets:
+            raise SimulatedError("UnprocessableEntityException", f"Asset {Id} already exists")
+
+        arn = f"arn:aws:mediapackage-vod:{REGION}:{ACCOUNT_ID}:assets/{Id}"
+        endpoints = [
+            {
+                "PackagingConfigurationId": configuration,
+                "Url": f"https://egress.example.com/out/v1/{Id}/{configuration}/{manifest}",
+            }
+            for configuration, manifest in PACKAGING_CONFIGURATIONS.items()
+        ]
+        self.assets[Id] = {"Id": Id, "Arn": arn, "EgressEndpoints": endpoints, **params}
+
+        for endpoint in endpoints:
+            self.bus.put(
+                {
+                    "source": "aws.mediapackage",
+                    "detail-type": "MediaPackage Input Notification",
+                    "resources": [arn],
+                    "detail": {
+                        "event": "VodAssetPlayable",
+                        "packaging_configuration_id": endpoint["PackagingConfigurationId"],
+                        "manifest_urls": [endpoint["Url"]],
+                    },
+                },
+                delay=self.args.package_seconds,
+            )
+        return self.assets[Id]
+
+    def mediapackage_vod_describe_asset(self, Id: str, **_: Any) -> dict[str, Any]:
+        if Id not in self.assets:
+            raise SimulatedError("NotFoundException", f"Asset {Id} not found", 404)
+        return self.assets[Id]
+
+    def mediapackage_vod_delete_asset(self, Id: str, **_: Any) -> dict[str, Any]:
+        if self.assets.pop(Id, None) is None:
+            raise SimulatedError("NotFoundException", f"Asset {Id} not found", 404)
+        return {}
+
+    def mediapackage_vod_tag_resource(
+        self, ResourceArn: str, Tags: dict[str, str], **_: Any
+    ) -> dict[str, Any]:
+        self.assets[ResourceArn.rsplit("/", 1)[-1]].setdefault("Tags", {}).update(Tags)
+        return {}
+
+    def mediapackage_vod_list_tags_for_resource(self, ResourceArn: str, **_: Any) -> dict[str, Any]:
+        asset = self.assets.get(ResourceArn.rsplit("/", 1)[-1], {})
+        return {"Tags": asset.get("Tags", {})}
+
+    # EventBridge
+
+    def events_put_events(self, Entries: list[dict[str, Any]], **_: Any) -> dict[str, Any]:
+        for entry in Entries:
+            self.bus.put({
+                "source": entry["Source"],
+                "detail-type": entry["DetailType"],
+                "detail": json.loads(entry["Detail"]),
+            })
+        return {
+            "FailedEntryCount": 0,
+            "Entries": [{"EventId": f"event-{next(self._ids)}"} for _ in Entries],
+        }
+
+    # MediaTailor
+
+    def mediatailor_create_vod_source(self, VodSourceName: str, **params: Any) -> dict[str, Any]:
+        if VodSourceName in self.vod_sources:
+            raise SimulatedError("BadRequestException", f"VodSource {VodSourceName} already exists")
+        arn = f"arn:aws:mediatailor:{REGION}:{ACCOUNT_ID}:vodSource/{VodSourceName}"
+        self.vod_sources[VodSourceName] = {"VodSourceName": VodSourceName, "Arn": arn, **params}
+        return self.vod_sources[VodSourceName]
+
+    def mediatailor_describe_vod_source(self, VodSourceName: str, **_: Any) -> dict[str, Any]:
+        if VodSourceName not in self.vod_sources:
+            raise SimulatedError("BadRequestException", f"VodSource {VodSourceName} not found")
+        return self.vod_sources[VodSourceName]
+
+    def mediatailor_update_vod_source(self, VodSourceName: str, **params: Any) -> dict[str, Any]:
+        self.vod_sources[VodSourceName].update(params)
+        return self.vod_sources[VodSourceName]
+
+    def mediatailor_tag_resource(
+        self, ResourceArn: str, Tags: dict[str, str], **_: Any
+    ) -> dict[str, Any]:
+        self.vod_sources[ResourceArn.rsplit("/", 1)[-1]].setdefault("Tags", {}).update(Tags)
+        return {}
+
+    def mediatailor_get_channel_schedule(self, ChannelName: str, **_: Any) -> dict[str, Any]:
+        items = [
+            {"ProgramName": name}
+            for name, program in self.programs.items()
+            if program["ChannelName"] == ChannelName
+        ]
+        return {"Items": items[:1]}
+
+    def mediatailor_create_program(self, ProgramName: str, **params: Any) -> dict[str, Any]:
+        if ProgramName in self.programs:
+            raise SimulatedError("BadRequestException", f"Program {ProgramName} already exists")
+        self.programs[ProgramName] = {"ProgramName": ProgramName, **params}
+        return {"ProgramName": ProgramName, "ChannelName": params["ChannelName"]}
+
+    def mediatailor_describe_program(self, ProgramName: str, **_: Any) -> dict[str, Any]:
+        if ProgramName not in self.programs:
+            raise SimulatedError("NotFoundException", f"Program {ProgramName} not found", 404)
+        return self.programs[ProgramName]
+
+    def mediatailor_update_program(
+        self, ProgramName: str, AdBreaks: list[dict[str, Any]] | None = None, **_: Any
+    ) -> dict[str, Any]:
+        self.programs[ProgramName]["AdBreaks"] = AdBreaks or []
+        return self.programs[ProgramName]
+
+    def mediatailor_delete_program(self, ProgramName: str, **_: Any) -> dict[str, Any]:
+        self.programs.pop(ProgramName, None)
+        return {}
+
+    # SNS
+
+    def sns_publish(self, Message: str, **_: Any) -> dict[str, Any]:
+        self.messages.append(len(Message.encode("utf-8")))
+        return {"MessageId": f"message-{next(self._ids)}"}
+
+
+def install_simulated_clients(aws: SimulatedAws) -> None:
+    """Route every client created through fast_common to the simulated services."""
+    from botocore.awsrequest import AWSResponse
+    from fast_common import clients, governor
+
+    create_client = clients.create_client
+
+    def create_simulated_client(service_name: str, endpoint_url: str | None = None) -> Any:
+        client = create_client(service_name, endpoint_url)
+
+        def capture_params(params: dict[str, Any], context: dict[str, Any], **_: Any) -> None:
+            context["simulated_params"] = copy.deepcopy(params)
+
+        def respond(model: Any, context: dict[str, Any], **_: Any) -> tuple[Any, dict[str, Any]]:
+            try:
+                parsed = aws.call(service_name, model.name, context["simulated_params"])
+                status = 200
+            except SimulatedError as error:
+                parsed = {"Error": {"Code": error.code, "Message": error.message}}
+                status = error.status
+            parsed["ResponseMetadata"] = {"HTTPStatusCode": status, "RequestId": "simulated"}
+            return AWSResponse(None, status, {}, None), parsed
+
+        client.meta.events.register("before-parameter-build.*.*", capture_params)
+        client.meta.events.register("before-call.*.*", respond)
+        return client
+
+    clients.reset_clients()
+    clients.create_client = create_simulated_client
+    governor.reset_governor()
+
+
+def load_handlers(sleeps: list[float], sleep_scale: float) -> dict[str, Callable[..., Any]]:
+    """Import every handler under its own module name and scale its sleeps."""
+    sys.path.insert(0, str(LAYER_DIR))
+    lock = threading.Lock()
+
+    def simulated_sleep(seconds: float) -> None:
+        with lock:
+            sleeps.append(seconds)
+        if sleep_scale:
+            time.sleep(seconds * sleep_scale)
+
+    handlers = {}
+    for name, path in HANDLERS.items():
+        spec = importlib.util.spec_from_file_location(f"{name}_app", SOURCE_DIR / path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+        if hasattr(module, "sleep"):
+            module.sleep = simulated_sleep
+        handlers[name] = module.lambda_handler
+    return handlers
+
+
+def simulate(args: argparse.Namespace) -> dict[str, Any]:
+    """Replay ``args.uploads`` synthetic uploads through the pipeline."""
+    os.environ.update(HANDLER_ENV)
+    if args.job_stats:
+        os.environ["JobStatsPath"] = str(args.job_stats)
+    sleeps: list[float] = []
+    handlers = load_handlers(sleeps, args.sleep_scale)
+    context = LambdaContext()
+
+    routes = [
+        ("media_convert_job", lambda event: event.get("source") == "aws.s3"),
+        (
+            "mediapackage_vod_asset",
+            lambda event: event.get("source") == "aws.mediaconvert"
+            and event["detail"].get("status") == "COMPLETE"
+            or event.get("detail-type") == "MediaConvert Job Reused",
+        ),
+        (
+            "mediatailor_vod_source",
+            lambda event: event.get("source") == "aws.mediapackage"
+            and event["detail"].get("event") == "VodAssetPlayable"
+            or event.get("detail-type") == "Ad Breaks Changed",
+        ),
+        ("sns_email_sender", lambda event: event.get("detail-type") == "Playback URLs"),
+    ]
+    bus = EventBus(
+        routes,
+        lambda target, event: handlers[target](event, context),
+        concurrency=args.concurrency,
+        retries=args.retries,
+        retry_delay=args.retry_delay,
+        batch_window=args.digest_window,
+        batch_size=args.digest_max_events,
+        batched_targets=("sns_email_sender",),
+    )
+    aws = SimulatedAws(bus, args, random.Random(args.seed))
+    install_simulated_clients(aws)
+
+    uploads: dict[str, float] = {}
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    for index in range(args.uploads):
+        trace = f"video{index:05d}"
+        key = f"uploads/{trace}.mp4"
+        tags = [{"Key": "AdOffsets", "Value": args.ad_offsets}] if args.ad_offsets else []
+        # A re-delivery has the content, and so the ETag, of an earlier upload
+        content = rng.randrange(index) if index and rng.random() < args.duplicate_rate else index
+        aws.objects[f"{INPUT_BUCKET}/{key}"] = {"TagSet": tags, "ETag": f'"{content:032x}"'}
+
+        delay = index / args.upload_rate if args.upload_rate else 0.0
+        uploads[trace] = start + delay
+        bus.put(
+            {
+                "source": "aws.s3",
+                "detail-type": "Object Created",
+                "detail": {"bucket": {"name": INPUT_BUCKET}, "object": {"key": key}},
+            },
+            delay=delay,
+            traces=(trace,),
+        )
+
+    bus.wait()
+    elapsed = time.perf_counter() - start
+
+    # Change the ad offsets of packaged uploads, which should not transcode again
+    retagged = [trace for trace in uploads if rng.random() < args.retag_rate]
+    retag_start = time.perf_counter()
+    for trace in retagged:
+        key = f"uploads/{trace}.mp4"
+        aws.objects[f"{INPUT_BUCKET}/{key}"]["TagSet"] = [
+            {"Key": "AdOffsets", "Value": args.retag_offsets}
+        ]
+        bus.put({
+            "source": "aws.s3",
+            "detail-type": "Object Tagging",
+            "detail": {"bucket": {"name": INPUT_BUCKET}, "object": {"key": key}},
+        })
+    bus.wait()
+    retag_elapsed = time.perf_counter() - retag_start
+    bus.close()
+
+    if args.vod_sources:
+        args.vod_sources.write_text(json.dumps(list(aws.vod_sources.values()), indent=2) + "\n")
+
+    from fast_common.governor import get_governor
+
+    result = report(args, bus, aws, uploads, sleeps, elapsed, get_governor().waited)
+    result["retagged"] = {
+        "uploads": len(retagged),
+        "elapsed_s": round(retag_elapsed, 2),
+        "programs_updated": sum(
+            1
+            for trace in retagged
+            if aws.programs.get(trace, {}).get("AdBreaks")
+            and aws.programs[trace]["AdBreaks"][0]["OffsetMillis"]
+            == int(args.retag_offsets.split()[0])
+        ),
+    }
+    return result
+
+
+def report(
+    args: argparse.Namespace,
+    bus: EventBus,
+    aws: SimulatedAws,
+    uploads: dict[str, float],
+    sleeps: list[float],
+    elapsed: float,
+    governor_waits: dict[str, float],
+) -> dict[str, Any]:
+    """Aggregate the invocations of a simulation into a report."""
+    stages: dict[str, list[float]] = {}
+    errors: Counter[str] = Counter()
+    finished: dict[str, float] = {}
+    notified: set[str] = set()
+
+    for invocation in bus.invocations:
+        stages.setdefault(invocation["stage"], []).append(invocation["end"] - invocation["start"])
+        if invocation["error"]:
+            errors[invocation["stage"]] += 1
+        for trace in invocation["traces"]:
+            finished[trace] = max(finished.get(trace, 0.0), invocation["end"])
+            if invocation["stage"] == "sns_email_sender" and not invocation["error"]:
+                notified.add(trace)
+
+    end_to_end = [finished[trace] - uploads[trace] for trace in notified]
+    failed_uploads = len(uploads) - len(notified)
+
+    return {
+        "settings": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "quiet", "vod_sources")
+        },
+        "uploads": len(uploads),
+        "completed": len(notified),
+        "failed": failed_uploads,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_per_s": round(len(notified) / elapsed, 2) if elapsed else 0.0,
+        "end_to_end": summarize(end_to_end),
+        "stages": {stage: summarize(durations) for stage, durations in stages.items()},
+        "invocation_errors": dict(errors),
+        "retries": sum(1 for invocation in bus.invocations if invocation["attempt"]),
+        "api_calls": dict(sorted(aws.calls.items())),
+        "throttled_calls": dict(sorted(aws.throttled.items())),
+        "unmodelled_calls": dict(sorted(aws.unmodelled.items())),
+        "emails": len(aws.messages),
+        "handler_sleeps": {"count": len(sleeps), "requested_s": round(sum(sleeps), 1)},
+        "governor_waits_s": {
+            name: round(seconds, 2) for name, seconds in sorted(governor_waits.items())
+        },
+        "unrouted_events": bus.unrouted,
+    }
+
+
+def print_report(result: dict[str, Any]) -> None:
+    """Print a simulation report as plain text."""
+    print(
+        f"{result['completed']}/{result['uploads']} uploads in {result['elapsed_s']}s "
+        f"({result['throughput_per_s']}/s), {result['failed']} failed, "
+        f"{result['retries']} retries, {result['emails']} emails"
+    )
+    print(f"{'stage':28} {'count':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    rows = {**result["stages"], "end_to_end": result["end_to_end"]}
+    for stage, stats in rows.items():
+        print(
+            f"{stage:28} {stats['count']:6} {stats['p50_ms']:7.1f}ms {stats['p90_ms']:7.1f}ms "
+            f"{stats['p99_ms']:7.1f}ms {stats['max_ms']:7.1f}ms"
+        )
+    print(f"{'api call':44} {'count':>6} {'throttled':>9}")
+    for name, count in result["api_calls"].items():
+        print(f"{name:44} {count:6} {result['throttled_calls'].get(name, 0):9}")
+    sleeps = result["handler_sleeps"]
+    print(f"Handler sleeps: {sleeps['count']} requesting {sleeps['requested_s']}s")
+    for name, seconds in result["governor_waits_s"].items():
+        print(f"Rate governor waits for {name}: {seconds}s")
+    for stage, count in result["invocation_errors"].items():
+        print(f"Errors in {stage}: {count}")
+    if result["retagged"]["uploads"]:
+        retagged = result["retagged"]
+        print(
+            f"Re-tagged {retagged['uploads']} uploads: {retagged['programs_updated']} programs "
+            f"updated in {retagged['elapsed_s']}s"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--uploads", type=int, default=100, help="synthetic uploads to replay")
+    parser.add_argument(
+        "--upload-rate",
+        type=float,
+        default=0.0,
+        help="uploads per second, 0 to upload everything at once",
+    )
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent invocations")
+    parser.add_argument("--api-latency-ms", type=float, default=20.0, help="latency per AWS call")
+    parser.add_argument(
+        "--latency-jitter",
+        type=float,
+        default=0.5,
+        help="relative spread of the latency, 0.5 for +/-50%%",
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="probability that an AWS call is throttled",
+    )
+    parser.add_argument(
+        "--transcode-seconds",
+        type=float,
+        default=1.0,
+        help="simulated MediaConvert job duration",
+    )
+    parser.add_argument(
+        "--package-seconds",
+        type=float,
+        default=0.5,
+        help="simulated delay before a MediaPackage asset is playable",
+    )
+    parser.add_argument(
+        "--sleep-scale",
+        type=float,
+        default=0.0,
+        help="fraction of each handler sleep to actually wait, 0 to skip sleeps",
+    )
+    parser.add_argument("--retries", type=int, default=2, help="retries of a failed invocation")
+    parser.add_argument(
+        "--retry-delay",
+        type=float,
+        default=0.5,
+        help="seconds before the first retry, growing with each attempt",
+    )
+    parser.add_argument(
+        "--digest-window",
+        type=float,
+        default=0.0,
+        help="seconds to batch Playback URLs events for the email function, 0 for no batching",
+    )
+    parser.add_argument(
+        "--digest-max-events",
+        type=int,
+        default=500,
+        help="maximum Playback URLs events in one email batch",
+    )
+    parser.add_argument("--ad-offsets", default="30000 90000", help="AdOffsets tag of uploads")
+    parser.add_argument(
+        "--retag-rate",
+        type=float,
+        default=0.0,
+        help="fraction of uploads whose ad offsets are changed after they are packaged",
+    )
+    parser.add_argument(
+        "--retag-offsets",
+        default="45000 105000",
+        help="AdOffsets tag set on re-tagged uploads (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--duplicate-rate",
+        type=float,
+        default=0.0,
+        help="fraction of uploads that re-deliver the content of an earlier upload",
+    )
+    parser.add_argument(
+        "--program-seconds",
+        type=float,
+        default=120.0,
+        help="duration of the simulated transcoded programs (default: %(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="random seed for latency and throttling")
+    parser.add_argument("--output", type=Path, help="write the report to a JSON file")
+    parser.add_argument(
+        "--vod-sources",
+        type=Path,
+        help="write the simulated VOD sources and their tags, for latency_report.py --input",
+    )
+    parser.add_argument(
+        "--job-stats",
+        type=Path,
+        help="append MediaConvert job statistics to a CSV file, for transcode_report.py --input",
+    )
+    parser.add_argument("--quiet", action="store_true", help="do not print the report")
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Run the simulation and report the results."""
+    args = parse_args()
+    result = simulate(args)
+
+    if not args.quiet:
+        print_report(result)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"Wrote {args.output}")
+
+    if result["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Report MediaConvert queue wait, encode speed and bytes per rung.
+
+The MediaPackage function records the timing of every completed MediaConvert
+job and the size of each rendition as CSV rows (``fast_common.jobstats``),
+under ``analytics/mediaconvert/`` in the destination bucket. This script reads
+those rows and reports, per queue, how long jobs waited against how long they
+took to transcode and how fast they encoded relative to real time, and per
+rung, the bitrate actually delivered against the advertised bandwidth and
+the storage each rung costs per hour of content.
+
+Usage:
+    cd source/scripts
+    python3 transcode_report.py --input s3://<destination-bucket>/analytics/mediaconvert/
+    python3 transcode_report.py --input s3://<bucket>/analytics/mediaconvert/ --since 2026-10-01
+    python3 transcode_report.py --input job_stats.csv --output report.json
+
+``--input`` accepts S3 prefixes, CSV files and directories of CSV files, and
+may be repeated.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+# Share the column definitions with the Lambda functions
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "fast_common"))
+from fast_common.tracing import parse_timestamp  # noqa: E402
+
+GIB = 1024**3
+
+# Concurrent S3 reads of per-job CSV objects
+READ_WORKERS = 16
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Return the nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(math.ceil(percent / 100 * len(ordered)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """Return the count and percentiles of a list of values."""
+    return {
+        "count": len(values),
+        "p10": round(percentile(values, 10), 2),
+        "p50": round(percentile(values, 50), 2),
+        "p90": round(percentile(values, 90), 2),
+        "max": round(max(values, default=0.0), 2),
+    }
+
+
+def to_float(value: str | None) -> float | None:
+    """Convert a CSV cell to a float, or None when it is empty."""
+    try:
+        return float(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def read_s3_rows(url: str, region: str | None) -> list[dict[str, str]]:
+    """Read the rows of every CSV object under an S3 prefix."""
+    import boto3
+
+    bucket, _, prefix = url.removeprefix("s3://").partition("/")
+    s3 = boto3.client("s3", region_name=region)
+    keys = [
+        item["Key"]
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix)
+        for item in page.get("Contents", [])
+        if item["Key"].endswith(".csv")
+    ]
+
+    def read(key: str) -> list[dict[str, str]]:
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read().decode("utf-8")
+        return list(csv.DictReader(io.StringIO(body)))
+
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        return [row for rows in executor.map(read, keys) for row in rows]
+
+
+def read_rows(inputs: list[str], region: str | None = None) -> list[dict[str, str]]:
+    """Read job statistics rows from S3 prefixes, CSV files and directories."""
+    rows: list[dict[str, str]] = []
+    for source in inputs:
+        if source.startswith("s3://"):
+            rows.extend(read_s3_rows(source, region))
+            continue
+        path = Path(source)
+        for file in sorted(path.rglob("*.csv")) if path.is_dir() else [path]:
+            with file.open(newline="", encoding="utf-8") as stats_file:
+                rows.extend(csv.DictReader(stats_file))
+    return rows
+
+
+def group_jobs(
+    rows: list[dict[str, str]], since: str | None = None
+) -> dict[str, list[dict[str, str]]]:
+    """Group rows by job, keeping the rows of the last record of each job."""
+    since_time = parse_timestamp(since) if since else None
+    jobs: dict[str, list[dict[str, str]]] = {}
+    for row in rows:
+        if since_time:
+            finished = row.get("FinishTime") or row.get("SubmitTime")
+            if not finished or parse_timestamp(finished) < since_time:
+                continue
+        job = jobs.setdefault(row["JobId"], [])
+        # A job recorded twice, e.g. by a replay, repeats its renditions
+        if any(existing["Rung"] == row["Rung"] for existing in job):
+            job.clear()
+        job.append(row)
+    return jobs
+
+
+def build_report(rows: list[dict[str, str]], since: str | None = None) -> dict[str, Any]:
+    """Compute queue, speed and rung statistics from job statistics rows."""
+    jobs = group_jobs(rows, since)
+    queues: dict[str, dict[str, list[float]]] = {}
+    rungs: dict[tuple[str, ...], dict[str, Any]] = {}
+    content_hours = 0.0
+    total_bytes = 0
+
+    for job_rows in jobs.values():
+        job = job_rows[0]
+        program_seconds = (to_float(job.get("ProgramMillis")) or 0.0) / 1000
+        content_hours += program_seconds / 3600
+        queue = queues.setdefault(
+            job.get("Queue") or "unknown",
+            {"queue_s": [], "transcode_s": [], "speed": [], "queue_share": []},
+        )
+        wait = to_float(job.get("QueueSeconds"))
+        transcode = to_float(job.get("TranscodeSeconds"))
+        if wait is not None:
+            queue["queue_s"].append(wait)
+        if transcode:
+            queue["transcode_s"].append(transcode)
+            queue["speed"].append(program_seconds / transcode)
+        if wait is not None and transcode:
+            queue["queue_share"].append(100 * wait / (wait + transcode))
+
+        for row in job_rows:
+            key = (
+                row.get("Type", ""), row["Rung"], row.get("Resolution", ""), row.get("Codecs", "")
+            )
+            rung = rungs.setdefault(
+                key, {"count": 0, "bandwidth": [], "bytes": 0, "seconds": 0.0, "kbps": []}
+            )
+            size = to_float(row.get("Bytes")) or 0.0
+            seconds = (to_float(row.get("DurationMillis")) or 0.0) / 1000
+            rung["count"] += 1
+            rung["bytes"] += size
+            rung["seconds"] += seconds
+            total_bytes += size
+            if seconds:
+                rung["kbps"].append(size * 8 / seconds / 1000)
+            if to_float(row.get("Bandwidth")):
+                rung["bandwidth"].append(to_float(row["Bandwidth"]) / 1000)
+
+    report_queues = {}
+    for name, values in queues.items():
+        transcode_hours = sum(values["transcode_s"]) / 3600
+        report_queues[name] = {
+            "queue_s": summarize(values["queue_s"]),
+            "transcode_s": summarize(values["transcode_s"]),
+            "speed_x_realtime": summarize(values["speed"]),
+            "queue_share_percent": summarize(values["queue_share"]),
+            "transcode_hours": round(transcode_hours, 2),
+        }
+
+    report_rungs = []
+    for (rung_type, rung, resolution, codecs), values in sorted(rungs.items()):
+        advertised = percentile(values["bandwidth"], 50)
+        hours = values["seconds"] / 3600
+        delivered = values["bytes"] * 8 / values["seconds"] / 1000 if hours else 0.0
+        report_rungs.append({
+            "rung": rung,
+            "type": rung_type,
+            "resolution": resolution,
+            "codecs": codecs,
+            "renditions": values["count"],
+            "advertised_kbps": round(advertised),
+            "delivered_kbps": round(delivered),
+            "delivered_p90_kbps": round(percentile(values["kbps"], 90)),
+            "delivered_percent": round(100 * delivered / advertised, 1) if advertised else None,
+            "gib_per_content_hour": round(values["bytes"] / GIB / hours, 3) if hours else 0.0,
+            "bytes_percent": round(100 * values["bytes"] / total_bytes, 1) if total_bytes else 0.0,
+        })
+
+    return {
+        "rows": len(rows),
+        "jobs": len(jobs),
+        "content_hours": round(content_hours, 2),
+        "stored_gib": round(total_bytes / GIB, 2),
+        "queues": report_queues,
+        "rungs": report_rungs,
+    }
+
+
+def print_report(report: dict[str, Any]) -> None:
+    """Print a transcode report as plain text."""
+    print(
+        f"{report['jobs']} jobs, {report['content_hours']} content hours, "
+        f"{report['stored_gib']} GiB stored"
+    )
+    print(
+        f"{'queue':24} {'jobs':>6} {'wait p50':>9} {'wait p90':>9} {'encode p50':>11} "
+        f"{'speed p10':>10} {'speed p50':>10} {'waiting':>8}"
+    )
+    for name, stats in report["queues"].items():
+        print(
+            f"{name:24} {stats['transcode_s']['count']:6} {stats['queue_s']['p50']:8.1f}s "
+            f"{stats['queue_s']['p90']:8.1f}s {stats['transcode_s']['p50']:10.1f}s "
+            f"{stats['speed_x_realtime']['p10']:9.2f}x {stats['speed_x_realtime']['p50']:9.2f}x "
+            f"{stats['queue_share_percent']['p50']:7.1f}%"
+        )
+
+    print(
+        f"{'rung':8} {'type':6} {'resolution':11} {'advertised':>11} {'delivered':>10} "
+        f"{'ratio':>7} {'GiB/hour':>9} {'bytes':>7}"
+    )
+    for rung in report["rungs"]:
+        ratio = f"{rung['delivered_percent']:6.1f}%" if rung["delivered_percent"] else "      -"
+        print(
+            f"{rung['rung']:8} {rung['type']:6} {rung['resolution']:11} "
+            f"{rung['advertised_kbps']:6} kbps {rung['delivered_kbps']:5} kbps {ratio} "
+            f"{rung['gib_per_content_hour']:9.3f} {rung['bytes_percent']:6.1f}%"
+        )
+
+
+def main() -> None:
+    """Build the transcode report from job statistics in S3 or local files."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--input",
+        action="append",
+        required=True,
+        help="S3 prefix (s3://bucket/prefix), CSV file or directory, may be repeated",
+    )
+    parser.add_argument("--region", help="AWS region of the bucket")
+    parser.add_argument("--since", help="only include jobs finished at or after this ISO 8601 time")
+    parser.add_argument("--output", type=Path, help="write the report to a JSON file")
+    args = parser.parse_args()
+
+    report = build_report(read_rows(args.input, args.region), args.since)
+    print_report(report)
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Upload a source video with its ad offsets so that exactly one transcode starts.
+
+Uploading a file and then tagging it with ``AdOffsets`` sends an Object
+Created and then an Object Tagging event to the MediaConvert function, which
+transcodes the file twice. This script sets the tags in the same request that
+creates the object (PutObject, or CreateMultipartUpload for large files), so
+only the Object Created event fires. Ad offsets are checked with the rules of
+the MediaConvert function before anything is uploaded. Large files are sent
+as a parallel multipart upload with a configurable part size and concurrency.
+
+Usage:
+    cd source/scripts
+    python3 upload.py movie.mxf --stack-name <stack-name> --ad-offsets "30000 90000 120000"
+    python3 upload.py movie.mov --bucket <source-bucket> --key series/ep1.mov --tag Genre=Drama
+    python3 upload.py movie.mxf --stack-name <stack-name> --part-size 128 --concurrency 16
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from urllib.parse import quote, urlencode
+
+SOURCE_DIR = Path(__file__).resolve().parent.parent
+
+# Share the ad offset rules with the MediaConvert function
+sys.path.insert(0, str(SOURCE_DIR / "layers" / "fast_common"))
+spec = importlib.util.spec_from_file_location(
+    "media_convert_job_app", SOURCE_DIR / "functions" / "media_convert_job" / "app.py"
+)
+media_convert_job = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(media_convert_job)
+
+MIB = 1024 * 1024
+
+# S3 multipart upload limits
+MIN_PART_SIZE = 5 * MIB
+MAX_PARTS = 10000
+
+# S3 object tag limits
+MAX_TAGS = 10
+MAX_TAG_VALUE_LENGTH = 256
+
+
+def validate_ad_offsets(value: str, tag_key: str) -> list[str]:
+    """
+    Return the ad offsets of a tag value as the MediaConvert function reads them.
+
+    Raises ValueError when the function would not find the tag, or when an
+    offset is not a non-negative number of milliseconds.
+    """
+    # The function reads the tag key of the deployed stack from its environment
+    os.environ["AdOffsetS3TagKeyName"] = tag_key
+    offsets = media_convert_job.get_ad_offsets([{"Key": tag_key, "Value": value}])
+    if not offsets:
+        raise ValueError(f"The MediaConvert function would not read ad offsets from {tag_key}")
+
+    for offset in offsets:
+        try:
+            milliseconds = float(offset)
+        except ValueError as error:
+            raise ValueError(f"Ad offset {offset} is not a number of milliseconds") from error
+        if milliseconds < 0:
+            raise ValueError(f"Ad offset {offset} is negative")
+    return offsets
+
+
+def build_tagging(tags: dict[str, str]) -> str:
+    """Encode tags as the URL query string S3 expects in the Tagging parameter."""
+    if len(tags) > MAX_TAGS:
+        raise ValueError(f"S3 objects can have at most {MAX_TAGS} tags")
+    for key, value in tags.items():
+        if len(value) > MAX_TAG_VALUE_LENGTH:
+            raise ValueError(f"Tag {key} is longer than {MAX_TAG_VALUE_LENGTH} characters")
+    return urlencode(tags, quote_via=quote)
+
+
+def get_part_size(file_size: int, part_size: int) -> int:
+    """Return the part size to use, growing it if the file would need too many parts."""
+    part_size = max(part_size, MIN_PART_SIZE)
+    while file_size > part_size * MAX_PARTS:
+        part_size *= 2
+    return part_size
+
+
+class Progress:
+    """Print the bytes uploaded and the throughput as parts complete."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.sent = 0
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._reported = 0
+
+    def __call__(self, sent: int) -> None:
+        with self._lock:
+            self.sent += sent
+            # Report every 5% so the output stays short for large files
+            if self.sent - self._reported < self.size / 20 and self.sent < self.size:
+                return
+            self._reported = self.sent
+            elapsed = time.perf_counter() - self.start
+            rate = self.sent / MIB / elapsed if elapsed else 0.0
+            print(
+                f"\r{self.sent / MIB:,.0f}/{self.size / MIB:,.0f} MiB ({rate:,.1f} MiB/s)",
+                end="",
+                file=sys.stderr,
+                flush=True,
+            )
+
+
+def resolve_stack(stack_name: str, region: str | None) -> dict[str, str]:
+    """Return the source bucket and ad offset tag key of a deployed stack."""
+    import boto3
+
+    stack = boto3.client("cloudformation", region_name=region).describe_stacks(
+        StackName=stack_name
+    )["Stacks"][0]
+    outputs = {output["OutputKey"]: output["OutputValue"] for output in stack.get("Outputs", [])}
+    parameters = {
+        parameter["ParameterKey"]: parameter.get("ParameterValue", "")
+        for parameter in stack.get("Parameters", [])
+    }
+    return {
+        "bucket": outputs["VideoSourceBucket"],
+        "tag_key": parameters.get("AdOffsetS3TagKeyName") or "AdOffsets",
+    }
+
+
+def upload(args: argparse.Namespace) -> dict[str, Any]:
+    """Upload the file with its tags and return the upload details."""
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+
+    size = args.file.stat().st_size
+    part_size = get_part_size(size, args.part_size * MIB)
+    config = TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=args.concurrency,
+    )
+    extra_args = {"Tagging": args.tagging}
+    if args.content_type:
+        extra_args["ContentType"] = args.content_type
+
+    progress = Progress(size)
+    s3 = boto3.client("s3", region_name=args.region)
+    s3.upload_file(
+        str(args.file),
+        args.bucket,
+        args.key,
+        ExtraArgs=extra_args,
+        Config=config,
+        Callback=progress,
+    )
+    print(file=sys.stderr)
+
+    elapsed = time.perf_counter() - progress.start
+    return {
+        "Location": f"s3://{args.bucket}/{args.key}",
+        "Size": size,
+        "Parts": -(-size // part_size) if size >= part_size else 1,
+        "PartSize": part_size,
+        "Seconds": round(elapsed, 1),
+        "MiBPerSecond": round(size / MIB / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse and validate command line arguments before anything is uploaded."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("file", type=Path, help="video file to upload")
+    parser.add_argument("--stack-name", help="look up the source bucket and ad offset tag key")
+    parser.add_argument("--bucket", help="source bucket to upload to")
+    parser.add_argument("--key", help="object key (default: the file name)")
+    parser.add_argument("--region", help="AWS region of the bucket")
+    parser.add_argument("--ad-offsets", help='ad break offsets in milliseconds, e.g. "30000 90000"')
+    parser.add_argument("--tag-key", help="tag key for the ad offsets (default: AdOffsets)")
+    parser.add_argument(
+        "--tag",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="additional object tag, may be repeated",
+    )
+    parser.add_argument(
+        "--part-size",
+        type=int,
+        default=64,
+        help="multipart part size in MiB, also the multipart threshold (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=10,
+        help="parts uploaded in parallel (default: %(default)s)",
+    )
+    parser.add_argument("--content-type", help="Content-Type of the object")
+    args = parser.parse_args()
+
+    if not args.file.is_file():
+        parser.error(f"{args.file} is not a file")
+    if args.stack_name:
+        stack = resolve_stack(args.stack_name, args.region)
+        args.bucket = args.bucket or stack["bucket"]
+        args.tag_key = args.tag_key or stack["tag_key"]
+    if not args.bucket:
+        parser.error("--stack-name or --bucket is required")
+    args.tag_key = args.tag_key or "AdOffsets"
+    args.key = args.key or args.file.name
+
+    if os.path.splitext(args.key)[1].lower() not in media_convert_job.VIDEO_EXTENSIONS:
+        parser.error(
+            f"{args.key} does not have a video extension, so no job would start "
+            f"({', '.join(sorted(media_convert_job.VIDEO_EXTENSIONS))})"
+        )
+
+    tags = {}
+    for tag in args.tag:
+        key, separator, value = tag.partition("=")
+        if not separator or not key:
+            parser.error(f"--tag {tag} must be KEY=VALUE")
+        tags[key] = value
+    if args.ad_offsets:
+        try:
+            tags[args.tag_key] = " ".join(validate_ad_offsets(args.ad_offsets, args.tag_key))
+        except ValueError as error:
+            parser.error(str(error))
+    try:
+        args.tagging = build_tagging(tags)
+    except ValueError as error:
+        parser.error(str(error))
+    return args
+
+
+def main() -> None:
+    """Upload one file with its tags."""
+    args = parse_args()
+    result = upload(args)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
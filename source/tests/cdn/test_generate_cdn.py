@@ -0,0 +1,125 @@
+"""
+Offline tests of the CloudFront template generated by generate_cdn.py.
+"""
+from __future__ import annotations
+
+import copy
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("troposphere")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "scripts"))
+import generate_cdn  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def template():
+    return generate_cdn.build_template().to_dict()
+
+
+def get_config(template):
+    return template["Resources"]["CloudFrontDistribution"]["Properties"]["DistributionConfig"]
+
+
+def get_behavior(template, pattern):
+    config = get_config(template)
+    if pattern is None:
+        return config["DefaultCacheBehavior"]
+    return next(b for b in config["CacheBehaviors"] if b["PathPattern"] == pattern)
+
+
+def get_cache_key(template, behavior):
+    policy = template["Resources"][behavior["CachePolicyId"]["Ref"]]
+    return policy["Properties"]["CachePolicyConfig"]["ParametersInCacheKeyAndForwardedToOrigin"]
+
+
+def test_template_is_valid(template):
+    assert generate_cdn.validate_template(template) == []
+
+
+def test_path_patterns_are_in_evaluation_order(template):
+    config = get_config(template)
+    assert [b["PathPattern"] for b in config["CacheBehaviors"]] == ["/tm/*", "*.m3u8", "*.mpd"]
+    assert "PathPattern" not in config["DefaultCacheBehavior"]
+
+
+def test_behaviors_target_their_origins(template):
+    config = get_config(template)
+    assert [origin["Id"] for origin in config["Origins"]] == [
+        generate_cdn.MEDIAPACKAGE_ORIGIN,
+        generate_cdn.MEDIATAILOR_ORIGIN,
+    ]
+    assert get_behavior(template, "/tm/*")["TargetOriginId"] == generate_cdn.MEDIATAILOR_ORIGIN
+    for pattern in ("*.m3u8", "*.mpd", None):
+        assert get_behavior(template, pattern)["TargetOriginId"] == generate_cdn.MEDIAPACKAGE_ORIGIN
+
+
+@pytest.mark.parametrize("pattern", ["*.m3u8", "*.mpd"])
+def test_manifests_compress_and_keep_the_manifest_filter(template, pattern):
+    behavior = get_behavior(template, pattern)
+    key = get_cache_key(template, behavior)
+    assert behavior["Compress"] is True
+    assert key["EnableAcceptEncodingGzip"] is True
+    assert key["QueryStringsConfig"] == {
+        "QueryStringBehavior": "whitelist",
+        "QueryStrings": ["aws.manifestfilter"],
+    }
+
+
+@pytest.mark.parametrize("pattern", ["/tm/*", None])
+def test_segments_and_ads_are_not_compressed_or_keyed_on_query_strings(template, pattern):
+    behavior = get_behavior(template, pattern)
+    key = get_cache_key(template, behavior)
+    assert behavior["Compress"] is False
+    assert key["EnableAcceptEncodingGzip"] is False
+    assert key["EnableAcceptEncodingBrotli"] is False
+    assert key["QueryStringsConfig"] == {"QueryStringBehavior": "none"}
+    assert key["HeadersConfig"] == {"HeaderBehavior": "none"}
+    assert key["CookiesConfig"] == {"CookieBehavior": "none"}
+
+
+def test_origin_shield_is_wired_to_the_condition(template):
+    origin = get_config(template)["Origins"][0]
+    assert origin["OriginShield"] == {
+        "Enabled": {"Fn::If": ["UseOriginShield", True, False]},
+        "OriginShieldRegion": {
+            "Fn::If": [
+                "UseOriginShield",
+                {"Ref": "OriginShieldRegion"},
+                {"Ref": "AWS::NoValue"},
+            ]
+        },
+    }
+    assert template["Conditions"]["UseOriginShield"] == {
+        "Fn::Not": [{"Fn::Equals": [{"Ref": "OriginShieldRegion"}, ""]}]
+    }
+
+
+def test_origin_shield_without_the_condition_is_rejected(template):
+    broken = copy.deepcopy(template)
+    get_config(broken)["Origins"][0]["OriginShield"] = {"Enabled": False}
+    assert generate_cdn.validate_template(broken) == [
+        "The MediaPackage origin Origin Shield is not switched by UseOriginShield"
+    ]
+
+
+def test_compressed_segments_are_rejected(template):
+    broken = copy.deepcopy(template)
+    get_behavior(broken, None)["Compress"] = True
+    errors = generate_cdn.validate_template(broken)
+    assert "Behavior default compresses media segments" in errors
+
+
+def test_committed_template_is_valid_and_current():
+    committed = generate_cdn.load_template()
+    assert generate_cdn.validate_template(committed) == []
+    ttls = generate_cdn.get_template_ttls(committed)
+    assert generate_cdn.build_template(*ttls).to_yaml() == generate_cdn.OUTPUT_FILE.read_text()
+
+
+def test_ttls_are_read_back_from_the_template():
+    template = generate_cdn.build_template(manifest_ttl=30, segment_ttl=604800).to_dict()
+    assert generate_cdn.get_template_ttls(template) == (30, 604800)
@@ -0,0 +1,53 @@
+"""
+Tests for the AWS API rate governor.
+"""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "layers" / "fast_common"))
+from fast_common import governor  # noqa: E402
+
+
+class ExhaustedServiceStore:
+    """Bucket store whose service bucket never refills."""
+
+    def __init__(self):
+        self.taken: list[str] = []
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        if "." not in key:
+            return 10.0
+        self.taken.append(key)
+        return 0.0
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(governor.time, "sleep", lambda seconds: None)
+
+
+def test_operation_bucket_is_used_after_service_bucket_gives_up():
+    store = ExhaustedServiceStore()
+    rate_governor = governor.RateGovernor(
+        {"mediatailor": (10, 20), "mediatailor.CreateProgram": (5, 10)}, store
+    )
+
+    waited = rate_governor.acquire("mediatailor", "CreateProgram")
+
+    assert waited == governor.MAX_WAIT_SECONDS
+    assert store.taken == ["mediatailor.CreateProgram"]
+
+
+def test_memory_store_spaces_calls_past_the_burst():
+    rate_governor = governor.RateGovernor(
+        {"mediatailor.CreateProgram": (5, 2)}, governor.MemoryBucketStore()
+    )
+
+    waits = [rate_governor.acquire("mediatailor", "CreateProgram") for _ in range(3)]
+
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] > 0
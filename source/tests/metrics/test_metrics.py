@@ -0,0 +1,65 @@
+"""
+Tests for the AWS API call metrics hooks.
+"""
+from __future__ import annotations
+
+import json
+import socket
+import sys
+import time
+from pathlib import Path
+
+import boto3
+import pytest
+from botocore.config import Config
+from botocore.exceptions import EndpointConnectionError
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "layers" / "fast_common"))
+from fast_common import metrics  # noqa: E402
+
+
+def get_closed_port() -> int:
+    """Return a local port with nothing listening on it."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.format_metrics()
+    yield
+    metrics.format_metrics()
+
+
+def test_connection_error_is_raised_and_counted():
+    client = metrics.instrument(boto3.client(
+        "s3",
+        region_name="us-east-1",
+        endpoint_url=f"http://127.0.0.1:{get_closed_port()}",
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+        config=Config(retries={"max_attempts": 1}, connect_timeout=1),
+    ))
+
+    with pytest.raises(EndpointConnectionError):
+        client.list_buckets()
+
+    documents = [json.loads(line) for line in metrics.format_metrics()]
+    assert len(documents) == 1
+    assert documents[0]["Service"] == "s3"
+    assert documents[0]["Operation"] == "ListBuckets"
+    assert documents[0]["ApiCalls"] == 1
+    assert documents[0]["ApiErrors"] == 1
+    assert len(documents[0]["ApiLatency"]) == 1
+
+
+def test_latencies_are_split_across_documents():
+    for _ in range(metrics.MAX_VALUES + 1):
+        context = {"metrics_start": time.perf_counter()}
+        metrics._after_call_error("s3", context, event_name="after-call-error.s3.GetObject")
+
+    documents = [json.loads(line) for line in metrics.format_metrics()]
+    assert [len(document["ApiLatency"]) for document in documents] == [metrics.MAX_VALUES, 1]
+    assert documents[0]["ApiCalls"] == metrics.MAX_VALUES + 1
+    assert "ApiCalls" not in documents[1]